@@ -0,0 +1,51 @@
+import time
+import asyncio
+import logging
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadBackpressure:
+    """
+    Pauses page crawling while Celery workers are behind: when the broker queue
+    (a Redis list of batch messages) reaches `high` messages, crawl workers wait
+    until it drains to `low`, so broker memory stays bounded however long the crawl is.
+    Queue length is read at most once per `check_interval` seconds.
+    """
+
+    def __init__(self, redis_client: redis.Redis, queue: str, high: int, low: int, check_interval: float = 1):
+        self.redis = redis_client
+        self.queue = queue
+        self.high = high
+        self.low = min(low, high)
+        self.check_interval = check_interval
+        self.depth = 0
+        self.throttled = False
+        self._checked_at = 0.0
+
+    def check(self) -> bool:
+        """True while crawling must wait, with hysteresis between the watermarks."""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return self.throttled
+        self._checked_at = now
+        try:
+            self.depth = self.redis.llen(self.queue)
+        except redis.RedisError as ex:
+            logger.error(f"Error while reading download queue length: {str(ex)}")
+            return self.throttled
+
+        if not self.throttled and self.depth >= self.high:
+            logger.info(f"Download queue has {self.depth} batches, crawling is paused")
+            self.throttled = True
+        elif self.throttled and self.depth <= self.low:
+            logger.info(f"Download queue has {self.depth} batches, crawling is resumed")
+            self.throttled = False
+        return self.throttled
+
+    async def wait(self, shared_data):
+        """Returns when downloads caught up or crawling is stopped."""
+        while shared_data["running"] and self.check():
+            await asyncio.sleep(self.check_interval)
@@ -0,0 +1,66 @@
+"""
+Micro-benchmark of image keyword matching: the old per-image re.sub/set
+implementation against the precompiled KeywordMatcher.
+
+    python benchmarks/bench_keyword_matcher.py
+"""
+import os
+import re
+import sys
+import random
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))  # add project dir to import our modules
+
+from keyword_matcher import KeywordMatcher  # noqa: E402
+
+
+def legacy_find_keyword(keywords: set[str], alt: str, title: str, filename: str) -> set:
+    """Crawler.image_find_keyword before the matcher, kept here for comparison."""
+    alt = alt.lower()
+    title = title.lower()
+
+    alt = re.sub(r"[^a-zA-Z0-9\s]+", " ", alt)
+    title = re.sub(r"[^a-zA-Z0-9\s]+", " ", title)
+    filename = re.sub(r"[^a-zA-Z0-9\s]+", " ", filename)
+
+    alt_matches = set(alt.split(" ")).intersection(set(keywords))
+    title_matches = set(title.split(" ")).intersection(set(keywords))
+    filename_matches = set(filename.split(" ")).intersection(set(keywords))
+
+    return alt_matches.union(title_matches).union(filename_matches)
+
+
+def make_images(count: int, words: list[str]) -> list[tuple[str, str, str]]:
+    rnd = random.Random(42)
+    return [
+        (
+            " ".join(rnd.choices(words, k=8)),
+            " ".join(rnd.choices(words, k=4)),
+            "_".join(rnd.choices(words, k=3)) + f"_{i}",
+        )
+        for i in range(count)
+    ]
+
+
+def main():
+    vocabulary = [f"word{i}" for i in range(10000)]
+    images = make_images(500, vocabulary)  # a few image heavy pages
+
+    for keywords_count in (3, 100, 2000):
+        keywords = set(vocabulary[:keywords_count])
+        matcher = KeywordMatcher(keywords, plurals=False)
+
+        legacy = timeit.timeit(
+            lambda: [legacy_find_keyword(keywords, *image) for image in images], number=20
+        )
+        compiled = timeit.timeit(lambda: [matcher.match(*image) for image in images], number=20)
+        per_image = 1_000_000 / (20 * len(images))
+        print(
+            f"{keywords_count:>4} keywords: legacy {legacy * per_image:7.2f} us/image, "
+            f"matcher {compiled * per_image:7.2f} us/image, speedup x{legacy / compiled:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+"""
+End-to-end benchmark of the crawling pipeline against a local synthetic website,
+no internet, Redis or Celery broker needed.
+
+A fake web server (separate process, so its CPU does not count) serves `--pages`
+HTML pages linking to `--fanout` other pages and showing `--images-per-page` images
+from a pool of `--images` generated images (formats and sizes are configurable,
+some of them are too small and must be rejected). `--latency` and `--error-rate`
+inject response delay and HTTP 500 errors, the same for every run with the same `--seed`.
+
+The real `Crawler` crawls the site and its image batches go to the real
+`tasks.download_and_store` (the body of the Celery task) in a thread pool instead of
+the broker, every batch is counted as a broker message. `--pipeline local` runs
+the single node mode, images are downloaded in the crawler process. Redis is a fakeredis
+TCP server in another process unless `--redis-url` is given. Results (pages/s, images/s, CPU, peak RSS, messages) are
+printed and saved as JSON; `--compare` prints the change against older results.
+
+    python benchmarks/bench_pipeline.py --pages 300 --latency 20
+    python benchmarks/bench_pipeline.py --compare benchmarks/results/pipeline_1a2b3c4.json
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import subprocess
+import urllib.request
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))  # add project dir to import our modules
+
+KEYWORD = "cat"
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+CONTENT_TYPES = {"jpg": "image/jpeg", "png": "image/png", "gif": "image/gif"}
+
+
+# ---- Synthetic website ----
+class FakeSite:
+    """Pages and images of the synthetic website, generated from the seed."""
+
+    def __init__(self, args):
+        self.args = args
+        self.pages = args.pages
+        rnd = random.Random(args.seed)
+        self.links = [rnd.sample(range(self.pages), min(args.fanout, self.pages)) for _ in range(self.pages)]
+        self.page_images = [
+            rnd.sample(range(args.images), min(args.images_per_page, args.images)) for _ in range(self.pages)
+        ]
+        self.image_kinds = [(rnd.choice(args.formats), rnd.choice(args.sizes)) for _ in range(args.images)]
+        self._images: dict[int, bytes] = {}
+        self._lock = threading.Lock()
+
+    def is_error(self, path: str) -> bool:
+        return random.Random(f"{self.args.seed}:{path}").random() < self.args.error_rate
+
+    def page(self, page_id: int) -> bytes:
+        links = "\n".join(
+            f'<a href="/page/{link}">{KEYWORD} page {link}</a>' for link in self.links[page_id]
+        )
+        images = "\n".join(
+            f'<img src="/img/{image_id}.{self.image_kinds[image_id][0]}" alt="{KEYWORD} photo {image_id}">'
+            for image_id in self.page_images[page_id]
+        )
+        filler = "<p>" + "lorem ipsum dolor sit amet " * 40 + "</p>\n"
+        return (
+            f"<html><head><title>Page {page_id}</title></head><body>\n"
+            f"<h1>{KEYWORD} page {page_id}</h1>\n{filler * 5}{images}\n{links}\n</body></html>"
+        ).encode()
+
+    def image(self, image_id: int) -> bytes:
+        """Random blocks scaled up: compressible, but every image has a different perceptual hash."""
+        with self._lock:
+            if image_id not in self._images:
+                from PIL import Image
+
+                image_format, (width, height) = self.image_kinds[image_id]
+                rnd = random.Random(f"{self.args.seed}:img:{image_id}")
+                blocks = Image.frombytes("RGB", (16, 12), rnd.randbytes(16 * 12 * 3))
+                img = blocks.resize((width, height), Image.NEAREST)
+                if image_format == "gif":
+                    img = img.convert("P")
+                data = io.BytesIO()
+                img.save(data, {"jpg": "JPEG", "png": "PNG", "gif": "GIF"}[image_format])
+                self._images[image_id] = data.getvalue()
+            return self._images[image_id]
+
+
+def serve_site(args, port_queue):
+    site = FakeSite(args)
+    stats = {"pages": 0, "images": 0, "errors": 0, "bytes": 0}
+    stats_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+
+        def do_GET(self):
+            if self.path == "/__stats":
+                return self.send(200, "application/json", json.dumps(stats).encode())
+            time.sleep(args.latency / 1000)
+            kind, _, name = self.path.strip("/").partition("/")
+            try:
+                if site.is_error(self.path):
+                    self.count("errors", 0)
+                    return self.send(500, "text/plain", b"injected error")
+                if kind == "page":
+                    body = site.page(int(name))
+                    self.count("pages", len(body))
+                    return self.send(200, "text/html; charset=utf-8", body)
+                if kind == "img":
+                    image_id, _, image_format = name.partition(".")
+                    body = site.image(int(image_id))
+                    self.count("images", len(body))
+                    return self.send(200, CONTENT_TYPES[image_format], body)
+            except (ValueError, IndexError, KeyError):
+                pass
+            self.send(404, "text/plain", b"not found")
+
+        def count(self, name: str, size: int):
+            with stats_lock:
+                stats[name] += 1
+                stats["bytes"] += size
+
+        def send(self, status: int, content_type: str, body: bytes):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def serve_redis(port_queue):
+    from fakeredis import TcpFakeServer
+
+    server = TcpFakeServer(("127.0.0.1", 0))
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+# ---- Pipeline ----
+class CountingTask:
+    """Stands in for the Celery task: counts messages and runs batches in a thread pool like workers do."""
+
+    def __init__(self, executor: ThreadPoolExecutor):
+        from tasks import download_and_store
+
+        self.download_and_store = download_and_store
+        self.executor = executor
+        self.futures = []
+        self.messages = 0
+        self.message_bytes = 0
+
+    def delay(self, images):
+        self.messages += 1
+        self.message_bytes += len(json.dumps(images))
+        self.futures.append(self.executor.submit(self.download_and_store, images))
+
+
+def usage() -> dict:
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)  # parser processes, after they exited
+    return {
+        "cpu": own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime,
+        "peak_rss_mb": own.ru_maxrss / 1024,
+        "children_peak_rss_mb": children.ru_maxrss / 1024,
+    }
+
+
+def bench_env(args, work_dir: str) -> dict:
+    return {
+        "SAVE_IMAGES_PATH": os.path.join(work_dir, "images"),
+        "IMAGES_BLOBS_PATH": os.path.join(work_dir, "blobs"),
+        "CRAWLER_RESPECT_ROBOTS": "false",
+        "CRAWLER_PERSIST_STATE": "false",
+        "CRAWLER_PAGE_CACHE": "false",
+        "CRAWLER_SHARDS": "1",
+        "CRAWLER_MAX_DEPTH": str(args.pages),
+        "CRAWLER_MAX_PAGES_PER_HOST": "0",
+        # one local host, politeness limits would measure the rate limiter
+        "CRAWLER_HOST_RATE": "1000000",
+        "CRAWLER_HOST_BURST": "1000000",
+        "CRAWLER_PER_HOST_CONCURRENCY": str(args.crawler_workers),
+        "CRAWLER_WORKERS": str(args.crawler_workers),
+        "CRAWLER_CONCURRENCY": str(args.crawler_workers),
+        "CRAWLER_PARSE_PROCESSES": str(args.parse_processes),
+        "CRAWLER_HTTP2": "false",
+        "IMAGE_DOWNLOAD_TIMEOUT": "30",
+        "IMAGE_PIPELINE": args.pipeline,
+        "IMAGE_PIPELINE_PROCESSES": str(args.image_workers),
+    }
+
+
+def run_pipeline(args, base_url: str) -> dict:
+    import redis
+
+    import tasks
+    import crawler
+    import metrics
+    from metrics import get_metrics
+
+    # shared by processes of the pipeline (image pipeline store processes are forked with it)
+    redis_client = redis.Redis.from_url(args.redis_url)
+    redis_client.flushdb()
+    crawler.redis_client = tasks.redis_client = tasks.url_cache.redis = get_metrics().redis = redis_client
+    metrics.redis_client = redis_client  # metrics of forked store processes
+
+    executor = ThreadPoolExecutor(args.image_workers)
+    c = crawler.Crawler([KEYWORD], "")
+    c.urls = [f"{base_url}/page/0"]
+    c.seed_urls = set(c.urls)
+    task = c.dispatcher.task = CountingTask(executor)
+
+    started_at = time.perf_counter()
+    asyncio.run(c.start_crawling({"running": True}))
+    crawled_at = time.perf_counter()
+    for future in task.futures:
+        future.result()
+    finished_at = time.perf_counter()
+    executor.shutdown()
+    c.manager.shutdown()
+
+    saved = int(redis_client.get("saved_images_count") or 0)
+    return {
+        "pages": c.visited_count,
+        "images_saved": saved,
+        "broker_messages": task.messages,
+        "broker_bytes": task.message_bytes,
+        "crawl_seconds": crawled_at - started_at,
+        "total_seconds": finished_at - started_at,
+        "pages_per_second": c.visited_count / (crawled_at - started_at),
+        "images_per_second": saved / (finished_at - started_at),
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(__file__), stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(result: dict, old_path: str):
+    with open(old_path) as f:
+        old = json.load(f)
+    print(f"\nCompared to {old_path} ({old.get('revision')}):")
+    for name in ("pages_per_second", "images_per_second", "cpu_seconds", "peak_rss_mb", "broker_messages"):
+        before, after = old["results"].get(name), result["results"].get(name)
+        if before:
+            print(f"  {name:>18}: {before:10.2f} -> {after:10.2f} ({(after - before) / before * 100:+.1f}%)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--fanout", type=int, default=8, help="links on every page")
+    parser.add_argument("--images", type=int, default=300, help="distinct images on the site")
+    parser.add_argument("--images-per-page", type=int, default=10)
+    parser.add_argument("--formats", default="jpg,png,gif", type=lambda value: value.split(","))
+    parser.add_argument(
+        "--sizes", default="800x600,400x300,100x100",
+        type=lambda value: [tuple(map(int, size.split("x"))) for size in value.split(",")],
+        help="image sizes, default includes too small images",
+    )
+    parser.add_argument("--latency", type=float, default=0, help="response delay, ms")
+    parser.add_argument("--error-rate", type=float, default=0, help="part of responses with HTTP 500")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--crawler-workers", type=int, default=20)
+    parser.add_argument("--parse-processes", type=int, default=2)
+    parser.add_argument("--image-workers", type=int, default=4, help="threads standing in for Celery workers")
+    parser.add_argument(
+        "--pipeline", choices=("celery", "local"), default="celery",
+        help="images sent in batches to Celery workers or downloaded in the crawler process (IMAGE_PIPELINE)",
+    )
+    parser.add_argument("--redis-url", help="real Redis instead of fakeredis server, the database is flushed")
+    parser.add_argument("--output", help="results JSON, default benchmarks/results/pipeline_<revision>.json")
+    parser.add_argument("--compare", help="older results JSON")
+    parser.add_argument("--verbose", action="store_true", help="show pipeline logs")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    # injected errors would flood the output
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve_site, args=(args, port_queue), daemon=True)
+    server.start()
+    base_url = f"http://127.0.0.1:{port_queue.get(timeout=10)}"
+    redis_server = None
+    if args.redis_url is None:
+        redis_server = multiprocessing.Process(target=serve_redis, args=(port_queue,), daemon=True)
+        redis_server.start()
+        args.redis_url = f"redis://127.0.0.1:{port_queue.get(timeout=10)}"
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.environ.update(bench_env(args, work_dir))
+        usage_before = usage()
+        results = run_pipeline(args, base_url)
+        usage_after = usage()
+
+    with urllib.request.urlopen(f"{base_url}/__stats") as response:
+        served = json.load(response)
+    server.terminate()
+    if redis_server is not None:
+        redis_server.terminate()
+
+    results["cpu_seconds"] = usage_after["cpu"] - usage_before["cpu"]
+    results["cpu_utilization"] = results["cpu_seconds"] / results["total_seconds"]
+    results["peak_rss_mb"] = usage_after["peak_rss_mb"]
+    results["parser_peak_rss_mb"] = usage_after["children_peak_rss_mb"]
+    revision = git_revision()
+    report = {
+        "benchmark": "pipeline",
+        "revision": revision,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "params": {
+            name: value for name, value in vars(args).items()
+            if name not in ("output", "compare", "redis_url", "verbose")
+        },
+        "served": served,
+        "results": results,
+    }
+
+    for name, value in results.items():
+        print(f"{name:>20}: {value:.2f}" if isinstance(value, float) else f"{name:>20}: {value}")
+    print(f"{'served':>20}: {served}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"pipeline_{revision}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved to {output}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,7 @@ import logging
 
 import redis
 from aiogram import Bot, Dispatcher, F
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.types import (
     Message,
     ReplyKeyboardMarkup,
@@ -16,6 +16,9 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 
 from config import config
+from crawler import Crawler
+from metrics import read_summary
+from quotas import KeywordQuotas
 
 API_TOKEN = config.API_TOKEN
 
@@ -32,6 +35,7 @@ logger = logging.getLogger(__name__)
 bot = Bot(token=API_TOKEN)
 dp = Dispatcher()
 redis_client = redis.Redis("redis")
+quotas = KeywordQuotas(redis_client)
 
 # Variables storing main keywords and additional text
 global_keywords = set([])
@@ -57,6 +61,7 @@ kb_main = ReplyKeyboardMarkup(
     keyboard=[
         [KeyboardButton(text="Keywords"), KeyboardButton(text="Additional text")],
         [KeyboardButton(text="Start Search"), KeyboardButton(text="Stop Search")],
+        [KeyboardButton(text="Stats")],
     ],
     resize_keyboard=True,
 )
@@ -105,7 +110,10 @@ async def cmd_start(message: Message):
             "1) Keywords - view and modify keywords\n"
             "2) Additional text - view and modify additional text\n"
             "3) Start Search - start the search\n"
-            "4) Stop Search - stop the search"
+            "4) Stop Search - stop the search\n"
+            "5) Stats - crawling and downloading progress\n\n"
+            "/quota 100 - stop searching a keyword when it has 100 new images "
+            "(/quota cat 100 - for one keyword, /quota - show quotas)"
         ),
         reply_markup=kb_main,
     )
@@ -195,6 +203,128 @@ async def process_remove_keyword(message: Message, state: FSMContext):
     await state.clear()
 
 
+# ---- Search (buttons "Start Search" and "Stop Search") ----
+@dp.message(F.text.lower() == "start search")
+async def start_search_button(message: Message):
+    """
+    Starts crawling for current keywords and additional text.
+    """
+    global crawler
+    if not global_keywords:
+        await message.answer("There are no keywords. Add keywords before starting the search.", reply_markup=kb_main)
+        return
+    # processes of a crawl which finished by itself (every quota met) are not alive
+    if crawler is not None and any(process.is_alive() for process in crawler.parsing_processes):
+        await message.answer("Search is already running.", reply_markup=kb_main)
+        return
+
+    crawler = Crawler(list(global_keywords), global_additional_text)
+    await asyncio.to_thread(crawler.start_parsing)
+    await message.answer(
+        f"Search started for: <b>{', '.join(sorted(global_keywords))}</b>",
+        parse_mode="html",
+        reply_markup=kb_main,
+    )
+
+
+@dp.message(F.text.lower() == "stop search")
+async def stop_search_button(message: Message):
+    """
+    Stops crawling, waits for crawling processes to finish.
+    """
+    if crawler is None:
+        await message.answer("Search is not running.", reply_markup=kb_main)
+        return
+    await asyncio.to_thread(crawler.stop_parsing)
+    await message.answer("Search stopped.", reply_markup=kb_main)
+
+
+# ---- Keyword quotas (/quota command) ----
+def format_quotas(progress: dict[str, tuple[int, int | None]]) -> str:
+    lines = [
+        f"{keyword}: {saved}/{target}" + (" - done" if saved >= target else "")
+        for keyword, (saved, target) in sorted(progress.items())
+        if target is not None
+    ]
+    return "Image quotas:\n" + "\n".join(lines) if lines else "There are no quotas."
+
+
+@dp.message(Command("quota"))
+async def set_quota(message: Message, command: CommandObject):
+    """
+    /quota <count> sets target image count for every keyword, /quota <keyword> <count> for one keyword,
+    /quota shows saved images of keywords. Search of a keyword stops when it has the target count,
+    the whole search finishes when every keyword has.
+    """
+    args = (command.args or "").strip().lower()
+    if not args:
+        progress = await asyncio.to_thread(quotas.progress)
+        await message.answer(format_quotas(progress), reply_markup=kb_main)
+        return
+
+    keyword, _, count = args.rpartition(" ")
+    if not count.isdigit():
+        await message.answer("Usage: /quota 100 or /quota cat 100", reply_markup=kb_main)
+        return
+    keywords = [keyword.strip()] if keyword.strip() else sorted(global_keywords)
+    if not keywords:
+        await message.answer("There are no keywords.", reply_markup=kb_main)
+        return
+
+    for keyword in keywords:
+        await asyncio.to_thread(quotas.set_target, keyword, int(count))
+    target = f"{count} new images" if int(count) > 0 else "no limit"
+    await message.answer(
+        f"Quota of <b>{', '.join(keywords)}</b>: {target}.",
+        parse_mode="html",
+        reply_markup=kb_main,
+    )
+
+
+# ---- Crawl statistics (button "Stats" is pressed) ----
+def format_size(size: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def format_stats(summary: dict) -> str:
+    lines = [
+        f"Pages crawled: <b>{summary['pages']:.0f}</b> ({summary['pages_per_second']:.1f}/s)",
+        f"Pages in queue: <b>{summary['queue_depth']:.0f}</b>",
+        f"Average page fetch: {summary['fetch_avg_seconds'] * 1000:.0f} ms, downloaded {format_size(summary['page_bytes'])}",
+        f"Images found: <b>{summary['images_found']:.0f}</b>",
+        f"Images downloaded: <b>{summary['images_downloaded']:.0f}</b> ({format_size(summary['images_bytes'])}), "
+        f"from url cache: {summary['images_cached']:.0f}",
+        f"Images saved: <b>{summary['images_saved']}</b>",
+    ]
+    for title, values in (("Fetch errors", summary["fetch_errors"]), ("Rejected images", summary["images_rejected"])):
+        if values:
+            details = ", ".join(f"{reason}: {count:.0f}" for reason, count in sorted(values.items()))
+            lines.append(f"{title}: {details}")
+    if summary["top_hosts"]:
+        lines.append("Top hosts:")
+        lines.extend(f"  {host}: {count:.0f}" for host, count in summary["top_hosts"])
+    return "\n".join(lines)
+
+
+@dp.message(Command("stats"))
+@dp.message(F.text.lower() == "stats")
+async def show_stats(message: Message):
+    """
+    Displays crawling and downloading metrics.
+    """
+    try:
+        summary = await asyncio.to_thread(read_summary, redis_client)
+    except redis.RedisError as ex:
+        logger.error(f"Error while reading metrics: {str(ex)}")
+        await message.answer("Statistics are not available now.", reply_markup=kb_main)
+        return
+    await message.answer(format_stats(summary), parse_mode="html", reply_markup=kb_main)
+
+
 # ---- Entry point for the bot ----
 async def main():
     await dp.start_polling(bot)
@@ -27,13 +27,218 @@ class Config:
     def SERVER_PORT(self):
         return os.getenv("SERVER_PORT", 0)
     
+    @property
+    def SERVER_WORKERS(self):
+        return int(os.getenv("SERVER_WORKERS", 2))
+
+    @property
+    def SERVER_THREADS(self):
+        return int(os.getenv("SERVER_THREADS", 16))
+
+    @property
+    def SERVER_LOCK_PATH(self):
+        return os.getenv("SERVER_LOCK_PATH", "images_export.lock")
+
     @property
     def SAVE_IMAGES_PATH(self):
         return os.getenv("SAVE_IMAGES_PATH", "images")
     
+    @property
+    def IMAGES_BLOBS_PATH(self):
+        return os.getenv("IMAGES_BLOBS_PATH", "image_blobs")
+
     @property
     def IMAGES_ARCHIVE_NAME(self):
         return os.getenv("IMAGES_ARCHIVE_NAME", "images")
 
+    @property
+    def IMAGES_BATCH_SIZE(self):
+        # a prefork Celery process downloads one batch at a time, a full batch uses every download slot
+        return int(os.getenv("IMAGES_BATCH_SIZE", self.IMAGE_DOWNLOAD_CONCURRENCY))
+
+    @property
+    def IMAGES_BATCH_INTERVAL(self):
+        return float(os.getenv("IMAGES_BATCH_INTERVAL", 2))
+
+    @property
+    def IMAGE_DOWNLOAD_CONCURRENCY(self):
+        return int(os.getenv("IMAGE_DOWNLOAD_CONCURRENCY", 200))
+
+    @property
+    def IMAGE_DOWNLOAD_TIMEOUT(self):
+        return float(os.getenv("IMAGE_DOWNLOAD_TIMEOUT", 5))
+
+    @property
+    def IMAGE_MAX_BYTES(self):
+        return int(os.getenv("IMAGE_MAX_BYTES", 20 * 1024 * 1024))
+
+    @property
+    def IMAGE_MIN_BYTES(self):
+        return int(os.getenv("IMAGE_MIN_BYTES", 1024))
+
+    @property
+    def IMAGE_MIN_SIZE(self):
+        return int(os.getenv("IMAGE_MIN_SIZE", 240))
+
+    @property
+    def IMAGE_PHASH_DEDUP(self):
+        return os.getenv("IMAGE_PHASH_DEDUP", "true").lower() in ("1", "true", "yes")
+
+    @property
+    def IMAGE_PHASH_DISTANCE(self):
+        return int(os.getenv("IMAGE_PHASH_DISTANCE", 6))
+
+    @property
+    def IMAGE_URL_CACHE_TTL(self):
+        return int(os.getenv("IMAGE_URL_CACHE_TTL", 7 * 24 * 3600))
+
+    @property
+    def IMAGE_URL_CACHE_REVALIDATE(self):
+        return int(os.getenv("IMAGE_URL_CACHE_REVALIDATE", 24 * 3600))
+
+    @property
+    def IMAGES_QUEUE_HIGH_WATERMARK(self):
+        return int(os.getenv("IMAGES_QUEUE_HIGH_WATERMARK", 1000))
+
+    @property
+    def IMAGES_QUEUE_LOW_WATERMARK(self):
+        return int(os.getenv("IMAGES_QUEUE_LOW_WATERMARK", 200))
+
+    @property
+    def IMAGES_QUEUE_CHECK_INTERVAL(self):
+        return float(os.getenv("IMAGES_QUEUE_CHECK_INTERVAL", 1))
+
+    @property
+    def IMAGE_PIPELINE(self):
+        return os.getenv("IMAGE_PIPELINE", "celery")
+
+    @property
+    def IMAGE_PIPELINE_QUEUE_SIZE(self):
+        return int(os.getenv("IMAGE_PIPELINE_QUEUE_SIZE", 1000))
+
+    @property
+    def IMAGE_PIPELINE_PROCESSES(self):
+        return int(os.getenv("IMAGE_PIPELINE_PROCESSES", os.cpu_count() or 1))
+
+    @property
+    def METRICS_FLUSH_INTERVAL(self):
+        return float(os.getenv("METRICS_FLUSH_INTERVAL", 5))
+
+    @property
+    def KEYWORD_PLURALS(self):
+        return os.getenv("KEYWORD_PLURALS", "true").lower() in ("1", "true", "yes")
+
+    @property
+    def KEYWORD_STEMMING(self):
+        return os.getenv("KEYWORD_STEMMING", "false").lower() in ("1", "true", "yes")
+
+    @property
+    def CRAWLER_WORKERS(self):
+        return int(os.getenv("CRAWLER_WORKERS", 20))
+
+    @property
+    def CRAWLER_CONCURRENCY(self):
+        return int(os.getenv("CRAWLER_CONCURRENCY", 20))
+
+    @property
+    def CRAWLER_MAX_CONNECTIONS(self):
+        return int(os.getenv("CRAWLER_MAX_CONNECTIONS", 100))
+
+    @property
+    def CRAWLER_MAX_KEEPALIVE_CONNECTIONS(self):
+        return int(os.getenv("CRAWLER_MAX_KEEPALIVE_CONNECTIONS", 50))
+
+    @property
+    def CRAWLER_KEEPALIVE_EXPIRY(self):
+        return float(os.getenv("CRAWLER_KEEPALIVE_EXPIRY", 30))
+
+    @property
+    def CRAWLER_HTTP2(self):
+        return os.getenv("CRAWLER_HTTP2", "true").lower() in ("1", "true", "yes")
+
+    @property
+    def CRAWLER_PAGE_CACHE(self):
+        return os.getenv("CRAWLER_PAGE_CACHE", "true").lower() in ("1", "true", "yes")
+
+    @property
+    def CRAWLER_PAGE_CACHE_PATH(self):
+        return os.getenv("CRAWLER_PAGE_CACHE_PATH", "page_cache")
+
+    @property
+    def CRAWLER_PAGE_CACHE_SIZE(self):
+        return int(os.getenv("CRAWLER_PAGE_CACHE_SIZE", 1024 * 1024 * 1024))
+
+    @property
+    def CRAWLER_PARSER(self):
+        return os.getenv("CRAWLER_PARSER", "tokenizer")
+
+    @property
+    def CRAWLER_PARSE_PROCESSES(self):
+        return int(os.getenv("CRAWLER_PARSE_PROCESSES", os.cpu_count() or 1))
+
+    @property
+    def CRAWLER_PER_HOST_CONCURRENCY(self):
+        return int(os.getenv("CRAWLER_PER_HOST_CONCURRENCY", 2))
+
+    @property
+    def CRAWLER_HOST_RATE(self):
+        return float(os.getenv("CRAWLER_HOST_RATE", 2))
+
+    @property
+    def CRAWLER_HOST_BURST(self):
+        return float(os.getenv("CRAWLER_HOST_BURST", 4))
+
+    @property
+    def CRAWLER_MAX_DEPTH(self):
+        return int(os.getenv("CRAWLER_MAX_DEPTH", 5))
+
+    @property
+    def CRAWLER_MAX_PAGES_PER_HOST(self):
+        return int(os.getenv("CRAWLER_MAX_PAGES_PER_HOST", 1000))
+
+    @property
+    def CRAWLER_SEEN_FILTER(self):
+        return os.getenv("CRAWLER_SEEN_FILTER", "bloom")
+
+    @property
+    def CRAWLER_SEEN_CAPACITY(self):
+        return int(os.getenv("CRAWLER_SEEN_CAPACITY", 10_000_000))
+
+    @property
+    def CRAWLER_SEEN_ERROR_RATE(self):
+        return float(os.getenv("CRAWLER_SEEN_ERROR_RATE", 0.001))
+
+    @property
+    def CRAWLER_PERSIST_STATE(self):
+        return os.getenv("CRAWLER_PERSIST_STATE", "true").lower() in ("1", "true", "yes")
+
+    @property
+    def CRAWLER_CHECKPOINT_INTERVAL(self):
+        return float(os.getenv("CRAWLER_CHECKPOINT_INTERVAL", 30))
+
+    @property
+    def CRAWLER_SHARDS(self):
+        return int(os.getenv("CRAWLER_SHARDS", 1))
+
+    @property
+    def CRAWLER_LOCAL_SHARDS(self):
+        return int(os.getenv("CRAWLER_LOCAL_SHARDS", self.CRAWLER_SHARDS))
+
+    @property
+    def CRAWLER_SHARD_FRONTIER_SIZE(self):
+        return int(os.getenv("CRAWLER_SHARD_FRONTIER_SIZE", 1000))
+
+    @property
+    def CRAWLER_SYNC_INTERVAL(self):
+        return float(os.getenv("CRAWLER_SYNC_INTERVAL", 1))
+
+    @property
+    def CRAWLER_RESPECT_ROBOTS(self):
+        return os.getenv("CRAWLER_RESPECT_ROBOTS", "true").lower() in ("1", "true", "yes")
+
+    @property
+    def CRAWLER_ROBOTS_TTL(self):
+        return float(os.getenv("CRAWLER_ROBOTS_TTL", 3600))
+
 
 config = Config()
\ No newline at end of file
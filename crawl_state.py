@@ -0,0 +1,124 @@
+import time
+import hashlib
+import logging
+
+import redis
+
+from seen_filter import BloomFilter, ExactSeenSet
+
+logger = logging.getLogger(__name__)
+
+
+def make_crawl_id(keywords: set[str], text_to_keyword: str) -> str:
+    """The same search (keywords and additional text) continues the same crawl."""
+    search = "|".join(sorted(keywords)) + "|" + text_to_keyword
+    return hashlib.sha1(search.encode()).hexdigest()[:16]
+
+
+class CrawlStateStore:
+    """
+    Keeps crawl frontier (sorted set url -> priority, hash url -> keyword of its branch)
+    and seen filter (bitmap) in Redis, so a stopped crawl can be resumed without refetching pages.
+
+    Frontier changes are buffered and written with one pipeline,
+    seen filter is saved on checkpoint(): whole the first time, then only its changed bytes
+    (a Bloom filter of 10M urls is ~18 MB, a checkpoint writes the bytes of urls added since the previous one).
+    """
+
+    def __init__(self, redis_client: redis.Redis, crawl_id: str, batch_size: int = 500):
+        self.redis = redis_client
+        self.batch_size = batch_size
+        self.frontier_key = f"crawl:{crawl_id}:frontier"
+        self.keywords_key = f"crawl:{crawl_id}:keywords"
+        self.seen_key = f"crawl:{crawl_id}:seen"
+        self.meta_key = f"crawl:{crawl_id}:meta"
+        self._pending = []  # ordered ("add" | "remove", url, depth, priority, keyword)
+        self.last_checkpoint = time.monotonic()
+        self._seen_saved = False  # saved seen filter is the same as in memory up to the changes since the last dump
+
+    @staticmethod
+    def _member(url: str, depth: int) -> str:
+        return f"{depth} {url}"
+
+    def add(self, url: str, priority: float, depth: int, keyword: str | None = None):
+        self._pending.append(("add", url, depth, priority, keyword))
+        self._flush_batch()
+
+    def remove(self, url: str, depth: int):
+        """Url is removed only when it was crawled, so pages in flight are crawled again after resume."""
+        self._pending.append(("remove", url, depth, 0, None))
+        self._flush_batch()
+
+    def _flush_batch(self):
+        if len(self._pending) < self.batch_size:
+            return
+        try:
+            self.flush()
+        except redis.RedisError as ex:
+            # changes stay pending and are written with the next batch
+            logger.error(f"Error while saving crawl frontier: {str(ex)}")
+
+    def flush(self):
+        if not self._pending:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        for op, url, depth, priority, keyword in self._pending:
+            if op == "add":
+                pipe.zadd(self.frontier_key, {self._member(url, depth): priority})
+                if keyword is not None:
+                    pipe.hset(self.keywords_key, url, keyword)
+            else:
+                pipe.zrem(self.frontier_key, self._member(url, depth))
+                pipe.hdel(self.keywords_key, url)
+        pipe.execute()
+        self._pending.clear()
+
+    def checkpoint(self, seen: BloomFilter | ExactSeenSet, visited_count: int):
+        self.flush()
+        changes = seen.dump_changes() if self._seen_saved else None
+        pipe = self.redis.pipeline()
+        if changes is None:
+            pipe.set(self.seen_key, seen.dump())
+        else:
+            for offset, data in changes:
+                pipe.setrange(self.seen_key, offset, data)
+        pipe.hset(self.meta_key, mapping={"seen_count": len(seen), "visited_count": visited_count})
+        try:
+            pipe.execute()
+        except redis.RedisError:
+            self._seen_saved = False  # changes are dropped from memory, the next checkpoint writes the whole filter
+            raise
+        self._seen_saved = True
+        self.last_checkpoint = time.monotonic()
+        logger.info(f"Crawl checkpoint saved, visited {visited_count} pages")
+
+    def exists(self) -> bool:
+        """Crawl was saved: urls left in frontier or only seen urls (frontier was empty at the checkpoint)."""
+        return bool(self.redis.exists(self.frontier_key, self.seen_key))
+
+    def restore(self, seen: BloomFilter | ExactSeenSet) -> int:
+        """Loads saved seen filter, returns visited pages count."""
+        meta = self.redis.hgetall(self.meta_key)
+        seen_data = self.redis.get(self.seen_key)
+        if seen_data is not None:
+            try:
+                seen.load(seen_data, int(meta.get(b"seen_count", 0)))
+                self._seen_saved = True
+            except ValueError as ex:
+                logger.error(f"Could not restore seen urls: {str(ex)}")
+        return int(meta.get(b"visited_count", 0))
+
+    def iter_frontier(self):
+        """Yields (url, priority, depth) of saved frontier."""
+        for member, priority in self.redis.zscan_iter(self.frontier_key, count=1000):
+            depth, url = member.decode().split(" ", 1)
+            yield url, priority, int(depth)
+
+    def url_keywords(self) -> dict[str, str]:
+        """Keywords of branches of saved frontier urls."""
+        return {url.decode(): keyword.decode() for url, keyword in self.redis.hgetall(self.keywords_key).items()}
+
+    def clear(self):
+        self._pending.clear()
+        self._seen_saved = False
+        self.redis.delete(self.frontier_key, self.keywords_key, self.seen_key, self.meta_key)
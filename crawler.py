@@ -1,17 +1,32 @@
 import os
-import re
+import json
+import time
 import asyncio
 import logging
 from urllib.parse import urljoin
 from multiprocessing import Process, Manager
+from concurrent.futures import ProcessPoolExecutor
 
 import httpx
 import redis
-from bs4 import BeautifulSoup
-from bs4.element import PageElement
 
 from celery_app import app
-from tasks import download_image
+from scheduler import HostScheduler, RobotsCache
+from frontier import LinkScorer
+from seen_filter import make_seen_filter
+from crawl_state import CrawlStateStore, make_crawl_id
+from distributed import CRAWL_JOB_KEY, ShardCoordinator, RedisSharedData
+from url_utils import canonicalize_url, get_host
+from parsing import parse_page
+from keyword_matcher import KeywordMatcher
+from tasks import download_images
+from dispatcher import DownloadDispatcher
+from url_cache import ImageUrlCache
+from http_cache import CachingTransport, PageCache
+from metrics import HOST_PAGES_KEY, Metrics, get_metrics
+from image_pipeline import LocalImagePipeline
+from backpressure import DownloadBackpressure
+from quotas import KeywordQuotas
 from config import config
 
 logging.getLogger("httpx").setLevel(logging.ERROR)  # disable httpx INFO logs
@@ -19,8 +34,11 @@ logger = logging.getLogger(__name__)
 redis_client = redis.Redis("redis")
 
 class Crawler:
-    def __init__(self, keywords: list[str], text_to_keyword: str):
+    def __init__(self, keywords: list[str], text_to_keyword: str, shard_id: int = 0):
         self.keywords = set(keywords)
+        self.matcher = KeywordMatcher(
+            self.keywords, plurals=config.KEYWORD_PLURALS, stemming=config.KEYWORD_STEMMING
+        )
 
         # make links pointed to google images by request
         self.text_to_keyword = text_to_keyword.replace(" ", "+")
@@ -28,106 +46,353 @@ class Crawler:
             f"https://www.google.com/search?q={keyword.replace(' ', '+')}+{self.text_to_keyword}&tbm=isch"
             for keyword in self.keywords
         ]
-        self.parsing_process: None | Process = None
+        self.parsing_processes: list[Process] = []
         self.manager = Manager()
         self.shared_data = self.manager.dict()  # -_-
         self.shared_data["running"] = False
 
-        self.visited = set()
-        self.to_visit = set(self.urls)
+        self.seed_urls = {canonicalize_url(url) for url in self.urls}
+        # pages are crawled for the keyword of their seed url, branches of keywords with enough images are dropped
+        self.seed_keywords = {canonicalize_url(url): keyword for url, keyword in zip(self.urls, self.keywords)}
+        self.url_keywords: dict[str, str] = {}  # url in frontier -> keyword of its branch
+        self.quotas = KeywordQuotas(redis_client)
+        self.satisfied: set[str] = set()  # keywords which reached their target image count
+        # every url which was put in frontier, so it is never queued twice
+        self.seen = make_seen_filter(
+            config.CRAWLER_SEEN_FILTER, config.CRAWLER_SEEN_CAPACITY, config.CRAWLER_SEEN_ERROR_RATE
+        )
+        self.visited_count = 0
+        # links of leased hosts, checked against urls queued by other shards in one batch per page
+        self._local_links: list[tuple[str, float, int, str | None]] = []
+        self.crawl_id = make_crawl_id(self.keywords, self.text_to_keyword)
+        self.shards_count = config.CRAWLER_SHARDS
+        self.set_shard(shard_id)
 
         headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
             "Chrome/114.0.0.0 Safari/537.36"
         }
-        self.httpx_client = httpx.AsyncClient(headers=headers)  # , max_redirects=5
+        limits = httpx.Limits(
+            max_connections=config.CRAWLER_MAX_CONNECTIONS,
+            max_keepalive_connections=config.CRAWLER_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=config.CRAWLER_KEEPALIVE_EXPIRY,
+        )
+        transport = httpx.AsyncHTTPTransport(limits=limits, http2=config.CRAWLER_HTTP2)
+        if config.CRAWLER_PAGE_CACHE:
+            # repeated crawls get pages from disk or revalidate them with 304
+            transport = CachingTransport(
+                PageCache(config.CRAWLER_PAGE_CACHE_PATH, config.CRAWLER_PAGE_CACHE_SIZE), transport
+            )
+        self.httpx_client = httpx.AsyncClient(headers=headers, transport=transport)  # , max_redirects=5
+
+        # created inside the crawling process, asyncio primitives must belong to its loop
+        self.frontier: None | HostScheduler = None
+        self.fetch_semaphore: None | asyncio.Semaphore = None
+        self.robots: None | RobotsCache = None
+        self.parse_executor: None | ProcessPoolExecutor = None
+        self.image_pipeline: None | LocalImagePipeline = None  # single node mode, images are not sent to Celery
+        self.backpressure: None | DownloadBackpressure = None
+        if config.IMAGE_PIPELINE != "local" and config.IMAGES_QUEUE_HIGH_WATERMARK > 0:
+            broker = redis.Redis.from_url(config.CELERY_BROKER_URL) if config.CELERY_BROKER_URL else redis_client
+            self.backpressure = DownloadBackpressure(
+                broker,
+                app.conf.task_default_queue,
+                high=config.IMAGES_QUEUE_HIGH_WATERMARK,
+                low=config.IMAGES_QUEUE_LOW_WATERMARK,
+                check_interval=config.IMAGES_QUEUE_CHECK_INTERVAL,
+            )
+        self.scorer = LinkScorer(self.keywords)
+        self.dispatcher = DownloadDispatcher(
+            download_images,
+            config.IMAGES_BATCH_SIZE,
+            config.IMAGES_BATCH_INTERVAL,
+            ImageUrlCache(redis_client, config.IMAGE_URL_CACHE_TTL, config.IMAGE_URL_CACHE_REVALIDATE),
+        )
+
+    def set_shard(self, shard_id: int):
+        """
+        Every crawling process runs one shard of the crawl: hosts with hash
+        of this shard, own saved state and links exchange with other shards.
+        """
+        self.shard_id = shard_id
+        state_id = self.crawl_id if self.shards_count == 1 else f"{self.crawl_id}:{shard_id}"
+
+        # frontier and seen urls are saved to redis, the same search continues from the last checkpoint
+        self.state_store: None | CrawlStateStore = None
+        if config.CRAWLER_PERSIST_STATE:
+            self.state_store = CrawlStateStore(redis_client, state_id)
+
+        self.coordinator: None | ShardCoordinator = None
+        if self.shards_count > 1:
+            self.coordinator = ShardCoordinator(redis_client, self.crawl_id, shard_id, self.shards_count)
+
+    def start_shards(self, shared_data, shards_limit: int):
+        shard_ids = [0]
+        if self.coordinator is not None:
+            # all shards are claimed before start, so the first one can't see the crawl finished alone
+            shard_ids = [self.coordinator.claim_shard() for _ in range(shards_limit)]
+            # None when every shard is already crawled by some process
+            shard_ids = [shard_id for shard_id in shard_ids if shard_id is not None]
+
+        for shard_id in shard_ids:
+            process = Process(target=self._run_shard, args=(shard_id, shared_data))
+            process.start()
+            self.parsing_processes.append(process)
 
     def start_parsing(self):
         logger.info("Start Crawling")
         self.shared_data["running"] = True
-        self.parsing_process = Process(
-            target=self._run_async, args=(self.start_crawling, self.shared_data)
-        )
-        self.parsing_process.start()
+        if self.coordinator is None:
+            self.start_shards(self.shared_data, 1)
+            return
+
+        self.coordinator.reset(resume=config.CRAWLER_PERSIST_STATE)
+        self.start_shards(self.shared_data, config.CRAWLER_LOCAL_SHARDS)
+        # crawler nodes take the rest of shards
+        redis_client.hset(CRAWL_JOB_KEY, mapping={
+            "keywords": json.dumps(sorted(self.keywords)),
+            "text_to_keyword": self.text_to_keyword,
+            "started_at": str(time.time()),
+        })
 
     def stop_parsing(self):
-        if self.parsing_process is not None:
+        if self.parsing_processes:
             logger.info("Stop Crawling")
             self.shared_data["running"] = False
-            self.parsing_process.join()
-            app.control.purge()  # clear queue for downloading images
+            if self.coordinator is not None:
+                redis_client.delete(CRAWL_JOB_KEY)
+            for process in self.parsing_processes:
+                process.join()
+            self.parsing_processes = []
+            if config.IMAGE_PIPELINE != "local":
+                app.control.purge()  # clear queue for downloading images
 
-    def image_find_keyword(self, img_tag: PageElement, filename: str) -> set:
-        # Check alt, title or file name
-        alt = img_tag.get("alt", "").lower()
-        title = img_tag.get("title", "").lower()
+    def image_find_keyword(self, alt: str, title: str, filename: str) -> list[str]:
+        # Check alt, title or file name, the best match is the first
+        return self.matcher.match(alt, title, filename)
 
-        # Replace any NOT letters/numbers/spaces with a space
-        alt = re.sub(r"[^a-zA-Z0-9\s]+", " ", alt)
-        title = re.sub(r"[^a-zA-Z0-9\s]+", " ", title)
-        filename = re.sub(r"[^a-zA-Z0-9\s]+", " ", filename)
+    async def fetch_page(self, page_url) -> httpx.Response:
+        """
+        Loads page, the number of requests in flight is limited by fetch_semaphore.
+        """
+        if self.fetch_semaphore is None:
+            return await self.httpx_client.get(page_url, timeout=3, follow_redirects=True)
 
-        alt_matches = set(alt.split(" ")).intersection(set(self.keywords))
-        title_matches = set(title.split(" ")).intersection(set(self.keywords))
-        filename_matches = set(filename.split(" ")).intersection(set(self.keywords))
+        async with self.fetch_semaphore:
+            return await self.httpx_client.get(page_url, timeout=3, follow_redirects=True)
 
-        return alt_matches.union(title_matches).union(filename_matches)
+    async def parse_html(self, html: str, page_url: str = ""):
+        """
+        Parses page in the process pool, so big pages don't block other requests.
+        """
+        if self.parse_executor is None:
+            return parse_page(html, config.CRAWLER_PARSER, page_url)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.parse_executor, parse_page, html, config.CRAWLER_PARSER, page_url)
 
-    async def scrape_images(self, page_url):
-        links = set()
+    async def scrape_images(self, page_url) -> dict[str, str]:
+        """
+        Sends found images to download, returns page links with their anchor text.
+        """
+        links = {}
 
+        started_at = time.monotonic()
         try:
-            response = await self.httpx_client.get(
-                page_url, timeout=3, follow_redirects=True
-            )
+            response = await self.fetch_page(page_url)
             response.raise_for_status()
         except Exception as ex:
             logger.error(f"Error while loading page {page_url}, ex: {str(ex)}, exception class: {ex.__class__}")
+            reason = f"http_{ex.response.status_code}" if isinstance(ex, httpx.HTTPStatusError) else type(ex).__name__
+            self.metrics.inc("crawler_fetch_errors_total", reason=reason)
             return links
+        self.metrics.observe("crawler_fetch_seconds", time.monotonic() - started_at)
+        self.metrics.inc("crawler_page_bytes_total", len(response.content))
 
-        soup = BeautifulSoup(response.text, "html.parser")
-        for img_tag in soup.find_all("img"):
-            src = img_tag.get("src")
-
-            if not src:
-                continue
+        started_at = time.monotonic()
+        images, page_links = await self.parse_html(response.text, page_url)
+        self.metrics.observe("crawler_parse_seconds", time.monotonic() - started_at)
 
+        found_images = 0
+        for src, alt, title in images:
             filename = src.split("/")[-1].lower()
             filename, file_ext = os.path.splitext(filename)
 
-            found_keywords = self.image_find_keyword(img_tag, filename)
+            found_keywords = [
+                keyword for keyword in self.image_find_keyword(alt, title, filename) if keyword not in self.satisfied
+            ]
             if found_keywords:
                 first_found, *_ = found_keywords
+                found_images += 1
                 absolute_src = urljoin(page_url, src)
-                download_image.delay(absolute_src, f"{config.SAVE_IMAGES_PATH}/{first_found}")
+                if self.image_pipeline is not None:
+                    # waits while downloads are behind
+                    await self.image_pipeline.put(absolute_src, f"{config.SAVE_IMAGES_PATH}/{first_found}")
+                else:
+                    self.dispatcher.add(absolute_src, f"{config.SAVE_IMAGES_PATH}/{first_found}")
 
-        for a_tag in soup.find_all("a"):
-            href = a_tag.get("href")
-            if not href:
-                continue
+        for href, anchor_text in page_links:
             abs_url = urljoin(page_url, href)
+            links[abs_url] = f"{links.get(abs_url, '')} {anchor_text}".strip()
 
-            links.add(abs_url)
+        self.scorer.record_page(page_url, found_images)
+        self.metrics.inc("crawler_images_found_total", found_images)
         return links
 
-    async def crawl_site(self, shared_data):
-        while self.to_visit and shared_data["running"]:
-            current_url, *_ = self.to_visit
-            self.to_visit.remove(current_url)
+    async def is_allowed(self, url: str) -> bool:
+        """
+        Checks robots.txt of url host and applies its Crawl-delay to the host queue.
+        """
+        # seed urls are user search requests, not crawled links
+        if self.robots is None or url in self.seed_urls:
+            return True
+
+        allowed, crawl_delay = await self.robots.allowed(url)
+        if crawl_delay:
+            self.frontier.set_crawl_delay(get_host(url), crawl_delay)
+        if not allowed:
+            logger.info(f"Disallowed by robots.txt: {url}")
+        return allowed
+
+    def enqueue(self, url: str, anchor_text: str = "", depth: int = 0, keyword: str | None = None):
+        url = canonicalize_url(url)
+        if url is None or depth > config.CRAWLER_MAX_DEPTH or url in self.seen:
+            return
+        priority = self.scorer.score(url, anchor_text, depth)
+        if self.coordinator is None:
+            self.add_to_frontier(url, priority, depth, keyword)
+        elif self.coordinator.holds(url) and (
+            self.frontier.qsize() + len(self._local_links) < config.CRAWLER_SHARD_FRONTIER_SIZE
+        ):
+            self._local_links.append((url, priority, depth, keyword))
+        else:
+            # links to not leased hosts and own backlog go through inboxes, where idle shards can steal them.
+            # Not added to seen: the url may come back stolen or forwarded, the shared queued set drops repeats.
+            # Links going through inboxes lose the branch, their pages are crawled for every keyword
+            self.coordinator.send(url, priority, depth)
 
-            if current_url in self.visited:
-                continue
+    def queue_local_links(self):
+        """Links of leased hosts which no shard has queued yet go to the frontier."""
+        if not self._local_links:
+            return
+        links, self._local_links = self._local_links, []
+        new = self.coordinator.mark_queued([url for url, _, _, _ in links])
+        for url, priority, depth, keyword in links:
+            if url in new:
+                self.add_to_frontier(url, priority, depth, keyword)
 
-            self.visited.add(current_url)
+    def add_to_frontier(self, url: str, priority: float, depth: int, keyword: str | None = None):
+        if url in self.seen:
+            return
+        if self.frontier.put_nowait(url, priority, depth):
+            self.seen.add(url)
+            # only urls in frontier have a branch keyword, the map is as big as the frontier
+            if keyword is not None:
+                self.url_keywords[url] = keyword
+            if self.state_store is not None:
+                self.state_store.add(url, priority, depth, keyword)
+
+    async def crawl_worker(self, shared_data):
+        """
+        Takes urls from the shared frontier until crawling is stopped.
+        """
+        while shared_data["running"]:
+            if self.backpressure is not None:
+                # pages stay in frontier while image downloads are behind
+                try:
+                    await self.backpressure.wait(shared_data)
+                except Exception as ex:
+                    # crawling goes on unthrottled, the worker must not die
+                    logger.error(f"Error while waiting for image downloads: {str(ex)}")
+            current_url, depth = await self.frontier.get()
+            keyword = self.url_keywords.pop(current_url, None)
+            try:
+                if keyword in self.satisfied:
+                    logger.info(f"Keyword {keyword} has enough images, skip {current_url}")
+                else:
+                    await self.crawl_page(current_url, depth, keyword)
+            except Exception as ex:
+                logger.error(f"Error while crawling {current_url}: {str(ex)}")
+            finally:
+                self.frontier.task_done(current_url)
+
+            # not reached when worker is cancelled, so the page stays in saved frontier
+            if self.state_store is not None:
+                self.state_store.remove(current_url, depth)
+
+    async def crawl_page(self, current_url: str, depth: int, keyword: str | None):
+        self.visited_count += 1
+        if await self.is_allowed(current_url):
             logger.info(f"Crawling: {current_url}")
 
-            # parse images by keywords & find all links on page and append in to_visit not visited
+            # parse images by keywords & find all links on page and append not seen ones to frontier
             links = await self.scrape_images(current_url)
 
-            for link in links:
-                if link not in self.visited:
-                    self.to_visit.add(link)
-            redis_client.incr("crawled_links_count")
+            for link, anchor_text in links.items():
+                self.enqueue(link, anchor_text, depth + 1, keyword)
+            self.queue_local_links()
+            self.metrics.inc("crawler_pages_total")
+            self.metrics.inc_ranked(HOST_PAGES_KEY, get_host(current_url))
+            self.metrics.inc_key("crawled_links_count")
+
+    @property
+    def metrics(self) -> Metrics:
+        # every crawling process has its own buffers
+        return get_metrics(config.METRICS_FLUSH_INTERVAL)
+
+    def report_progress(self):
+        """Frontier size and crawl rate since the previous call of this shard."""
+        now = time.monotonic()
+        elapsed = now - self._progress_at
+        if elapsed > 0:
+            rate = (self.visited_count - self._progress_visited) / elapsed
+            self.metrics.set("crawler_pages_per_second", round(rate, 2), shard=self.shard_id)
+        self.metrics.set("crawler_queue_depth", self.frontier.qsize(), shard=self.shard_id)
+        if self.image_pipeline is not None:
+            self.metrics.set("images_queue_depth", self.image_pipeline.qsize(), shard=self.shard_id)
+        if self.backpressure is not None:
+            self.metrics.set("images_broker_queue_depth", self.backpressure.depth)
+            self.metrics.set("crawler_throttled", int(self.backpressure.throttled), shard=self.shard_id)
+        self._progress_at, self._progress_visited = now, self.visited_count
+
+    def quotas_met(self) -> bool:
+        """Updates keywords with enough images, True when every keyword has its target count."""
+        try:
+            self.satisfied = self.quotas.satisfied(self.keywords)
+        except redis.RedisError as ex:
+            logger.error(f"Error while reading keyword quotas: {str(ex)}")
+            return False
+        return bool(self.keywords) and self.satisfied == self.keywords
+
+    def checkpoint(self, force: bool = False):
+        if self.state_store is None:
+            return
+        if force or time.monotonic() - self.state_store.last_checkpoint >= config.CRAWLER_CHECKPOINT_INTERVAL:
+            try:
+                self.state_store.checkpoint(self.seen, self.visited_count)
+            except Exception as ex:
+                logger.error(f"Error while saving crawl checkpoint: {str(ex)}")
+
+    def sync_shards(self) -> bool:
+        """
+        Exchanges links with other shards, returns True when the crawl is finished.
+        """
+        if self.coordinator is None:
+            return self.frontier.is_idle()
+
+        try:
+            room = config.CRAWLER_SHARD_FRONTIER_SIZE - self.frontier.qsize()
+            drained = [host for host in self.coordinator.leased if self.frontier.is_host_idle(host)]
+            for url, priority, depth in self.coordinator.sync(self.frontier.is_idle(), room, drained):
+                self.add_to_frontier(url, priority, depth)
+            return self.frontier.is_idle() and self.coordinator.is_finished()
+        except redis.RedisError as ex:
+            logger.error(f"Error while syncing shard {self.shard_id}: {str(ex)}")
+            return False
+
+    def _run_shard(self, shard_id, shared_data):
+        self.set_shard(shard_id)
+        self._run_async(self.start_crawling, shared_data)
 
     def _run_async(self, coro_fn, shared_data):
         """
@@ -136,14 +401,127 @@ class Crawler:
         asyncio.run(coro_fn(shared_data))
 
     async def start_crawling(self, shared_data):
-        async_tasks = []
+        self.frontier = HostScheduler(
+            per_host_concurrency=config.CRAWLER_PER_HOST_CONCURRENCY,
+            rate=config.CRAWLER_HOST_RATE,
+            burst=config.CRAWLER_HOST_BURST,
+            max_pages_per_host=config.CRAWLER_MAX_PAGES_PER_HOST,
+        )
+        self.fetch_semaphore = asyncio.Semaphore(config.CRAWLER_CONCURRENCY)
+        if config.CRAWLER_PARSE_PROCESSES > 0:
+            self.parse_executor = ProcessPoolExecutor(config.CRAWLER_PARSE_PROCESSES)
+        if config.IMAGE_PIPELINE == "local":
+            self.image_pipeline = LocalImagePipeline(
+                self.dispatcher.url_cache,
+                workers=config.IMAGE_DOWNLOAD_CONCURRENCY,
+                queue_size=config.IMAGE_PIPELINE_QUEUE_SIZE,
+                store_processes=config.IMAGE_PIPELINE_PROCESSES,
+            )
+            await self.image_pipeline.start()
+        if config.CRAWLER_RESPECT_ROBOTS:
+            self.robots = RobotsCache(
+                self.httpx_client, self.httpx_client.headers["User-Agent"], ttl=config.CRAWLER_ROBOTS_TTL
+            )
+        if self.state_store is not None and self.state_store.exists():
+            self.visited_count = self.state_store.restore(self.seen)
+            url_keywords = self.state_store.url_keywords()
+            items = list(self.state_store.iter_frontier())
+            if self.coordinator is not None:
+                # hosts leased by other shards since the stop are crawled by them
+                own = self.coordinator.take(items, check_queued=False)
+                for url, _, depth in set(items) - set(own):
+                    self.state_store.remove(url, depth)
+                items = own
+            for url, priority, depth in items:
+                self.frontier.put_nowait(url, priority, depth)
+                self.seen.add(url)
+                if url in url_keywords:
+                    self.url_keywords[url] = url_keywords[url]
+            logger.info(f"Resumed crawling, {self.frontier.qsize()} pages in frontier")
+        else:
+            for url in self.urls:
+                self.enqueue(url, keyword=self.seed_keywords.get(canonicalize_url(url)))
+            self.queue_local_links()
 
-        for _ in self.urls:
-            task = asyncio.create_task(self.crawl_site(shared_data))
-            async_tasks.append(task)
+        self.quotas_met()  # seed branches of keywords with enough images are not crawled
+        self._progress_at, self._progress_visited = time.monotonic(), self.visited_count
+        workers = [
+            asyncio.create_task(self.crawl_worker(shared_data))
+            for _ in range(config.CRAWLER_WORKERS)
+        ]
 
+        finished = False
         try:
-            await asyncio.gather(*async_tasks, return_exceptions=True)
-            logger.info(f"\nFinished crawling. Visited {len(self.visited)} pages.")
+            # crawl is finished when every queued url was processed (by every shard), otherwise wait for stop
+            while shared_data["running"] and not finished:
+                try:
+                    await asyncio.wait_for(self.frontier.join(), timeout=config.CRAWLER_SYNC_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self.checkpoint()
+                self.dispatcher.maybe_flush()
+                finished = self.sync_shards()
+                if self.quotas_met():
+                    logger.info("Every keyword has its target image count")
+                    finished = True
+                self.report_progress()
+            logger.info(f"\nFinished crawling. Visited {self.visited_count} pages.")
         except Exception as ex:
             logger.error(f"\nError while crawling: {str(ex)}")
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await self.httpx_client.aclose()
+            self.dispatcher.flush()
+            if self.image_pipeline is not None:
+                await self.image_pipeline.close(drain=finished)
+            if self.parse_executor is not None:
+                self.parse_executor.shutdown(cancel_futures=True)
+
+            self.metrics.set("crawler_pages_per_second", 0, shard=self.shard_id)
+            self.metrics.set("crawler_queue_depth", 0, shard=self.shard_id)
+            if self.image_pipeline is not None:
+                self.metrics.set("images_queue_depth", 0, shard=self.shard_id)
+            self.metrics.flush()
+
+            if self.coordinator is not None:
+                if finished:
+                    self.coordinator.clear_queued()  # the same search can be started again
+                else:
+                    self.coordinator.flush()
+            if self.state_store is not None:
+                if finished:
+                    self.state_store.clear()  # nothing left to resume
+                else:
+                    self.checkpoint(force=True)
+
+
+def run_crawler_node():
+    """
+    Entry point of crawler node containers in distributed mode:
+    waits for a crawl job published by the bot and crawls its free shards.
+    """
+    last_started_at = None
+    while True:
+        job = redis_client.hgetall(CRAWL_JOB_KEY)
+        started_at = job.get(b"started_at")
+        if started_at is None or started_at == last_started_at:
+            time.sleep(1)
+            continue
+
+        last_started_at = started_at
+        crawler = Crawler(json.loads(job[b"keywords"]), job[b"text_to_keyword"].decode())
+        if crawler.coordinator is None:
+            logger.error("Crawler node needs CRAWLER_SHARDS > 1")
+            continue
+
+        logger.info(f"Received crawl job for keywords: {', '.join(sorted(crawler.keywords))}")
+        crawler.start_shards(RedisSharedData(redis_client, started_at), config.CRAWLER_LOCAL_SHARDS)
+        for process in crawler.parsing_processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    run_crawler_node()
@@ -0,0 +1,49 @@
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadDispatcher:
+    """
+    Buffers found images and sends them to Celery as one batch task,
+    when `batch_size` images are collected or `flush_interval` seconds passed.
+    Images which url cache knows as rejected or already saved to the same folder are not sent.
+    """
+
+    def __init__(self, task, batch_size: int, flush_interval: float, url_cache=None):
+        self.task = task
+        self.url_cache = url_cache
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # (image url, save dir) in the order found, the same image of a keyword is sent once
+        self._batch: dict[tuple[str, str], None] = {}
+        self._flushed_at = time.monotonic()
+
+    def add(self, absolute_src: str, save_dir: str):
+        self._batch[absolute_src, save_dir] = None
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def maybe_flush(self):
+        if time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self._flushed_at = time.monotonic()
+        if not self._batch:
+            return
+        batch, self._batch = list(self._batch), {}
+        if self.url_cache is not None:
+            entries = self.url_cache.get_many([absolute_src for absolute_src, _ in batch])
+            batch = [
+                (absolute_src, save_dir)
+                for (absolute_src, save_dir), entry in zip(batch, entries)
+                if not self.url_cache.is_done(entry, save_dir)
+            ]
+            if not batch:
+                return
+        try:
+            self.task.delay(batch)
+        except Exception as ex:
+            logger.error(f"Error while sending {len(batch)} images to download: {str(ex)}")
@@ -0,0 +1,255 @@
+import time
+import hashlib
+import logging
+
+import redis
+
+from url_utils import get_host
+
+logger = logging.getLogger(__name__)
+
+CRAWL_JOB_KEY = "crawl_job"
+
+
+def shard_for_host(host: str, shards_count: int) -> int:
+    # stable between processes, unlike hash()
+    digest = hashlib.blake2b(host.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % shards_count
+
+
+class ShardCoordinator:
+    """
+    Shares crawl frontier between crawler processes/nodes. Every host belongs to
+    one shard (by host hash), links to hosts of other shards are sent to their
+    inbox (sorted set by priority). A shard keeps in memory only the urls it will
+    crawl soon, the rest of its backlog waits in its inbox, where idle shards can steal it.
+
+    A host is crawled by one shard at a time, so per-host politeness still holds:
+    a shard takes a lease on a host (hash host -> shard) before crawling it and
+    releases it when no urls of the host are left in its memory. Urls of a host
+    leased by another shard are forwarded to that shard.
+
+    Every url is queued by one shard once: urls which got into a shard frontier are
+    added to a shared set, urls stolen, forwarded or sent again later are dropped
+    by the shard which takes them.
+
+    A shard without local work steals from the biggest inbox of unclaimed shards
+    (no process crawls them), idle shards or shards behind by more than
+    `steal_threshold` urls. The crawl is finished when every claimed shard is idle
+    and all inboxes are empty.
+    """
+
+    def __init__(
+        self,
+        redis_client: redis.Redis,
+        crawl_id: str,
+        shard_id: int,
+        shards_count: int,
+        batch_size: int = 500,
+        steal_threshold: int = 1000,
+    ):
+        self.redis = redis_client
+        self.shard_id = shard_id
+        self.shards_count = shards_count
+        self.batch_size = batch_size
+        self.steal_threshold = steal_threshold
+        self.prefix = f"crawl:{crawl_id}"
+        self.idle_key = f"{self.prefix}:idle"
+        self.done_key = f"{self.prefix}:done"
+        self.claimed_key = f"{self.prefix}:claimed"
+        self.leases_key = f"{self.prefix}:leases"
+        self.queued_key = f"{self.prefix}:queued"
+        self.leased: set[str] = set()  # hosts crawled by this shard
+        self._outbox: dict[int, dict[str, float]] = {}
+
+    def inbox_key(self, shard_id: int) -> str:
+        return f"{self.prefix}:inbox:{shard_id}"
+
+    def holds(self, url: str) -> bool:
+        """Host of url is leased by this shard, its urls can go straight to the local frontier."""
+        return get_host(url) in self.leased
+
+    def send(self, url: str, priority: float, depth: int):
+        """Buffers url for the inbox of the shard of its host (own inbox for leased hosts)."""
+        host = get_host(url)
+        shard_id = self.shard_id if host in self.leased else shard_for_host(host, self.shards_count)
+        outbox = self._outbox.setdefault(shard_id, {})
+        member = f"{depth} {url}"
+        outbox[member] = max(priority, outbox.get(member, priority))
+        if sum(len(members) for members in self._outbox.values()) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._outbox:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        for shard_id, members in self._outbox.items():
+            # GT keeps the best priority if url was sent by several shards
+            pipe.zadd(self.inbox_key(shard_id), members, gt=True)
+        pipe.execute()
+        self._outbox.clear()
+
+    def _pop(self, shard_id: int, count: int) -> list[tuple[str, float, int]]:
+        items = []
+        for member, priority in self.redis.zpopmax(self.inbox_key(shard_id), count):
+            depth, url = member.decode().split(" ", 1)
+            items.append((url, priority, int(depth)))
+        return items
+
+    def _steal(self, room: int) -> list[tuple[str, float, int]]:
+        others = [shard_id for shard_id in range(self.shards_count) if shard_id != self.shard_id]
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.get(self.claimed_key)
+        pipe.smembers(self.idle_key)
+        for shard_id in others:
+            pipe.zcard(self.inbox_key(shard_id))
+        claimed, idle, *sizes = pipe.execute()
+        claimed = min(int(claimed or 0), self.shards_count)  # shards 0..claimed-1 have a process
+        idle = {int(shard_id) for shard_id in idle}
+
+        candidates = []
+        for shard_id, size in zip(others, sizes):
+            if not size:
+                continue
+            if shard_id >= claimed or shard_id in idle:
+                candidates.append((size, size, shard_id))  # nobody else takes these urls now, take all
+            elif size > self.steal_threshold:
+                candidates.append((size, size // 2, shard_id))  # the best half of a shard which is behind
+        if not candidates:
+            return []
+
+        _, count, victim = max(candidates)
+        items = self._pop(victim, min(count, room))
+        if items:
+            logger.info(f"Shard {self.shard_id} stole {len(items)} urls from shard {victim}")
+        return items
+
+    def mark_queued(self, urls: list[str]) -> set[str]:
+        """Adds urls to the set of urls queued by any shard, returns the ones which were not there."""
+        if not urls:
+            return set()
+        pipe = self.redis.pipeline(transaction=False)
+        for url in urls:
+            pipe.sadd(self.queued_key, url)
+        return {url for url, added in zip(urls, pipe.execute()) if added}
+
+    def take(self, items: list[tuple[str, float, int]], check_queued: bool = True) -> list[tuple[str, float, int]]:
+        """
+        Leases hosts of (url, priority, depth) items, returns items of own hosts
+        which no shard has queued yet and forwards the rest to the shards which hold their hosts.
+        Restored frontier passes `check_queued=False`, its urls were queued by this shard.
+        """
+        hosts = list({get_host(url) for url, _, _ in items} - self.leased)
+        owners = {}
+        if hosts:
+            pipe = self.redis.pipeline(transaction=False)
+            for host in hosts:
+                pipe.hsetnx(self.leases_key, host, self.shard_id)
+            taken = pipe.execute()
+            self.leased.update(host for host, ok in zip(hosts, taken) if ok)
+            lost = [host for host, ok in zip(hosts, taken) if not ok]
+            if lost:
+                owners = dict(zip(lost, self.redis.hmget(self.leases_key, lost)))
+
+        own, forwarded = [], []
+        for url, priority, depth in items:
+            host = get_host(url)
+            if host in self.leased:
+                own.append((url, priority, depth))
+                continue
+            # lease released in the meantime: back to own inbox, taken with the next sync
+            owner = owners.get(host)
+            shard_id = self.shard_id if owner is None else int(owner)
+            self._outbox.setdefault(shard_id, {})[f"{depth} {url}"] = priority
+            forwarded.append(url)
+        if forwarded and not check_queued:
+            self.redis.srem(self.queued_key, *forwarded)  # queued here, the shard which takes them queues them
+        self.flush()
+        if check_queued:
+            new = self.mark_queued([url for url, _, _ in own])
+            own = [item for item in own if item[0] in new]
+        return own
+
+    def release(self, hosts):
+        """Hosts without urls in local frontier can be leased by other shards."""
+        hosts = list(hosts)
+        if not hosts:
+            return
+        self.redis.hdel(self.leases_key, *hosts)
+        self.leased.difference_update(hosts)
+
+    def sync(self, local_idle: bool, room: int | None = None, drained_hosts=()) -> list[tuple[str, float, int]]:
+        """
+        Sends buffered links to other shards, releases drained hosts and returns
+        at most `room` (url, priority, depth) of own inbox (or stolen when there is no local work).
+        """
+        room = self.batch_size if room is None else room
+        self.flush()
+        self.release(drained_hosts)
+        # shard is marked busy before taking urls, so the crawl is never seen finished with urls in flight
+        self.redis.srem(self.idle_key, self.shard_id)
+        items = self._pop(self.shard_id, room) if room > 0 else []
+        if not items and local_idle and room > 0:
+            items = self._steal(room)
+        items = self.take(items)
+        if not items and local_idle:
+            self.redis.sadd(self.idle_key, self.shard_id)
+        return items
+
+    def is_finished(self) -> bool:
+        pipe = self.redis.pipeline()
+        pipe.exists(self.done_key)
+        pipe.get(self.claimed_key)
+        pipe.scard(self.idle_key)
+        for shard_id in range(self.shards_count):
+            pipe.zcard(self.inbox_key(shard_id))
+        done, claimed, idle_count, *sizes = pipe.execute()
+        if done:
+            return True
+
+        # inboxes of unclaimed shards are drained by idle shards, so every inbox must be empty
+        shards_running = min(int(claimed or 0), self.shards_count)
+        if idle_count >= shards_running and not any(sizes):
+            self.redis.set(self.done_key, 1, ex=3600)
+            return True
+        return False
+
+    def claim_shard(self) -> int | None:
+        """Takes the next free shard id for this process, None if every shard is taken."""
+        shard_id = self.redis.incr(self.claimed_key) - 1
+        if shard_id >= self.shards_count:
+            return None
+        return shard_id
+
+    def reset(self, resume: bool = True):
+        """Called before a crawl starts, inboxes are kept to resume stopped crawl."""
+        self.redis.delete(self.idle_key, self.done_key, self.claimed_key, self.leases_key)
+        if not resume:
+            self.clear_queued()  # frontiers are not restored, their urls must be queued again
+        self._outbox.clear()
+        self.leased.clear()
+
+    def clear_queued(self):
+        """Finished crawl of the same keywords can be started again."""
+        self.redis.delete(self.queued_key)
+
+
+class RedisSharedData:
+    """
+    Stands for Manager().dict() on crawler nodes: crawling runs while crawl job is published.
+    The flag is cached for one second, workers read it for every page.
+    """
+
+    def __init__(self, redis_client: redis.Redis, job_started_at: bytes):
+        self.redis = redis_client
+        self.job_started_at = job_started_at
+        self._running = True
+        self._checked_at = 0.0
+
+    def __getitem__(self, key: str):
+        if key != "running":
+            raise KeyError(key)
+        if time.monotonic() - self._checked_at >= 1:
+            self._running = self.redis.hget(CRAWL_JOB_KEY, "started_at") == self.job_started_at
+            self._checked_at = time.monotonic()
+        return self._running
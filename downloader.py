@@ -0,0 +1,132 @@
+import os
+import asyncio
+import threading
+
+import httpx
+
+from image_probe import PROBE_BYTES, probe_image_size
+
+
+class ImageTooLarge(Exception):
+    pass
+
+
+class ImageTooSmall(Exception):
+    pass
+
+
+class NotModified(Exception):
+    """Image did not change since it was downloaded with these ETag/Last-Modified."""
+
+
+class DownloadedImage(bytes):
+    """Image body with validators of the response, to revalidate it later."""
+
+    etag: str = ""
+    last_modified: str = ""
+
+
+class AsyncImageDownloader:
+    """
+    Downloads images with one pooled httpx.AsyncClient on an event loop running
+    in a background thread, so connections (per host keep-alive, HTTP/2) are
+    reused by all tasks of a Celery worker process and a batch is downloaded concurrently.
+    """
+
+    def __init__(
+        self,
+        concurrency: int,
+        max_bytes: int,
+        timeout: float,
+        http2: bool = True,
+        min_bytes: int = 0,
+        min_size: int = 0,
+    ):
+        self.concurrency = concurrency
+        self.max_bytes = max_bytes
+        self.min_bytes = min_bytes
+        self.min_size = min_size
+        self.timeout = timeout
+        self.http2 = http2
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.client: None | httpx.AsyncClient = None
+        self.semaphore: None | asyncio.Semaphore = None
+        self.run(self._init())
+
+    async def _init(self):
+        # client and semaphore must be created in the downloader loop
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        self.client = httpx.AsyncClient(limits=limits, http2=self.http2, timeout=self.timeout, follow_redirects=True)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+
+    def run(self, coro):
+        """Runs coroutine in the downloader loop and waits for its result from a sync code."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def check_size(self, header: bytes):
+        """Raises ImageTooSmall if image size in header is not bigger than min_size."""
+        size = probe_image_size(header)
+        if size is not None and (size[0] <= self.min_size or size[1] <= self.min_size):
+            raise ImageTooSmall(f"Image is too small: {size[0]}x{size[1]}")
+        return size
+
+    async def fetch(self, url: str, headers: dict | None = None) -> DownloadedImage:
+        """
+        Streams image body, stops as soon as it is bigger than max_bytes
+        or its header shows that image is too small, so small icons cost a few KB.
+        """
+        async with self.semaphore:
+            async with self.client.stream("GET", url, headers=headers) as response:
+                if response.status_code == 304:
+                    raise NotModified(url)
+                response.raise_for_status()
+                content_length = int(response.headers.get("Content-Length", 0))
+                if content_length > self.max_bytes:
+                    raise ImageTooLarge(f"Image is too large: {content_length} bytes")
+                if 0 < content_length < self.min_bytes:
+                    raise ImageTooSmall(f"Image is too small: {content_length} bytes")
+
+                body = bytearray()
+                probing = self.min_size > 0
+                async for chunk in response.aiter_bytes():
+                    body += chunk
+                    if len(body) > self.max_bytes:
+                        raise ImageTooLarge(f"Image is larger than {self.max_bytes} bytes")
+                    if probing:
+                        # probing stops when size is known or it isn't found in the first PROBE_BYTES
+                        probing = self.check_size(bytes(body)) is None and len(body) < PROBE_BYTES
+                if probing:
+                    self.check_size(bytes(body))  # whole image is smaller than PROBE_BYTES
+                image = DownloadedImage(body)
+                image.etag = response.headers.get("ETag", "")
+                image.last_modified = response.headers.get("Last-Modified", "")
+                return image
+
+    async def _fetch_many(self, urls: list[str], headers: list[dict | None]) -> list[bytes | BaseException]:
+        return await asyncio.gather(
+            *(self.fetch(url, url_headers) for url, url_headers in zip(urls, headers)),
+            return_exceptions=True,
+        )
+
+    def fetch_many(self, urls: list[str], headers: list[dict | None] | None = None) -> list[bytes | BaseException]:
+        """Downloads urls concurrently (with request headers per url), returns body or exception for every url."""
+        return self.run(self._fetch_many(urls, headers or [None] * len(urls)))
+
+
+_downloader: None | AsyncImageDownloader = None
+_downloader_pid: None | int = None
+
+
+def get_downloader(**kwargs) -> AsyncImageDownloader:
+    """
+    Downloader of the current process, Celery prefork workers are forked
+    after import, so every process starts its own loop thread.
+    """
+    global _downloader, _downloader_pid
+    if _downloader is None or _downloader_pid != os.getpid():
+        _downloader = AsyncImageDownloader(**kwargs)
+        _downloader_pid = os.getpid()
+    return _downloader
@@ -0,0 +1,51 @@
+import re
+from urllib.parse import urlsplit, unquote
+
+from url_utils import get_host
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+# weights of link score parts
+KEYWORD_WEIGHT = 3.0
+HOST_YIELD_WEIGHT = 1.0
+DEPTH_PENALTY = 1.0
+SEED_SCORE = 1000.0  # seed urls are always crawled first
+
+
+def url_words(url: str) -> set[str]:
+    parts = urlsplit(url)
+    return set(WORD_RE.findall(unquote(f"{parts.path} {parts.query}").lower()))
+
+
+class LinkScorer:
+    """
+    Scores links found on pages: keywords in anchor text/url, images saved
+    from the link host so far and depth from seed url.
+    """
+
+    def __init__(self, keywords: set[str]):
+        self.keywords = keywords
+        self.host_stats: dict[str, list[int]] = {}  # host -> [pages crawled, images found]
+
+    def record_page(self, url: str, images_found: int):
+        stats = self.host_stats.setdefault(get_host(url), [0, 0])
+        stats[0] += 1
+        stats[1] += images_found
+
+    def host_yield(self, host: str) -> float:
+        pages, images = self.host_stats.get(host, (0, 0))
+        if not pages:
+            return 0.0
+        return images / pages
+
+    def score(self, url: str, anchor_text: str, depth: int) -> float:
+        if depth == 0:
+            return SEED_SCORE
+
+        words = url_words(url) | set(WORD_RE.findall(anchor_text.lower()))
+        keyword_matches = len(words & self.keywords)
+        return (
+            KEYWORD_WEIGHT * keyword_matches
+            + HOST_YIELD_WEIGHT * self.host_yield(get_host(url))
+            - DEPTH_PENALTY * depth
+        )
@@ -0,0 +1,13 @@
+# production server for server.py: gunicorn -c gunicorn.conf.py server:app
+# every module level name is a gunicorn setting, `config` is one of them
+from config import config as app_config
+
+bind = f"{app_config.SERVER_HOST or '0.0.0.0'}:{app_config.SERVER_PORT or 5000}"
+# every download holds a thread while the archive is streamed
+workers = app_config.SERVER_WORKERS
+threads = app_config.SERVER_THREADS
+worker_class = "gthread"
+# the worker heartbeat doesn't depend on request duration in gthread workers
+timeout = 60
+graceful_timeout = 30
+accesslog = "-"
@@ -0,0 +1,215 @@
+import os
+import json
+import time
+import zlib
+import struct
+import asyncio
+import hashlib
+import logging
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# headers updated from 304 response
+REVALIDATED_HEADERS = ("cache-control", "date", "expires", "etag", "last-modified")
+# connection level headers are not stored
+HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "upgrade", "proxy-connection"}
+
+
+def parse_cache_control(value: str) -> dict[str, str | None]:
+    directives = {}
+    for part in value.split(","):
+        name, _, arg = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = arg.strip('"') or None
+    return directives
+
+
+def _http_date(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def freshness_lifetime(headers: httpx.Headers) -> float:
+    """Seconds response is fresh by Cache-Control max-age or Expires, 0 if it must be revalidated."""
+    directives = parse_cache_control(headers.get("Cache-Control", ""))
+    if "no-cache" in directives:
+        return 0
+    if directives.get("max-age"):
+        try:
+            return max(int(directives["max-age"]), 0)
+        except ValueError:
+            return 0
+    expires = _http_date(headers.get("Expires"))
+    if expires is not None:
+        date = _http_date(headers.get("Date")) or time.time()
+        return max(expires - date, 0)
+    return 0
+
+
+def is_cacheable(request: httpx.Request, response: httpx.Response) -> bool:
+    if request.method != "GET" or response.status_code != 200:
+        return False
+    directives = parse_cache_control(response.headers.get("Cache-Control", ""))
+    if "no-store" in directives or response.headers.get("Vary", "").strip() == "*":
+        return False
+    has_validators = "ETag" in response.headers or "Last-Modified" in response.headers
+    return has_validators or freshness_lifetime(response.headers) > 0
+
+
+class CachedResponse:
+    def __init__(self, status_code: int, headers: list[tuple[str, str]], body: bytes, stored_at: float):
+        self.status_code = status_code
+        self.headers = httpx.Headers(headers)
+        self.body = body  # as received, Content-Encoding is kept
+        self.stored_at = stored_at
+
+    def is_fresh(self) -> bool:
+        return time.time() - self.stored_at < freshness_lifetime(self.headers)
+
+    def validators(self) -> dict[str, str]:
+        headers = {}
+        if "ETag" in self.headers:
+            headers["If-None-Match"] = self.headers["ETag"]
+        if "Last-Modified" in self.headers:
+            headers["If-Modified-Since"] = self.headers["Last-Modified"]
+        return headers
+
+    def to_response(self, request: httpx.Request) -> httpx.Response:
+        return httpx.Response(self.status_code, headers=self.headers, content=self.body, request=request)
+
+
+class PageCache:
+    """
+    Responses on disk, one file per url: JSON metadata and body, compressed
+    with zlib unless the server already compressed it. Files are written to a
+    temporary file and renamed, so several crawler processes can share the directory.
+
+    Least recently used files (by mtime, touched on every hit) are removed
+    when the cache is bigger than `max_size` bytes.
+    """
+
+    def __init__(self, path: str, max_size: int):
+        self.path = path
+        self.max_size = max_size
+        self.size = self._scan_size() if os.path.isdir(path) else 0
+
+    def _scan_size(self) -> int:
+        return sum(entry.stat().st_size for entry in os.scandir(self.path) if entry.is_file())
+
+    def _file(self, url: str) -> str:
+        return os.path.join(self.path, hashlib.sha1(url.encode()).hexdigest())
+
+    def load(self, url: str) -> CachedResponse | None:
+        path = self._file(url)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # recently used
+            meta_size = struct.unpack(">I", data[:4])[0]
+            meta = json.loads(data[4:4 + meta_size])
+            body = data[4 + meta_size:]
+            if meta["compressed"]:
+                body = zlib.decompress(body)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, struct.error, zlib.error) as ex:
+            logger.error(f"Broken page cache entry for {url}: {str(ex)}")
+            return None
+        return CachedResponse(meta["status_code"], meta["headers"], body, meta["stored_at"])
+
+    def store(self, url: str, cached: CachedResponse):
+        compressed = "Content-Encoding" not in cached.headers
+        meta = json.dumps({
+            "url": url,
+            "status_code": cached.status_code,
+            "headers": list(cached.headers.multi_items()),
+            "stored_at": cached.stored_at,
+            "compressed": compressed,
+        }).encode()
+        body = zlib.compress(cached.body) if compressed else cached.body
+
+        os.makedirs(self.path, exist_ok=True)
+        path = self._file(url)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(struct.pack(">I", len(meta)) + meta + body)
+        os.replace(tmp_path, path)
+        self.size += 4 + len(meta) + len(body)
+        if self.size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """Removes least recently used files until the cache takes 90% of max_size."""
+        entries = [entry for entry in os.scandir(self.path) if entry.is_file()]
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        self.size = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self.size <= self.max_size * 0.9:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self.size -= size
+            except FileNotFoundError:
+                pass  # removed by another process
+
+
+class CachingTransport(httpx.AsyncBaseTransport):
+    """
+    HTTP cache under httpx client: fresh responses (Cache-Control max-age, Expires)
+    are returned from the page cache, stale ones are revalidated with
+    If-None-Match/If-Modified-Since and a 304 returns the cached body.
+    """
+
+    def __init__(self, cache: PageCache, transport: httpx.AsyncBaseTransport):
+        self.cache = cache
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if request.method != "GET":
+            return await self.transport.handle_async_request(request)
+
+        url = str(request.url)
+        cached = await asyncio.to_thread(self.cache.load, url)
+        if cached is not None:
+            if cached.is_fresh():
+                return cached.to_response(request)
+            for name, value in cached.validators().items():
+                request.headers[name] = value
+
+        response = await self.transport.handle_async_request(request)
+        if response.status_code == 304 and cached is not None:
+            await response.aclose()
+            for name in REVALIDATED_HEADERS:
+                if name in response.headers:
+                    cached.headers[name] = response.headers[name]
+            cached.stored_at = time.time()
+            await self._store(url, cached)
+            return cached.to_response(request)
+
+        if not is_cacheable(request, response):
+            return response
+
+        # raw body (still Content-Encoded) is read to store it, the client decodes it as usual
+        body = b"".join([chunk async for chunk in response.stream])
+        await response.aclose()
+        headers = [(name, value) for name, value in response.headers.multi_items() if name not in HOP_BY_HOP_HEADERS]
+        cached = CachedResponse(response.status_code, headers, body, time.time())
+        await self._store(url, cached)
+        return cached.to_response(request)
+
+    async def _store(self, url: str, cached: CachedResponse):
+        try:
+            await asyncio.to_thread(self.cache.store, url, cached)
+        except OSError as ex:
+            logger.error(f"Error while saving page {url} to cache: {str(ex)}")
+
+    async def aclose(self):
+        await self.transport.aclose()
@@ -0,0 +1,125 @@
+import io
+
+import redis
+from PIL import Image, UnidentifiedImageError
+
+HASH_SIZE = 8  # 64 bit hash
+HASH_BITS = HASH_SIZE * HASH_SIZE
+
+
+def dhash(image_raw_data: bytes, hash_size: int = HASH_SIZE) -> int | None:
+    """
+    Difference hash: image is scaled down to (hash_size + 1) x hash_size grayscale
+    and every bit tells if a pixel is brighter than its right neighbour.
+    Resized, recompressed and CDN copies of an image get the same or close hashes.
+    None if image can't be decoded (SVG is not rasterized).
+    """
+    try:
+        with Image.open(io.BytesIO(image_raw_data)) as img:
+            # JPEG is decoded at reduced scale, a few times faster than the full decode
+            img.draft("L", (hash_size * 4, hash_size * 4))
+            pixels = list(img.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS).getdata())
+    except (UnidentifiedImageError, OSError):
+        return None
+
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class PerceptualHashIndex:
+    """
+    Near-duplicate lookup over Redis with multi-index hashing: the hash is split
+    into max_distance + 1 bands and every band value keeps a set of hashes.
+    Hashes within max_distance bits differ in at most max_distance bands,
+    so they share at least one band and only hashes of the same band values are compared.
+    Every hash keeps the name of the saved image it came from.
+    """
+
+    def __init__(self, redis_client: redis.Redis, max_distance: int, key_prefix: str = "image_phash"):
+        self.redis = redis_client
+        self.max_distance = max_distance
+        self.key_prefix = key_prefix
+        self.names_key = f"{key_prefix}:names"  # hash -> image name
+        self.version_key = f"{key_prefix}:version"  # changed by every add/remove, watched by find_or_add
+
+        bands_count = min(max_distance + 1, HASH_BITS)
+        band_bits = [HASH_BITS // bands_count + (i < HASH_BITS % bands_count) for i in range(bands_count)]
+        self.bands: list[tuple[int, int]] = []  # (shift, mask)
+        shift = 0
+        for bits in band_bits:
+            self.bands.append((shift, (1 << bits) - 1))
+            shift += bits
+
+    def _band_keys(self, value: int) -> list[str]:
+        return [
+            f"{self.key_prefix}:{band}:{(value >> shift) & mask:x}"
+            for band, (shift, mask) in enumerate(self.bands)
+        ]
+
+    def find(self, value: int, client=None) -> int | None:
+        """Returns indexed hash within max_distance bits of value, None if there is no such hash."""
+        if client is None:
+            pipe = self.redis.pipeline(transaction=False)
+            for key in self._band_keys(value):
+                pipe.smembers(key)
+            band_members = pipe.execute()
+        else:
+            band_members = [client.smembers(key) for key in self._band_keys(value)]  # watching pipeline
+        candidates = set().union(*band_members)
+
+        for candidate in candidates:
+            candidate = int(candidate, 16)
+            if hamming_distance(value, candidate) <= self.max_distance:
+                return candidate
+        return None
+
+    def _add(self, pipe, value: int, name: str | None):
+        for key in self._band_keys(value):
+            pipe.sadd(key, f"{value:x}")
+        if name is not None:
+            pipe.hset(self.names_key, f"{value:x}", name)
+        pipe.incr(self.version_key)
+
+    def add(self, value: int, name: str | None = None):
+        pipe = self.redis.pipeline(transaction=False)
+        self._add(pipe, value, name)
+        pipe.execute()
+
+    def find_or_add(self, value: int, name: str) -> tuple[int, str | None] | None:
+        """
+        Returns (similar hash, its image name) or adds value for image `name` and returns None.
+        Lookup and add are one optimistic transaction (WATCH of the version key, retried if another
+        hash was added in between), so two workers never both add close hashes as new images.
+        """
+        found = None
+
+        def find_or_add_transaction(pipe):
+            nonlocal found
+            similar = self.find(value, pipe)
+            if similar is not None:
+                name_of_similar = pipe.hget(self.names_key, f"{similar:x}")
+                found = similar, name_of_similar.decode() if name_of_similar is not None else None
+                return
+            pipe.multi()
+            self._add(pipe, value, name)
+
+        self.redis.transaction(find_or_add_transaction, self.version_key)
+        return found
+
+    def remove(self, value: int):
+        """Image of the hash was not saved."""
+        pipe = self.redis.pipeline(transaction=False)
+        for key in self._band_keys(value):
+            pipe.srem(key, f"{value:x}")
+        pipe.hdel(self.names_key, f"{value:x}")
+        pipe.incr(self.version_key)
+        pipe.execute()
@@ -0,0 +1,69 @@
+import os
+import time
+
+import redis
+
+# images saved during the last seconds are not exported yet, so a worker
+# which took its timestamp before the export cursor can still add its image
+SETTLE_SECONDS = 5
+
+
+class ImageManifest:
+    """
+    Index of saved images in Redis: a sorted set per keyword folder,
+    image name -> time it was saved. Exports list images from it instead of walking
+    the images folder, `since` cursor selects images saved after the previous export.
+    """
+
+    def __init__(self, redis_client: redis.Redis, root: str):
+        self.redis = redis_client
+        self.root = root
+        self.folders_key = "images_manifest:folders"
+
+    @staticmethod
+    def key(folder: str) -> str:
+        return f"images_manifest:{folder}"
+
+    def folder(self, save_dir: str) -> str:
+        return os.path.relpath(save_dir, self.root).replace(os.sep, "/")
+
+    def add(self, save_dir: str, image_name: str, saved_at: float | None = None):
+        folder = self.folder(save_dir)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zadd(self.key(folder), {image_name: saved_at or time.time()}, nx=True)
+        pipe.sadd(self.folders_key, folder)
+        pipe.execute()
+
+    def folders(self) -> list[str]:
+        return sorted(folder.decode() for folder in self.redis.smembers(self.folders_key))
+
+    @staticmethod
+    def default_until() -> float:
+        return time.time() - SETTLE_SECONDS
+
+    def list_images(
+        self, folders: list[str] | None = None, since: float | None = None, until: float | None = None
+    ) -> list[tuple[str, float]]:
+        """(folder/image name, saved at) of images saved in (since, until], oldest first."""
+        folders = folders or self.folders()
+        min_score = "-inf" if since is None else f"({since}"
+        max_score = self.default_until() if until is None else until
+        pipe = self.redis.pipeline(transaction=False)
+        for folder in folders:
+            pipe.zrangebyscore(self.key(folder), min_score, max_score, withscores=True)
+
+        images = [
+            (f"{folder}/{image_name.decode()}", saved_at)
+            for folder, folder_images in zip(folders, pipe.execute())
+            for image_name, saved_at in folder_images
+        ]
+        images.sort(key=lambda image: image[1])
+        return images
+
+    def remove(self, images: list[str]):
+        """images: folder/image name, as returned by list_images()."""
+        pipe = self.redis.pipeline(transaction=False)
+        for image in images:
+            folder, _, image_name = image.rpartition("/")
+            pipe.zrem(self.key(folder or "."), image_name)
+        pipe.execute()
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+from multiprocessing import util
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from config import config
+from downloader import AsyncImageDownloader
+from metrics import get_metrics
+from url_cache import ImageUrlCache
+from tasks import handle_failed_download, store_cached, store_download
+
+logger = logging.getLogger(__name__)
+
+
+def _init_store_process():
+    # pool processes exit without atexit handlers, multiprocessing finalizers still run
+    util.Finalize(None, lambda: get_metrics(config.METRICS_FLUSH_INTERVAL).flush(), exitpriority=10)
+
+
+class LocalImagePipeline:
+    """
+    Single node mode without Celery: images found by the crawler go through a bounded
+    asyncio.Queue to download workers in the crawler process. Downloads run on the
+    pooled downloader loop thread, validation, hashing and saving in a process pool.
+    put() waits while the queue is full, so page fetching slows down to the download speed.
+    """
+
+    def __init__(self, url_cache: ImageUrlCache, workers: int, queue_size: int, store_processes: int):
+        self.url_cache = url_cache
+        self.workers_count = workers
+        self.queue_size = queue_size
+        self.store_processes = store_processes  # 0 - store in a thread
+        self.queue: None | asyncio.Queue = None
+        self.workers: list[asyncio.Task] = []
+        self.store_executor: None | Executor = None
+        self.downloader: None | AsyncImageDownloader = None
+        # queued or downloading (url, save dir), the same image is not queued twice for a keyword
+        self._pending: set[tuple[str, str]] = set()
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        if self.store_processes > 0:
+            self.store_executor = ProcessPoolExecutor(self.store_processes, initializer=_init_store_process)
+        else:
+            self.store_executor = ThreadPoolExecutor(1)
+        self.downloader = AsyncImageDownloader(
+            concurrency=self.workers_count,
+            max_bytes=config.IMAGE_MAX_BYTES,
+            timeout=config.IMAGE_DOWNLOAD_TIMEOUT,
+            min_bytes=config.IMAGE_MIN_BYTES,
+            min_size=config.IMAGE_MIN_SIZE,
+        )
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.workers_count)]
+
+    def qsize(self) -> int:
+        return self.queue.qsize()
+
+    async def put(self, absolute_src: str, save_dir: str):
+        image = (absolute_src, save_dir)
+        if image in self._pending:
+            return
+        self._pending.add(image)
+        try:
+            await self.queue.put(image)
+        except asyncio.CancelledError:
+            self._pending.discard(image)
+            raise
+
+    async def _worker(self):
+        while True:
+            absolute_src, save_dir = await self.queue.get()
+            try:
+                await self.process(absolute_src, save_dir)
+            except Exception as ex:
+                logger.error(f"Error while processing image {absolute_src}: {str(ex)}")
+            finally:
+                self._pending.discard((absolute_src, save_dir))
+                self.queue.task_done()
+
+    async def fetch(self, absolute_src: str, headers: dict | None):
+        future = asyncio.run_coroutine_threadsafe(self.downloader.fetch(absolute_src, headers), self.downloader.loop)
+        return await asyncio.wrap_future(future)
+
+    async def process(self, absolute_src: str, save_dir: str):
+        entry = (await asyncio.to_thread(self.url_cache.get_many, [absolute_src]))[0]
+        if self.url_cache.is_done(entry, save_dir):
+            return
+        if entry is not None and self.url_cache.is_fresh(entry):
+            await asyncio.to_thread(store_cached, absolute_src, save_dir, entry)
+            get_metrics(config.METRICS_FLUSH_INTERVAL).inc("images_cached_total")
+            return
+
+        try:
+            image = await self.fetch(absolute_src, self.url_cache.validators(entry))
+        except Exception as ex:
+            await asyncio.to_thread(handle_failed_download, absolute_src, save_dir, entry, ex)
+            return
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            self.store_executor, store_download,
+            absolute_src, save_dir, bytes(image), image.etag, image.last_modified,
+        )
+
+    async def close(self, drain: bool = True):
+        """Waits for queued images when the crawl is finished, a stopped crawl drops them."""
+        if drain:
+            await self.queue.join()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        if self.downloader is not None:
+            await asyncio.wrap_future(
+                asyncio.run_coroutine_threadsafe(self.downloader.client.aclose(), self.downloader.loop)
+            )
+            self.downloader.loop.call_soon_threadsafe(self.downloader.loop.stop)
+        if self.store_executor is not None:
+            await asyncio.to_thread(self.store_executor.shutdown, cancel_futures=not drain)
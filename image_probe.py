@@ -0,0 +1,133 @@
+import re
+import struct
+
+# image size is usually in the first few KB, JPEG with big EXIF may need more
+PROBE_BYTES = 64 * 1024
+
+# root element after optional BOM, XML declaration, comments and doctype, HTML pages with inline SVG are not images
+SVG_ROOT_RE = re.compile(
+    rb"^(?:\xef\xbb\xbf)?\s*(?:<\?xml\b.*?\?>\s*)?(?:(?:<!--.*?-->|<!DOCTYPE\b[^\[>]*(?:\[.*?\])?\s*>)\s*)*<svg[\s/>]",
+    re.IGNORECASE | re.DOTALL,
+)
+SVG_TAG_RE = re.compile(rb"<svg\b[^>]*>", re.IGNORECASE | re.DOTALL)
+SVG_ATTR_RE = re.compile(rb"""\b(width|height|viewBox)\s*=\s*["']([^"']*)["']""", re.IGNORECASE)
+SVG_LENGTH_RE = re.compile(rb"^\s*([0-9.]+)\s*(px)?\s*$")
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _png_size(data: bytes):
+    if len(data) < 24:
+        return None
+    return struct.unpack(">II", data[16:24])
+
+
+def _gif_size(data: bytes):
+    if len(data) < 10:
+        return None
+    return struct.unpack("<HH", data[6:10])
+
+
+def _webp_size(data: bytes):
+    if len(data) < 30:
+        return None
+    chunk = data[12:16]
+    if chunk == b"VP8 ":
+        w, h = struct.unpack("<HH", data[26:30])
+        return w & 0x3FFF, h & 0x3FFF
+    if chunk == b"VP8L":
+        bits = int.from_bytes(data[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        return int.from_bytes(data[24:27], "little") + 1, int.from_bytes(data[27:30], "little") + 1
+    return None
+
+
+def _avif_size(data: bytes):
+    """Size from the image spatial extents (ispe) property of the primary item."""
+    pos = data.find(b"ispe", 0, PROBE_BYTES)
+    if pos < 4 or pos + 16 > len(data):
+        return None
+    return struct.unpack(">II", data[pos + 8:pos + 16])
+
+
+def _jpeg_size(data: bytes):
+    pos = 2
+    while pos + 9 < len(data):
+        if data[pos] != 0xFF:
+            return None  # broken marker structure
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1  # fill byte
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            h, w = struct.unpack(">HH", data[pos + 5:pos + 9])
+            return w, h
+        if marker == 0xD8 or 0xD0 <= marker <= 0xD7:
+            pos += 2  # markers without length
+            continue
+        pos += 2 + struct.unpack(">H", data[pos + 2:pos + 4])[0]
+    return None
+
+
+def _svg_length(value: bytes):
+    found = SVG_LENGTH_RE.match(value)
+    return float(found.group(1)) if found else None
+
+
+def _svg_size(data: bytes):
+    """Size of rendered SVG in px: width/height attributes or viewBox, no rasterizing."""
+    tag = SVG_TAG_RE.search(data)
+    if tag is None:
+        return None
+    attrs = {name.lower(): value for name, value in SVG_ATTR_RE.findall(tag.group(0))}
+
+    w = _svg_length(attrs.get(b"width", b""))
+    h = _svg_length(attrs.get(b"height", b""))
+    if w is not None and h is not None:
+        return int(w), int(h)
+
+    view_box = attrs.get(b"viewbox", b"").replace(b",", b" ").split()
+    if len(view_box) == 4:
+        try:
+            return int(float(view_box[2])), int(float(view_box[3]))
+        except ValueError:
+            return None
+    return None
+
+
+def probe_image_format(data: bytes) -> str | None:
+    """Format by file signature: png, jpg, gif, webp, avif or svg, None if unknown."""
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if data.startswith(b"\xff\xd8"):
+        return "jpg"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data[4:8] == b"ftyp" and data[8:12] in (b"avif", b"avis"):
+        return "avif"
+    if SVG_ROOT_RE.match(data[:PROBE_BYTES]):
+        return "svg"
+    return None
+
+
+SIZE_READERS = {
+    "png": _png_size,
+    "jpg": _jpeg_size,
+    "gif": _gif_size,
+    "webp": _webp_size,
+    "avif": _avif_size,
+    "svg": _svg_size,
+}
+
+
+def probe_image_size(data: bytes) -> tuple[int, int] | None:
+    """
+    Reads (width, height) from the beginning of PNG/JPEG/GIF/WebP/AVIF/SVG file.
+    None if format is unknown or more bytes are needed.
+    """
+    image_format = probe_image_format(data)
+    if image_format is None:
+        return None
+    return SIZE_READERS[image_format](data)
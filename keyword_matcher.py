@@ -0,0 +1,79 @@
+import re
+
+WORD_RE = re.compile(r"[^\W_]+")
+
+# where keyword was found, alt text describes the image better than file name
+ALT_WEIGHT = 3
+TITLE_WEIGHT = 2
+FILENAME_WEIGHT = 1
+STEM_SUFFIXES = ("ing", "ed", "es", "er", "s")
+
+
+def word_variants(word: str, plurals: bool, stemming: bool) -> set[str]:
+    variants = {word}
+    if plurals:
+        variants |= {word + "s", word + "es"}
+        if word.endswith("y") and len(word) > 2:
+            variants.add(word[:-1] + "ies")
+    if stemming:
+        stem = word
+        for suffix in STEM_SUFFIXES:
+            if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+                stem = word[: -len(suffix)]
+                break
+        variants |= {stem + suffix for suffix in ("", *STEM_SUFFIXES)}
+    return variants
+
+
+class KeywordMatcher:
+    """
+    Finds keywords in image alt, title and file name. Keywords are compiled
+    once into a dict of word forms (and phrases by their first word), so text
+    is split into words with one regex pass and every word costs one dict lookup,
+    no matter how many keywords there are.
+
+    Multi-word keywords match with any separators ("red car" matches "red_car.jpg"),
+    plurals and stemming of the last keyword word are optional.
+    """
+
+    def __init__(self, keywords, plurals: bool = True, stemming: bool = False):
+        self.words: dict[str, list[str]] = {}  # word form -> one word keywords
+        self.phrases: dict[str, list[tuple[list[str], set[str], str]]] = {}  # first word -> (middle, last forms, keyword)
+
+        for keyword in sorted(set(keywords)):
+            words = WORD_RE.findall(keyword.lower())
+            if not words:
+                continue
+
+            last_variants = word_variants(words[-1], plurals, stemming)
+            if len(words) == 1:
+                for variant in last_variants:
+                    self.words.setdefault(variant, []).append(keyword)
+            else:
+                self.phrases.setdefault(words[0], []).append((words[1:-1], last_variants, keyword))
+
+        self.first_words = set(self.words) | set(self.phrases)
+
+    def _scan(self, text: str, weight: int, scores: dict[str, int]):
+        words = WORD_RE.findall(text.lower())
+        if self.first_words.isdisjoint(words):
+            return  # most of images, checked with one set operation
+        for i, word in enumerate(words):
+            for keyword in self.words.get(word, ()):
+                scores[keyword] = scores.get(keyword, 0) + weight
+
+            for middle, last_variants, keyword in self.phrases.get(word, ()):
+                last = i + len(middle) + 1
+                if last < len(words) and words[last] in last_variants and words[i + 1:last] == middle:
+                    scores[keyword] = scores.get(keyword, 0) + weight
+
+    def match(self, alt: str, title: str, filename: str) -> list[str]:
+        """Returns found keywords, the best found (in alt, then title, then file name) first."""
+        scores = {}
+        # phrases are matched inside one field, "red" in alt and "car" in title is not "red car"
+        self._scan(alt, ALT_WEIGHT, scores)
+        self._scan(title, TITLE_WEIGHT, scores)
+        self._scan(filename, FILENAME_WEIGHT, scores)
+
+        # sorted is stable, keywords with the same score stay in order they were found
+        return sorted(scores, key=scores.get, reverse=True)
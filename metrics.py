@@ -0,0 +1,254 @@
+import os
+import time
+import logging
+import threading
+
+import redis
+
+logger = logging.getLogger(__name__)
+redis_client = redis.Redis("redis")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024)
+
+COUNTERS_KEY = "metrics:counters"
+GAUGES_KEY = "metrics:gauges"
+HISTOGRAMS_KEY = "metrics:histograms"
+TYPES_KEY = "metrics:types"
+HOST_PAGES_KEY = "metrics:host_pages"  # sorted set, not exported to Prometheus: a series per host is unbounded
+RANKED_LIMIT = 1000  # members kept in sorted sets, the rest with the lowest scores are dropped
+HELP = {
+    "crawler_pages_total": "Pages crawled",
+    "crawler_fetch_errors_total": "Page fetch errors by reason",
+    "crawler_fetch_seconds": "Page fetch latency",
+    "crawler_parse_seconds": "Page parse time",
+    "crawler_page_bytes_total": "Bytes of crawled pages",
+    "crawler_images_found_total": "Images sent to download",
+    "crawler_queue_depth": "Urls in crawler frontier",
+    "crawler_pages_per_second": "Crawl rate of the last flush interval",
+    "images_queue_depth": "Images waiting for download in single node mode",
+    "images_broker_queue_depth": "Image batches waiting for Celery workers",
+    "crawler_throttled": "1 while crawling waits for image downloads",
+    "images_downloaded_total": "Images downloaded",
+    "images_downloaded_bytes_total": "Bytes of downloaded images",
+    "images_downloaded_bytes": "Size of downloaded images",
+    "images_cached_total": "Image urls found in url cache, not downloaded",
+    "images_saved_total": "Images saved",
+    "images_rejected_total": "Images not saved by reason",
+    "archive_requests_total": "Archive requests",
+    "archive_bytes_sent_total": "Archive bytes sent",
+}
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def series(name: str, labels: dict) -> str:
+    """Prometheus series name: name{label="value",...}."""
+    if not labels:
+        return name
+    pairs = ",".join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items()))
+    return f"{name}{{{pairs}}}"
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms of one process, aggregated in memory
+    and written to Redis hashes with one pipeline every `flush_interval` seconds
+    (or on flush()), so an event costs a dict update instead of a Redis call.
+    Hashes are shared by all crawler, worker and server processes.
+    """
+
+    def __init__(self, redis_client: redis.Redis, flush_interval: float = 5):
+        self.redis = redis_client
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._counters: dict[str, float] = {}
+        self._keys: dict[str, int] = {}  # plain Redis counters, e.g. crawled_links_count
+        self._ranked: dict[tuple[str, str], float] = {}  # (sorted set, member) -> score increment
+        self._gauges: dict[str, float] = {}
+        self._histograms: dict[str, float] = {}  # cumulative bucket, _sum and _count series
+        self._types: dict[str, str] = {}
+        self._flushed_at = time.monotonic()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = series(name, labels)
+        with self._lock:
+            self._types[name] = "counter"
+            self._counters[key] = self._counters.get(key, 0) + value
+        self.maybe_flush()
+
+    def inc_key(self, key: str, value: int = 1):
+        with self._lock:
+            self._keys[key] = self._keys.get(key, 0) + value
+        self.maybe_flush()
+
+    def inc_ranked(self, key: str, member: str, value: float = 1):
+        """Score of member in a sorted set which keeps RANKED_LIMIT top members, e.g. pages per host."""
+        with self._lock:
+            self._ranked[(key, member)] = self._ranked.get((key, member), 0) + value
+        self.maybe_flush()
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self._types[name] = "gauge"
+            self._gauges[series(name, labels)] = value
+        self.maybe_flush()
+
+    def observe(self, name: str, value: float, buckets=LATENCY_BUCKETS, **labels):
+        with self._lock:
+            self._types[name] = "histogram"
+            for bound in (*buckets, "+Inf"):
+                # every bucket is written, empty ones too
+                key = series(f"{name}_bucket", {**labels, "le": bound})
+                self._histograms[key] = self._histograms.get(key, 0) + (bound == "+Inf" or value <= bound)
+            for suffix, amount in (("_sum", value), ("_count", 1)):
+                key = series(f"{name}{suffix}", labels)
+                self._histograms[key] = self._histograms.get(key, 0) + amount
+        self.maybe_flush()
+
+    def maybe_flush(self):
+        if time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            self._flushed_at = time.monotonic()
+            counters, self._counters = self._counters, {}
+            keys, self._keys = self._keys, {}
+            ranked, self._ranked = self._ranked, {}
+            gauges, self._gauges = self._gauges, {}
+            histograms, self._histograms = self._histograms, {}
+            types = dict(self._types)
+        if not (counters or keys or ranked or gauges or histograms):
+            return
+
+        pipe = self.redis.pipeline(transaction=False)
+        for key, value in counters.items():
+            pipe.hincrbyfloat(COUNTERS_KEY, key, value)
+        for key, value in histograms.items():
+            pipe.hincrbyfloat(HISTOGRAMS_KEY, key, value)
+        for key, value in keys.items():
+            pipe.incrby(key, value)
+        for (key, member), value in ranked.items():
+            pipe.zincrby(key, value, member)
+        for key in {key for key, _ in ranked}:
+            pipe.zremrangebyrank(key, 0, -RANKED_LIMIT - 1)
+        if gauges:
+            pipe.hset(GAUGES_KEY, mapping=gauges)
+        if types:
+            pipe.hset(TYPES_KEY, mapping=types)
+        try:
+            pipe.execute()
+        except redis.RedisError as ex:
+            logger.error(f"Error while saving metrics: {str(ex)}")
+            self._merge_back(counters, keys, ranked, gauges, histograms)
+
+    def _merge_back(self, counters, keys, ranked, gauges, histograms):
+        """Not saved values are written with the next flush."""
+        with self._lock:
+            for pending, current in (
+                (counters, self._counters), (keys, self._keys), (ranked, self._ranked), (histograms, self._histograms)
+            ):
+                for key, value in pending.items():
+                    current[key] = current.get(key, 0) + value
+            for key, value in gauges.items():
+                self._gauges.setdefault(key, value)
+
+
+_metrics: None | Metrics = None
+_metrics_pid: None | int = None
+
+
+def get_metrics(flush_interval: float = 5) -> Metrics:
+    """Metrics of the current process, forked processes don't share buffers with the parent."""
+    global _metrics, _metrics_pid
+    if _metrics is None or _metrics_pid != os.getpid():
+        _metrics = Metrics(redis_client, flush_interval)
+        _metrics_pid = os.getpid()
+    return _metrics
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+def _series_order(line: str):
+    """Histogram buckets in increasing `le` order, other series by name."""
+    key = line.rsplit(" ", 1)[0]
+    if 'le="' not in key:
+        return key, 0.0
+    le = key.split('le="', 1)[1].split('"', 1)[0]
+    return key.replace(f'le="{le}"', ""), float("inf") if le == "+Inf" else float(le)
+
+
+def render_prometheus(redis_client: redis.Redis) -> str:
+    """All metrics in Prometheus text format."""
+    pipe = redis_client.pipeline(transaction=False)
+    for key in (TYPES_KEY, COUNTERS_KEY, GAUGES_KEY, HISTOGRAMS_KEY):
+        pipe.hgetall(key)
+    types, *values = [
+        {field.decode(): value.decode() for field, value in hash_values.items()}
+        for hash_values in pipe.execute()
+    ]
+
+    by_name: dict[str, list[str]] = {}
+    for hash_values in values:
+        for key, value in hash_values.items():
+            base = key.split("{", 1)[0]
+            for suffix in ("_bucket", "_sum", "_count"):
+                if base.endswith(suffix) and types.get(base[: -len(suffix)]) == "histogram":
+                    base = base[: -len(suffix)]
+                    break
+            by_name.setdefault(base, []).append(f"{key} {_number(float(value))}")
+
+    lines = []
+    for name in sorted(by_name):
+        if name in HELP:
+            lines.append(f"# HELP {name} {HELP[name]}")
+        lines.append(f"# TYPE {name} {types.get(name, 'untyped')}")
+        lines.extend(sorted(by_name[name], key=_series_order))
+    return "\n".join(lines) + "\n"
+
+
+def read_summary(redis_client: redis.Redis, top_hosts: int = 5) -> dict:
+    """Main numbers for the bot: totals, rates, rejection reasons and the most crawled hosts."""
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hgetall(COUNTERS_KEY)
+    pipe.hgetall(GAUGES_KEY)
+    pipe.hgetall(HISTOGRAMS_KEY)
+    pipe.get("saved_images_count")
+    pipe.zrevrange(HOST_PAGES_KEY, 0, top_hosts - 1, withscores=True)
+    counters, gauges, histograms, saved, hosts = pipe.execute()
+    counters = {key.decode(): float(value) for key, value in counters.items()}
+    gauges = {key.decode(): float(value) for key, value in gauges.items()}
+    histograms = {key.decode(): float(value) for key, value in histograms.items()}
+
+    def total(values: dict, name: str) -> float:
+        return sum(value for key, value in values.items() if key.split("{", 1)[0] == name)
+
+    def by_label(name: str, label: str) -> dict[str, float]:
+        found = {}
+        for key, value in counters.items():
+            if key.startswith(name + "{") and f'{label}="' in key:
+                label_value = key.split(f'{label}="', 1)[1].split('"', 1)[0]
+                found[label_value] = found.get(label_value, 0) + value
+        return found
+
+    fetch_count = total(histograms, "crawler_fetch_seconds_count")
+    return {
+        "pages": total(counters, "crawler_pages_total"),
+        "pages_per_second": total(gauges, "crawler_pages_per_second"),
+        "queue_depth": total(gauges, "crawler_queue_depth"),
+        "fetch_avg_seconds": total(histograms, "crawler_fetch_seconds_sum") / fetch_count if fetch_count else 0,
+        "fetch_errors": by_label("crawler_fetch_errors_total", "reason"),
+        "page_bytes": total(counters, "crawler_page_bytes_total"),
+        "images_found": total(counters, "crawler_images_found_total"),
+        "images_downloaded": total(counters, "images_downloaded_total"),
+        "images_bytes": total(counters, "images_downloaded_bytes_total"),
+        "images_cached": total(counters, "images_cached_total"),
+        "images_saved": int(saved or 0),
+        "images_rejected": by_label("images_rejected_total", "reason"),
+        "top_hosts": [(host.decode(), pages) for host, pages in hosts],
+    }
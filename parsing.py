@@ -0,0 +1,297 @@
+import re
+import json
+from html import unescape
+from html.parser import HTMLParser
+from urllib.parse import parse_qs, urlsplit
+
+from bs4 import BeautifulSoup
+
+# (src, alt, title) of images and (href, anchor text) of <a> tags
+ImageItem = tuple[str, str, str]
+LinkItem = tuple[str, str]
+
+PARSERS = {}
+EXTRACTORS = []  # (page url matcher, extractor) of site specific images
+
+# lazy loading scripts keep the real image in data-* attributes, src is a placeholder
+SRCSET_ATTRS = ("srcset", "data-srcset", "data-lazy-srcset")
+LAZY_SRC_ATTRS = ("data-src", "data-lazy-src", "data-original", "data-lazy", "data-url", "data-hi-res-src")
+OPEN_GRAPH_IMAGES = ("og:image", "og:image:url", "og:image:secure_url", "twitter:image")
+SRCSET_URL_RE = re.compile(r"[\s,]*(\S+)")
+CSS_URL_RE = re.compile(r"""background(?:-image)?\s*:[^;}]*?url\(\s*['"]?([^'")\s]+)['"]?\s*\)""", re.I)
+
+
+def register_parser(name: str):
+    """Adds parser backend: function html -> (images, links)."""
+    def decorator(func):
+        PARSERS[name] = func
+        return func
+    return decorator
+
+
+def register_extractor(matches):
+    """Adds extractor of site specific images: function (html, page url) -> images, for pages where matches(url)."""
+    def decorator(func):
+        EXTRACTORS.append((matches, func))
+        return func
+    return decorator
+
+
+def parse_page(html: str, backend: str = "tokenizer", page_url: str = "") -> tuple[list[ImageItem], list[LinkItem]]:
+    """
+    Extracts images and links from page. Top level function, so it can be run in a process pool.
+    Images of extractors matching page url (full size images of search results) go first.
+    """
+    try:
+        parser = PARSERS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown parser backend: {backend}")
+    images, links = parser(html)
+    for matches, extractor in EXTRACTORS:
+        if page_url and matches(page_url):
+            images = extractor(html, page_url) + images
+    return images, links
+
+
+# ---- Generic image extraction, shared by parser backends ----
+def _descriptor_size(descriptor: str) -> float:
+    """Width (800w) or density (2x) of srcset candidate, 1x if missing."""
+    if not descriptor:
+        return 1.0
+    try:
+        return float(descriptor[:-1]) if descriptor[-1] in "wx" else 0.0
+    except ValueError:
+        return 0.0
+
+
+def largest_srcset_candidate(srcset: str) -> str | None:
+    """The widest (or densest) url of srcset, commas inside urls are kept as in the HTML spec."""
+    best, best_size = None, -1.0
+    position = 0
+    while match := SRCSET_URL_RE.match(srcset, position):
+        url, position = match.group(1), match.end()
+        descriptor = ""
+        if url.endswith(","):
+            url = url.rstrip(",")
+        else:
+            end = srcset.find(",", position)
+            end = len(srcset) if end == -1 else end
+            descriptor, position = srcset[position:end].strip().lower(), end + 1
+        size = _descriptor_size(descriptor)
+        if url and not url.startswith("data:") and size > best_size:
+            best, best_size = url, size
+    return best
+
+
+def best_image_src(attrs: dict) -> str | None:
+    """Full size image of <img>/<source>: the largest srcset candidate, lazy loaded url or src."""
+    for name in SRCSET_ATTRS:
+        if attrs.get(name) and (src := largest_srcset_candidate(attrs[name])):
+            return src
+    for name in (*LAZY_SRC_ATTRS, "src"):
+        src = attrs.get(name)
+        if src and not src.startswith("data:"):
+            return src
+    return None
+
+
+def css_images(css: str, alt: str = "", title: str = "") -> list[ImageItem]:
+    return [(url, alt, title) for url in CSS_URL_RE.findall(css) if not url.startswith("data:")]
+
+
+class OpenGraphImages:
+    """og:image and twitter:image of page, described by og:image:alt and og:title."""
+
+    def __init__(self):
+        self.urls: list[str] = []
+        self.alt = ""
+        self.title = ""
+
+    def add_meta(self, attrs: dict):
+        name = (attrs.get("property") or attrs.get("name") or "").lower()
+        content = attrs.get("content") or ""
+        if name in OPEN_GRAPH_IMAGES and content and content not in self.urls:
+            self.urls.append(content)
+        elif name == "og:image:alt":
+            self.alt = content
+        elif name == "og:title":
+            self.title = content
+
+    def images(self) -> list[ImageItem]:
+        return [(url, self.alt, self.title) for url in self.urls]
+
+
+class ImageLinkExtractor(HTMLParser):
+    """
+    Streaming tokenizer which only looks at image tags (<img>, <picture>/<source>, og:image meta,
+    CSS backgrounds) and <a> tags, no document tree is built.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.images: list[ImageItem] = []
+        self.links: list[LinkItem] = []
+        self.open_graph = OpenGraphImages()
+        self._href = None
+        self._anchor_text = []
+        self._picture_sources: list[str] | None = None  # inside <picture>, described by its <img>
+        self._in_style = False
+
+    def _close_anchor(self):
+        if self._href is not None:
+            text = " ".join(part for part in (s.strip() for s in self._anchor_text) if part)
+            self.links.append((self._href, text))
+        self._href = None
+        self._anchor_text = []
+
+    def _close_picture(self):
+        # <picture> without <img>
+        for src in self._picture_sources or []:
+            self.images.append((src, "", ""))
+        self._picture_sources = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if attrs.get("style"):
+            self.images.extend(css_images(attrs["style"], attrs.get("aria-label") or "", attrs.get("title") or ""))
+        if tag == "img":
+            src = best_image_src(attrs)
+            alt, title = attrs.get("alt") or "", attrs.get("title") or ""
+            for source_src in self._picture_sources or []:
+                self.images.append((source_src, alt, title))
+            if self._picture_sources is not None:
+                self._picture_sources = []
+            if src:
+                self.images.append((src, alt, title))
+        elif tag == "source" and self._picture_sources is not None:
+            src = best_image_src(attrs)
+            if src:
+                self._picture_sources.append(src)
+        elif tag == "picture":
+            self._close_picture()
+            self._picture_sources = []
+        elif tag == "meta":
+            self.open_graph.add_meta(attrs)
+        elif tag == "style":
+            self._in_style = True
+        elif tag == "a":
+            self._close_anchor()  # not closed <a> ends with the next one
+            href = attrs.get("href")
+            if href:
+                self._href = href
+
+    def handle_endtag(self, tag):
+        if tag == "a":
+            self._close_anchor()
+        elif tag == "picture":
+            self._close_picture()
+        elif tag == "style":
+            self._in_style = False
+
+    def handle_data(self, data):
+        if self._href is not None:
+            self._anchor_text.append(data)
+        if self._in_style:
+            self.images.extend(css_images(data))
+
+
+@register_parser("tokenizer")
+def parse_with_tokenizer(html: str) -> tuple[list[ImageItem], list[LinkItem]]:
+    extractor = ImageLinkExtractor()
+    extractor.feed(html)
+    extractor.close()
+    extractor._close_anchor()
+    extractor._close_picture()
+    return extractor.images + extractor.open_graph.images(), extractor.links
+
+
+def parse_with_soup(html: str, features: str) -> tuple[list[ImageItem], list[LinkItem]]:
+    soup = BeautifulSoup(html, features)
+    images = []
+    open_graph = OpenGraphImages()
+    for tag in soup.find_all(True):
+        if tag.get("style"):
+            images.extend(css_images(tag["style"], tag.get("aria-label", ""), tag.get("title", "")))
+        if tag.name == "img":
+            src = best_image_src(tag.attrs)
+            if src:
+                images.append((src, tag.get("alt", ""), tag.get("title", "")))
+        elif tag.name == "source" and tag.parent is not None and tag.parent.name == "picture":
+            src = best_image_src(tag.attrs)
+            img_tag = tag.parent.find("img")
+            if src:
+                images.append((src, img_tag.get("alt", "") if img_tag else "", img_tag.get("title", "") if img_tag else ""))
+        elif tag.name == "meta":
+            open_graph.add_meta(tag.attrs)
+        elif tag.name == "style":
+            images.extend(css_images(tag.get_text()))
+    links = [
+        (a_tag.get("href"), a_tag.get_text(" ", strip=True))
+        for a_tag in soup.find_all("a")
+        if a_tag.get("href")
+    ]
+    return images + open_graph.images(), links
+
+
+@register_parser("html.parser")
+def parse_with_html_parser(html: str) -> tuple[list[ImageItem], list[LinkItem]]:
+    return parse_with_soup(html, "html.parser")
+
+
+@register_parser("lxml")
+def parse_with_lxml(html: str) -> tuple[list[ImageItem], list[LinkItem]]:
+    # lxml is optional, it is not in requirements.txt
+    return parse_with_soup(html, "lxml")
+
+
+# ---- Search engine result pages ----
+GOOGLE_IMAGE_RE = re.compile(r'\["(https?://[^"\\]*(?:\\.[^"\\]*)*)",(\d+),(\d+)\]')
+BING_METADATA_RE = re.compile(r'\bm="(\{[^"]*\})"')
+
+
+def _search_query(page_url: str) -> str:
+    return parse_qs(urlsplit(page_url).query).get("q", [""])[0]
+
+
+def is_google_images(page_url: str) -> bool:
+    url = urlsplit(page_url)
+    query = parse_qs(url.query)
+    return ".google." in f".{url.hostname}" and (query.get("tbm") == ["isch"] or query.get("udm") == ["2"])
+
+
+def is_bing_images(page_url: str) -> bool:
+    url = urlsplit(page_url)
+    return (url.hostname or "").endswith("bing.com") and url.path.startswith("/images/search")
+
+
+@register_extractor(is_google_images)
+def extract_google_images(html: str, page_url: str) -> list[ImageItem]:
+    """
+    Google Images page shows small thumbnails, full size urls are in script data
+    as ["url",height,width] arrays. Images are described by the search query.
+    """
+    query = _search_query(page_url)
+    found = {}
+    for match in GOOGLE_IMAGE_RE.finditer(html):
+        try:
+            url = json.loads(f'"{match.group(1)}"')  # \u003d and other escapes
+        except ValueError:
+            continue
+        if "gstatic.com" not in url:  # thumbnails
+            found.setdefault(url, (url, query, ""))
+    return list(found.values())
+
+
+@register_extractor(is_bing_images)
+def extract_bing_images(html: str, page_url: str) -> list[ImageItem]:
+    """Bing keeps full size url and title of a result in JSON of the `m` attribute."""
+    query = _search_query(page_url)
+    found = {}
+    for match in BING_METADATA_RE.finditer(html):
+        try:
+            metadata = json.loads(unescape(match.group(1)))
+        except ValueError:
+            continue
+        if metadata.get("murl"):
+            found.setdefault(metadata["murl"], (metadata["murl"], query, metadata.get("t", "")))
+    return list(found.values())
@@ -0,0 +1,73 @@
+import os
+
+import redis
+
+TARGETS_KEY = "keyword_quota:targets"
+SAVED_KEY = "keyword_quota:saved"
+
+
+def folder_keyword(save_dir: str) -> str:
+    """Images of a keyword are saved to SAVE_IMAGES_PATH/<keyword>."""
+    return os.path.basename(os.path.normpath(save_dir))
+
+
+class KeywordQuotas:
+    """
+    Target image counts per keyword set from the bot and counts of images saved
+    to keyword folders since the target was set. A slot is reserved with HINCRBY
+    before an image is linked, so concurrent workers never save more than the target.
+    Keywords without a target have no limit, their images are only counted.
+    """
+
+    def __init__(self, redis_client: redis.Redis):
+        self.redis = redis_client
+
+    def set_target(self, keyword: str, target: int):
+        """Starts counting images of keyword from zero, 0 removes the target."""
+        pipe = self.redis.pipeline()
+        if target > 0:
+            pipe.hset(TARGETS_KEY, keyword, target)
+        else:
+            pipe.hdel(TARGETS_KEY, keyword)
+        pipe.hdel(SAVED_KEY, keyword)
+        pipe.execute()
+
+    def progress(self) -> dict[str, tuple[int, int | None]]:
+        """keyword -> (saved images, target or None)."""
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hgetall(TARGETS_KEY)
+        pipe.hgetall(SAVED_KEY)
+        targets, saved = [
+            {key.decode(): int(value) for key, value in values.items()} for values in pipe.execute()
+        ]
+        return {keyword: (saved.get(keyword, 0), targets.get(keyword)) for keyword in {*targets, *saved}}
+
+    def reserve(self, keyword: str) -> bool:
+        """Counts one more image of keyword, False (and nothing counted) if its target is reached."""
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hincrby(SAVED_KEY, keyword, 1)
+        pipe.hget(TARGETS_KEY, keyword)
+        saved, target = pipe.execute()
+        if target is not None and saved > int(target):
+            self.release(keyword)
+            return False
+        return True
+
+    def release(self, keyword: str):
+        """Reserved slot was not used."""
+        self.redis.hincrby(SAVED_KEY, keyword, -1)
+
+    def satisfied(self, keywords) -> set[str]:
+        """Keywords which have a target and reached it."""
+        keywords = list(keywords)
+        if not keywords:
+            return set()
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hmget(TARGETS_KEY, keywords)
+        pipe.hmget(SAVED_KEY, keywords)
+        targets, saved = pipe.execute()
+        return {
+            keyword
+            for keyword, target, count in zip(keywords, targets, saved)
+            if target is not None and int(count or 0) >= int(target)
+        }
@@ -0,0 +1,278 @@
+import time
+import heapq
+import asyncio
+import logging
+from collections import OrderedDict
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+
+import httpx
+
+from url_utils import get_host
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Classic token bucket, `rate` tokens per second and at most `capacity` tokens stored.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self, now: float | None = None) -> float:
+        """Seconds left until one token is available."""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now: float | None = None) -> bool:
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class HostState:
+    def __init__(self, bucket: TokenBucket):
+        self.queue = []  # heap of (-priority, seq, url, depth)
+        self.bucket = bucket
+        self.active = 0
+        self.pages = 0
+        self.scheduled = False
+
+    def best_priority(self) -> float:
+        return -self.queue[0][0]
+
+
+class HostScheduler:
+    """
+    Priority frontier with queue per host. Hands out the highest priority url
+    among hosts which are under per-host concurrency limit and have a token in
+    their bucket, so workers are never parked on one slow or throttled host.
+
+    Works like asyncio.Queue, but items are (url, depth) and task_done() takes url.
+
+    States of hosts without queued or in flight urls are kept for at most `max_idle_hosts`
+    hosts (least recently used are evicted), an evicted host starts with a new bucket and page count.
+    """
+
+    def __init__(
+        self,
+        per_host_concurrency: int,
+        rate: float,
+        burst: float,
+        max_pages_per_host: int = 0,
+        max_idle_hosts: int = 10000,
+    ):
+        self.per_host_concurrency = per_host_concurrency
+        self.rate = rate
+        self.burst = burst
+        self.max_pages_per_host = max_pages_per_host
+        self.max_idle_hosts = max_idle_hosts
+
+        self.hosts: dict[str, HostState] = {}
+        self._idle: OrderedDict[str, None] = OrderedDict()  # idle hosts, least recently used first
+        self._delayed = []  # heap of (ready_at, seq, host), hosts waiting for token
+        self._runnable = []  # heap of (-priority, seq, host), hosts which can be crawled now
+        self._seq = 0
+        self._queued = 0
+        self._unfinished = 0
+        self._finished = asyncio.Event()
+        self._finished.set()
+        self._wakeup = asyncio.Event()
+
+    def qsize(self) -> int:
+        return self._queued
+
+    def is_idle(self) -> bool:
+        """No urls are queued or in flight."""
+        return self._unfinished == 0
+
+    def is_host_idle(self, host: str) -> bool:
+        """No urls of host are queued or in flight."""
+        state = self.hosts.get(host)
+        return state is None or (not state.queue and not state.active)
+
+    def _state(self, host: str) -> HostState:
+        state = self.hosts.get(host)
+        if state is None:
+            state = HostState(TokenBucket(self.rate, self.burst))
+            self.hosts[host] = state
+        self._idle.pop(host, None)
+        return state
+
+    def _release_if_idle(self, host: str, state: HostState):
+        if state.queue or state.active:
+            return
+        self._idle[host] = None
+        self._idle.move_to_end(host)
+        while len(self._idle) > self.max_idle_hosts:
+            evicted, _ = self._idle.popitem(last=False)
+            del self.hosts[evicted]
+
+    def _schedule(self, host: str, state: HostState, ready_at: float | None = None):
+        if state.scheduled or not state.queue or state.active >= self.per_host_concurrency:
+            return
+        state.scheduled = True
+        self._seq += 1
+        if ready_at is None:
+            # priority is taken at schedule time, urls added later wait for the next round of the host
+            heapq.heappush(self._runnable, (-state.best_priority(), self._seq, host))
+        else:
+            heapq.heappush(self._delayed, (ready_at, self._seq, host))
+        self._wakeup.set()
+
+    def set_crawl_delay(self, host: str, crawl_delay: float):
+        """Crawl-delay from robots.txt, one request per `crawl_delay` seconds."""
+        if crawl_delay <= 0:
+            return
+        state = self._state(host)
+        rate = 1 / crawl_delay
+        if rate < state.bucket.rate:
+            state.bucket = TokenBucket(rate, 1)
+            state.bucket.tokens = 0
+        self._release_if_idle(host, state)
+
+    def put_nowait(self, url: str, priority: float = 0.0, depth: int = 0) -> bool:
+        """Adds url, returns False if its host already reached max_pages_per_host."""
+        host = get_host(url)
+        state = self._state(host)
+        if self.max_pages_per_host and state.pages + len(state.queue) >= self.max_pages_per_host:
+            self._release_if_idle(host, state)
+            return False
+
+        self._seq += 1
+        heapq.heappush(state.queue, (-priority, self._seq, url, depth))
+        self._queued += 1
+        self._unfinished += 1
+        self._finished.clear()
+        self._schedule(host, state)
+        return True
+
+    async def get(self) -> tuple[str, int]:
+        while True:
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, _, host = heapq.heappop(self._delayed)
+                state = self.hosts[host]
+                state.scheduled = False
+                self._schedule(host, state)
+
+            while self._runnable:
+                _, _, host = heapq.heappop(self._runnable)
+                state = self.hosts[host]
+                state.scheduled = False
+
+                if not state.bucket.consume(now):
+                    self._schedule(host, state, now + state.bucket.delay(now))
+                    continue
+
+                _, _, url, depth = heapq.heappop(state.queue)
+                self._queued -= 1
+                state.active += 1
+                state.pages += 1
+                self._schedule(host, state)
+                return url, depth
+
+            timeout = self._delayed[0][0] - now if self._delayed else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def task_done(self, url: str):
+        host = get_host(url)
+        state = self.hosts[host]
+        state.active -= 1
+        self._schedule(host, state)
+        self._release_if_idle(host, state)
+
+        self._unfinished -= 1
+        if self._unfinished == 0:
+            self._finished.set()
+
+    async def join(self):
+        await self._finished.wait()
+
+
+class RobotsCache:
+    """
+    Parsed robots.txt per host, entries are evicted after `ttl` seconds
+    or when there are more than `max_size` hosts (least recently used first).
+    """
+
+    def __init__(self, client: httpx.AsyncClient, user_agent: str, ttl: float = 3600, max_size: int = 10000):
+        self.client = client
+        self.user_agent = user_agent
+        self.ttl = ttl
+        self.max_size = max_size
+        self._cache: OrderedDict[str, tuple[float, RobotFileParser]] = OrderedDict()
+        self._loading: dict[str, asyncio.Future] = {}
+
+    async def _load(self, scheme: str, host: str) -> RobotFileParser:
+        parser = RobotFileParser()
+        try:
+            response = await self.client.get(f"{scheme}://{host}/robots.txt", timeout=3, follow_redirects=True)
+        except Exception as ex:
+            logger.info(f"Could not load robots.txt for {host}: {str(ex)}")
+            parser.allow_all = True
+            return parser
+
+        if response.status_code in (401, 403):
+            parser.disallow_all = True
+        elif response.status_code >= 400:
+            parser.allow_all = True
+        else:
+            parser.parse(response.text.splitlines())
+        return parser
+
+    async def get(self, url: str) -> RobotFileParser:
+        parts = urlsplit(url)
+        host = parts.netloc.lower()
+
+        cached = self._cache.get(host)
+        if cached is not None:
+            loaded_at, parser = cached
+            if time.monotonic() - loaded_at < self.ttl:
+                self._cache.move_to_end(host)
+                return parser
+            del self._cache[host]
+
+        # several workers may ask for the same host, robots.txt is loaded only once
+        if host in self._loading:
+            return await self._loading[host]
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[host] = future
+        try:
+            parser = await self._load(parts.scheme or "http", host)
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            del self._loading[host]
+        future.set_result(parser)
+
+        self._cache[host] = (time.monotonic(), parser)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+        return parser
+
+    async def allowed(self, url: str) -> tuple[bool, float | None]:
+        """Returns whether url can be fetched and Crawl-delay for its host."""
+        parser = await self.get(url)
+        return parser.can_fetch(self.user_agent, url), parser.crawl_delay(self.user_agent)
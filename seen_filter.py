@@ -0,0 +1,114 @@
+import math
+import hashlib
+
+
+class BloomFilter:
+    """
+    Probabilistic set of strings on top of a bit array, takes about
+    -ln(error_rate) / ln(2)^2 bits per item (~1.8 bytes for 0.1% false positives).
+    May say that new item was already seen, never the opposite.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+        self._changed: set[int] = set()  # bytes changed since the last dump
+
+    def _positions(self, item: str):
+        # double hashing, k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes_count):
+            yield (h1 + i * h2) % self.size
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    def add(self, item: str) -> bool:
+        """Adds item, returns False if it was (probably) already seen."""
+        is_new = False
+        for pos in self._positions(item):
+            byte, bit = pos >> 3, 1 << (pos & 7)
+            if not self.bits[byte] & bit:
+                self.bits[byte] |= bit
+                self._changed.add(byte)
+                is_new = True
+        if is_new:
+            self.count += 1
+        return is_new
+
+    def __len__(self) -> int:
+        return self.count
+
+    def dump(self) -> bytes:
+        self._changed.clear()
+        return bytes(self.bits)
+
+    def dump_changes(self, gap: int = 16) -> list[tuple[int, bytes]] | None:
+        """
+        (offset, bytes) ranges changed since the last dump, changes closer than `gap` bytes
+        are one range. None when the whole dump is smaller than the changes.
+        """
+        if len(self._changed) * gap >= len(self.bits):
+            return None
+        ranges = []
+        start = end = None
+        for byte in sorted(self._changed):
+            if start is not None and byte - end <= gap:
+                end = byte
+                continue
+            if start is not None:
+                ranges.append((start, bytes(self.bits[start:end + 1])))
+            start = end = byte
+        if start is not None:
+            ranges.append((start, bytes(self.bits[start:end + 1])))
+        self._changed.clear()
+        return ranges
+
+    def load(self, data: bytes, count: int):
+        if len(data) != len(self.bits):
+            raise ValueError("Saved filter has another size, capacity or error rate were changed")
+        self.bits = bytearray(data)
+        self.count = count
+        self._changed.clear()
+
+
+class ExactSeenSet:
+    """
+    Exact variant with the same interface, keeps all items (for tests and small crawls).
+    """
+
+    def __init__(self):
+        self.items = set()
+
+    def __contains__(self, item: str) -> bool:
+        return item in self.items
+
+    def add(self, item: str) -> bool:
+        if item in self.items:
+            return False
+        self.items.add(item)
+        return True
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def dump(self) -> bytes:
+        return "\n".join(self.items).encode()
+
+    def dump_changes(self) -> None:
+        return None  # always saved whole
+
+    def load(self, data: bytes, count: int):
+        self.items = set(data.decode().split("\n")) if data else set()
+
+
+def make_seen_filter(kind: str, capacity: int, error_rate: float) -> BloomFilter | ExactSeenSet:
+    if kind == "exact":
+        return ExactSeenSet()
+    if kind == "bloom":
+        return BloomFilter(capacity, error_rate)
+    raise ValueError(f"Unknown seen filter: {kind}")
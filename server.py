@@ -1,29 +1,235 @@
 import os
-import shutil
+import re
+import fcntl
 import logging
 
-from flask import Flask, send_file
+import redis
+from flask import Flask, Response, request
 
 from config import config
+from image_manifest import ImageManifest
+from metrics import get_metrics, render_prometheus
+from zip_stream import ZipStream
 
 app = Flask(__name__)
 logger = logging.getLogger(__name__)
 
 PARSED_IMAGES_DIR = config.SAVE_IMAGES_PATH
-ARCHIVE_PATH = f"./{config.IMAGES_ARCHIVE_NAME}.zip"
+redis_client = redis.Redis("redis")
+manifest = ImageManifest(redis_client, PARSED_IMAGES_DIR)
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(range_header: str | None, size: int) -> tuple[int, int] | None:
+    """(start, end) of a single byte range, None if header is missing or not supported."""
+    found = RANGE_RE.match(range_header or "")
+    if found is None or found.groups() == ("", ""):
+        return None
+    start, end = found.groups()
+    if start == "":  # last bytes: bytes=-500
+        return max(size - int(end), 0), size - 1
+    return int(start), min(int(end), size - 1) if end else size - 1
+
+
+def remove_archived(archive: ZipStream):
+    """
+    Removes archived images only (new ones may be saved while archive was sent),
+    their manifest entries, empty folders and blobs which are not linked anymore.
+    """
+    blobs = linked_blobs(archive)
+    for entry in archive.entries:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+    try:
+        manifest.remove([entry.arcname for entry in archive.entries])
+    except redis.RedisError as ex:
+        logger.error(f"Error while removing archived images from manifest: {str(ex)}")
+    for dir_path, _, _ in sorted(os.walk(PARSED_IMAGES_DIR), key=lambda item: len(item[0]), reverse=True):
+        try:
+            os.rmdir(dir_path)
+        except OSError:
+            pass  # not empty
+    remove_unlinked_blobs(blobs)
+
+
+def linked_blobs(archive: ZipStream) -> set[str]:
+    """Blobs which archived images are hard links to (blob is named as the image)."""
+    blobs = set()
+    for entry in archive.entries:
+        image_name = os.path.basename(entry.path)
+        path = os.path.join(config.IMAGES_BLOBS_PATH, image_name[:2], image_name)
+        try:
+            if os.path.samestat(os.stat(entry.path), os.stat(path)):
+                blobs.add(path)
+        except FileNotFoundError:
+            pass
+    return blobs
+
+
+def remove_unlinked_blobs(blobs: set[str]):
+    """Removes blobs which are not linked from any keyword folder anymore, only given ones are checked."""
+    for path in blobs:
+        try:
+            if os.stat(path).st_nlink == 1:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class ExportLock:
+    """
+    Lock file shared by all server workers (flock): downloads which keep images hold
+    a shared lock, an export which removes images holds an exclusive one, so images
+    are never removed while another archive with them is streamed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+
+    def acquire(self, exclusive: bool) -> bool:
+        self.file = open(self.path, "a")
+        try:
+            fcntl.flock(self.file, (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.release()
+            return False
+        return True
+
+    def release(self):
+        if self.file is not None:
+            self.file.close()  # closing the file releases the lock
+            self.file = None
+
+
+class LockedStream:
+    """
+    Response body which releases the lock when the server closes it (sent or client disconnected).
+    Sent bytes are counted, the metric is written on close.
+    """
+
+    def __init__(self, chunks, lock: ExportLock):
+        self.chunks = chunks
+        self.lock = lock
+        self.sent = 0
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        close = getattr(self.chunks, "close", None)
+        if close is not None:
+            close()
+        self.lock.release()
+        metrics = get_metrics(config.METRICS_FLUSH_INTERVAL)
+        metrics.inc("archive_bytes_sent_total", self.sent)
+        metrics.flush()
+
+
+def parse_cursor(name: str) -> float | None:
+    value = request.args.get(name)
+    return None if value in (None, "") else float(value)
+
+
+@app.after_request
+def count_archive_request(response: Response) -> Response:
+    if request.path == "/get_images_archive":
+        get_metrics(config.METRICS_FLUSH_INTERVAL).inc("archive_requests_total", status=response.status_code)
+    return response
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Crawler, image workers and server metrics in Prometheus text format."""
+    try:
+        body = render_prometheus(redis_client)
+    except redis.RedisError as ex:
+        logger.error(f"Error while reading metrics: {str(ex)}")
+        return "Metrics are not available", 503
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
 
 @app.route("/get_images_archive")
 def images_archive():
-    if not os.path.exists(PARSED_IMAGES_DIR) or not os.listdir(PARSED_IMAGES_DIR):
-        logger.error("Found no images dir, cannot make archive")
-        return "No images found", 404
-    
-    shutil.make_archive(config.IMAGES_ARCHIVE_NAME, "zip", PARSED_IMAGES_DIR)
-    shutil.rmtree(config.SAVE_IMAGES_PATH)
-    
-    logger.info("Archive was made")
-    return send_file(ARCHIVE_PATH, as_attachment=True)
+    """
+    Sends zip of parsed images generated on the fly. The whole archive sent in one
+    response removes archived images (unless `remove=0`); Range requests (resumed downloads)
+    don't remove anything. A Range is served only with If-Range of the current ETag.
+
+    `keyword` (can be repeated) and `since`/`until` select images from the manifest:
+    images of these keyword folders saved after `since`. X-Export-Cursor header is `since`
+    for the next export; a resumed download passes the same `until`.
+    """
+    keywords = request.args.getlist("keyword")
+    try:
+        since, until = parse_cursor("since"), parse_cursor("until")
+    except ValueError:
+        return "since and until must be timestamps", 400
+    remove = request.args.get("remove", "1") != "0" and "Range" not in request.headers
+
+    # taken before images are listed, so listed images are not removed by another export
+    lock = ExportLock(config.SERVER_LOCK_PATH)
+    if not lock.acquire(exclusive=remove):
+        return "Another export is running, try again later", 409, {"Retry-After": "10"}
+
+    try:
+        if keywords or since is not None or until is not None:
+            until = until if until is not None else manifest.default_until()
+            images = manifest.list_images(keywords, since, until)
+            archive = ZipStream([(os.path.join(PARSED_IMAGES_DIR, image), image) for image, _ in images])
+        elif os.path.exists(PARSED_IMAGES_DIR):
+            until = manifest.default_until()
+            archive = ZipStream.from_dir(PARSED_IMAGES_DIR)
+        else:
+            archive = ZipStream([])
+    except Exception:
+        lock.release()
+        raise
+
+    if not archive.entries:
+        logger.error("Found no images, cannot make archive")
+        lock.release()
+        return "No images found", 404, {"X-Export-Cursor": str(since or until or "")}
+
+    byte_range = parse_range(request.headers.get("Range"), archive.size)
+
+    headers = {
+        "Content-Disposition": f"attachment; filename={config.IMAGES_ARCHIVE_NAME}.zip",
+        "Accept-Ranges": "bytes",
+        "ETag": f'"{archive.etag}"',
+        "X-Export-Cursor": str(until),
+    }
+
+    # manifest may have changed since the first part, bytes of another archive layout would corrupt the file:
+    # a part is sent only for the ETag the client already has, else the whole archive
+    if byte_range is not None and request.headers.get("If-Range") == headers["ETag"]:
+        start, end = byte_range
+        if start > end:
+            lock.release()
+            headers["Content-Range"] = f"bytes */{archive.size}"
+            return Response(status=416, headers=headers)
+        headers["Content-Range"] = f"bytes {start}-{end}/{archive.size}"
+        headers["Content-Length"] = str(end - start + 1)
+        logger.info(f"Sending archive bytes {start}-{end} of {archive.size}")
+        return Response(
+            LockedStream(archive.iter_bytes(start, end), lock),
+            status=206, mimetype="application/zip", headers=headers,
+        )
+
+    def generate():
+        yield from archive.iter_bytes()
+        if remove:
+            remove_archived(archive)
+        logger.info(f"Archive of {len(archive.entries)} images was sent")
+
+    headers["Content-Length"] = str(archive.size)
+    return Response(LockedStream(generate(), lock), mimetype="application/zip", headers=headers)
 
 
 if __name__ == "__main__":
-    app.run(host=config.SERVER_HOST, port=config.SERVER_PORT)
\ No newline at end of file
+    # development server, docker compose runs it with gunicorn (gunicorn.conf.py)
+    app.run(host=config.SERVER_HOST, port=config.SERVER_PORT)
@@ -2,52 +2,75 @@ import hashlib
 import io
 import logging
 import os
-from datetime import datetime
+import time
+import shutil
 
-import cv2
+import httpx
 import redis
-import numpy as np
-import cairosvg
-import requests
 from PIL import Image, UnidentifiedImageError
 
 
 from celery_app import app
+from config import config
+from downloader import ImageTooLarge, ImageTooSmall, NotModified, get_downloader
+from image_hash import PerceptualHashIndex, dhash
+from image_manifest import ImageManifest
+from image_probe import probe_image_format, probe_image_size
+from metrics import SIZE_BUCKETS, get_metrics
+from quotas import KeywordQuotas, folder_keyword
+from url_cache import REJECTED, STORED, ImageUrlCache
 
 logger = logging.getLogger(__name__)
 redis_client = redis.Redis("redis")
+url_cache = ImageUrlCache(redis_client, config.IMAGE_URL_CACHE_TTL, config.IMAGE_URL_CACHE_REVALIDATE)
+BLOB_WAIT_TIMEOUT = 2.0  # seconds a duplicate waits for the blob written by another worker
 
-def render_svg_to_png_bytes(svg_path, dpi=96):
+def get_image_data_size(image_raw_data: bytes) -> tuple[int, int]:
     """
-    Converts SVG to PNG in memory at the given DPI,
-    returns PNG data as bytes.
+    Reads image size without decoding pixels: from PNG/JPEG/GIF/WebP/SVG header,
+    other formats are opened lazily by Pillow, which only parses the header too.
+    SVG size comes from width/height or viewBox, it is not rendered.
     """
-    with open(svg_path, "rb") as f:
-        svg_data = f.read()
-    png_data = cairosvg.svg2png(bytestring=svg_data, dpi=dpi)
-    return png_data
-
+    size = probe_image_size(image_raw_data)
+    if size is not None:
+        return size
+    try:
+        with Image.open(io.BytesIO(image_raw_data)) as img:
+            return img.size  # (width, height) in pixels
+    except UnidentifiedImageError:
+        return (0, 0)
 
-def get_image_size(image_path, dpi=96):
-    """Try to open image, if it is .png, .jpg, .gif,
-    else if .svg we are need to convert to .png
 
-    """
+def get_image_size(image_path):
     try:
-        img = cv2.imread(image_path)
-        h, w, _ = img.shape
-        return (w, h)
-    except UnidentifiedImageError:  # error if image is svg 
-        png_data = render_svg_to_png_bytes(image_path, dpi=dpi)
-        img = Image.open(io.BytesIO(png_data))
-        return img.size  # (width, height) in pixels
+        with open(image_path, "rb") as f:
+            return get_image_data_size(f.read())
     except FileNotFoundError:
         return (0, 0)
 
 
+# saved formats by file signature -> extension of saved file
+IMAGE_EXTENSIONS = {"png": ".png", "jpg": ".jpg", "gif": ".gif", "svg": ".svg", "webp": ".webp", "avif": ".avif"}
+# formats decoded before saving, AVIF needs a Pillow plugin and is checked by its header only
+DECODED_FORMATS = {"png", "jpg", "gif", "webp"}
+
+
+def is_image_decodable(image_raw_data: bytes) -> bool:
+    """Raster image is decoded (JPEG at reduced scale), so truncated or corrupt downloads are not saved."""
+    if probe_image_format(image_raw_data) not in DECODED_FORMATS:
+        return True
+    try:
+        with Image.open(io.BytesIO(image_raw_data)) as img:
+            img.draft("RGB", (256, 256))
+            img.load()
+    except Exception:
+        return False
+    return True
+
+
 def has_ext(filename: str, extenstions: list[str] | None = None) -> bool:
     if extenstions is None:
-        valid_extensions = [".png", ".jpg", ".gif", ".svg", ".PNG"]
+        valid_extensions = [".png", ".jpg", ".gif", ".svg", ".PNG", ".webp", ".avif"]
     else:
         valid_extensions = extenstions
     
@@ -58,58 +81,320 @@ def has_ext(filename: str, extenstions: list[str] | None = None) -> bool:
     return False
 
 
-def is_image_valid(path: str) -> bool:
+def is_image_valid(path: str, image_raw_data: bytes | None = None) -> bool:
+    """
+    Checks format and size of the downloaded bytes if given, else extension and size of the saved file.
+    Format of downloaded image is taken from its signature, srcset and CDN urls often have no extension.
+    """
+    metrics = get_metrics(config.METRICS_FLUSH_INTERVAL)
     try:
-        if not has_ext(path):
+        if image_raw_data is not None and probe_image_format(image_raw_data) not in IMAGE_EXTENSIONS:
+            logger.info("Image is not valid. Unknown image format")
+            metrics.inc("images_rejected_total", reason="bad_format")
+            return False
+        if image_raw_data is None and not has_ext(path):
+            metrics.inc("images_rejected_total", reason="bad_extension")
             return False
 
-        w, h = get_image_size(path)
-        if w > 240 and h > 240:
+        w, h = get_image_size(path) if image_raw_data is None else get_image_data_size(image_raw_data)
+        if w > config.IMAGE_MIN_SIZE and h > config.IMAGE_MIN_SIZE:
+            if image_raw_data is not None and not is_image_decodable(image_raw_data):
+                logger.info("Image is not valid. Corrupt or truncated image")
+                metrics.inc("images_rejected_total", reason="corrupt")
+                return False
             return True
     except Exception as ex:
         logger.error(f"Exception when image validation: {str(ex)}")
     
     logger.info("Image is not valid. small image size")
+    metrics.inc("images_rejected_total", reason="too_small")
     return False
 
 
-@app.task
-def download_image(absolute_src: str, save_dir: str):
+def make_image_name(absolute_src: str, image_hash: str, image_format: str | None = None) -> str:
+    """
+    Images are named by content hash, so the same image always gets the same name.
+    Extension comes from the format of image bytes if it is known, else from url.
+    """
+    logger.info(f"Received image path: {absolute_src}")
+    if image_format in IMAGE_EXTENSIONS:
+        return f"{image_hash}{IMAGE_EXTENSIONS[image_format]}"
+    _, file_ext = os.path.splitext(absolute_src)  # get file extension from URL
+    logger.info(f"Found extension: {file_ext}")
+    
+    # make correct file extension
+    file_ext = file_ext.replace("?", " ").replace("#", " ").replace("&", " ").replace("@", " ")
+    file_ext = file_ext.split(" ")[0]
+    file_ext = file_ext if file_ext != ".jpeg" else ".jpg"
+    logger.info(f"Clean extension: {file_ext}")
+    return f"{image_hash}{file_ext}"
+
+
+def blob_path(image_name: str) -> str:
+    return os.path.join(config.IMAGES_BLOBS_PATH, image_name[:2], image_name)
+
+
+def write_blob(path: str, image_raw_data: bytes):
+    """Written to a temporary file and renamed, so a blob is never seen half written."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(image_raw_data)
+    os.replace(tmp_path, path)
+
+
+def wait_for_blob(path: str) -> bool:
+    """Blob of a hash added by another worker may be still written, True when it exists."""
+    deadline = time.monotonic() + BLOB_WAIT_TIMEOUT
+    while not os.path.exists(path):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def link_blob(path: str, save_dir: str, image_name: str) -> bool:
+    """
+    Keyword folder references the blob with a hard link, it is copied if links are not supported.
+    Returns False if the image is already in this folder.
+    """
+    os.makedirs(save_dir, exist_ok=True)
+    image_path = os.path.join(save_dir, image_name)
+    linked = True
+    try:
+        os.link(path, image_path)
+    except FileExistsError:
+        linked = False
+    except OSError:
+        shutil.copyfile(path, image_path)
+    # exports list images from the manifest, not from the folder
+    ImageManifest(redis_client, config.SAVE_IMAGES_PATH).add(save_dir, image_name)
+    logger.info(f"Image path: {image_path}")
+    return linked
+
+
+def reserve_quota(save_dir: str) -> bool:
+    """Counts an image of the keyword folder, False if the keyword already has its target count."""
+    keyword = folder_keyword(save_dir)
+    if KeywordQuotas(redis_client).reserve(keyword):
+        return True
+    logger.info(f"Keyword {keyword} has enough images, do not save")
+    get_metrics(config.METRICS_FLUSH_INTERVAL).inc("images_rejected_total", reason="quota")
+    return False
+
+
+def link_reserved(path: str, save_dir: str, image_name: str) -> bool:
+    """Links the image with a reserved quota slot, False (slot released) if the folder already has it."""
+    if not link_blob(path, save_dir, image_name):
+        KeywordQuotas(redis_client).release(folder_keyword(save_dir))  # not a new image of the keyword
+        return False
+    return True
+
+
+def link_saved(path: str, save_dir: str, image_name: str) -> tuple[str, str] | None:
+    """
+    Links a saved blob to keyword folder, a quota slot is reserved only if the folder doesn't have it yet.
+    Returns (url cache status, blob name), None when the keyword has enough images.
+    """
+    if not os.path.exists(os.path.join(save_dir, image_name)):
+        if not reserve_quota(save_dir):
+            return None
+        link_reserved(path, save_dir, image_name)
+    return STORED, image_name
+
+
+def perceptual_hash(image_raw_data: bytes) -> int | None:
+    """Hash for the near duplicate check, None if the check is off or image is not decodable (SVG)."""
+    if not config.IMAGE_PHASH_DEDUP:
+        return None
+    return dhash(image_raw_data)
+
+
+def store_near_duplicate(image_phash: int, similar: tuple[int, str | None], save_dir: str) -> tuple[str, str] | None:
+    """
+    Resized or recompressed copy of a saved image is not saved again,
+    the saved image is linked to keyword folder like an exact duplicate.
+    """
+    similar_hash, similar_name = similar
+    logger.info(f"Near duplicate image, do not save. Hash {image_phash:016x} is close to {similar_hash:016x}")
+    if similar_name and os.path.exists(blob_path(similar_name)):
+        return link_saved(blob_path(similar_name), save_dir, similar_name)
+    # saved before image names were indexed or still being written
+    get_metrics(config.METRICS_FLUSH_INTERVAL).inc("images_rejected_total", reason="near_duplicate")
+    return REJECTED, ""
+
+
+def store_image(absolute_src: str, save_dir: str, image_raw_data: bytes) -> tuple[str, str] | None:
+    """
+    Saves image once as a blob named by its hash and links it to keyword folder.
+    SADD result is the atomic dedup check: only the worker which added the hash writes the blob.
+    Returns (url cache status, blob name), None on error or when the keyword has enough images.
+    """
     try:
-        os.makedirs(save_dir, exist_ok=True)
-        logger.info(f"Received image path: {absolute_src}")
-        _, file_ext = os.path.splitext(absolute_src)  # get file extension from URL
-        logger.info(f"Found extension: {file_ext}")
-        
-        # make correct file extension
-        file_ext = file_ext.replace("?", " ").replace("#", " ").replace("&", " ").replace("@", " ")
-        file_ext = file_ext.split(" ")[0]
-        file_ext = file_ext if file_ext != ".jpeg" else ".jpg"
-        logger.info(f"Clean extension: {file_ext}")
-        
-        new_image_name = datetime.now().strftime("%Y_%m_%d_%H_%M_%S_%f")
-        path = os.path.join(save_dir, f"{new_image_name}{file_ext}")
-        logger.info(f"Image path to save: {path}")
-        # TODO: check ext before saving ??
-        response = requests.get(absolute_src, timeout=5)
-        response.raise_for_status()
-        
-        image_raw_data = response.content
         image_hash = hashlib.md5(image_raw_data).hexdigest()
-        if not redis_client.sismember("image_hashes", image_hash):  # check if image already saved
-            image = np.asarray(bytearray(image_raw_data), dtype="uint8")
-            image = cv2.imdecode(image, cv2.IMREAD_COLOR)
-            cv2.imwrite(path, image)
-            
-            redis_client.sadd("image_hashes", image_hash)
-            
-            # check image, if not valid - delete
-            if not is_image_valid(path):
-                os.remove(path)
-            else:
-                redis_client.incr("saved_images_count")
+        image_name = make_image_name(absolute_src, image_hash, probe_image_format(image_raw_data))
+        path = blob_path(image_name)
+
+        # validated in memory before dedup, invalid images do not get into the hash set
+        if not is_image_valid(image_name, image_raw_data):
+            return REJECTED, ""
+
+        metrics = get_metrics(config.METRICS_FLUSH_INTERVAL)
+        if redis_client.sadd("image_hashes", image_hash):
+            image_phash = perceptual_hash(image_raw_data)
+            phash_index = PerceptualHashIndex(redis_client, config.IMAGE_PHASH_DISTANCE)
+            # checked before the quota slot is reserved, so the crawl never sees a target reached by a rejected image
+            if image_phash is not None:
+                similar = phash_index.find_or_add(image_phash, image_name)
+                if similar is not None:
+                    redis_client.srem("image_hashes", image_hash)  # exact copies are checked against the index too
+                    return store_near_duplicate(image_phash, similar, save_dir)
+            if not reserve_quota(save_dir):
+                redis_client.srem("image_hashes", image_hash)  # can be saved for another keyword
+                if image_phash is not None:
+                    phash_index.remove(image_phash)
+                return None
+            try:
+                write_blob(path, image_raw_data)
+            except Exception:
+                redis_client.srem("image_hashes", image_hash)  # another worker can save it
+                if image_phash is not None:
+                    phash_index.remove(image_phash)
+                KeywordQuotas(redis_client).release(folder_keyword(save_dir))
+                raise
+            if link_reserved(path, save_dir, image_name):
+                metrics.inc_key("saved_images_count")
+                metrics.inc("images_saved_total")
                 logger.info("Image saved")
-        else:
+        elif wait_for_blob(path):
+            # the same image found by another keyword, only a link is added
+            logger.info("Duplicate image, linked to saved one")
+            return link_saved(path, save_dir, image_name)
+        elif redis_client.sismember("image_hashes", image_hash):
+            # saved image was exported and removed
             logger.info("Duplicate image, do not save")
+            metrics.inc("images_rejected_total", reason="duplicate")
+            return REJECTED, ""
+        else:
+            return None  # the worker which added the hash failed, the url is not remembered and can be saved later
+        return STORED, image_name
     except Exception as ex:
+        logger.error(f"Error saving: {absolute_src}: {ex}")
+
+
+def store_cached(absolute_src: str, save_dir: str, entry: dict[str, str]):
+    """Image url was downloaded before, a saved image is only linked to save_dir."""
+    if entry["status"] == STORED and os.path.exists(blob_path(entry["name"])):
+        if link_saved(blob_path(entry["name"]), save_dir, entry["name"]) is not None:
+            url_cache.add_dir(absolute_src, save_dir)
+    else:
+        logger.info(f"Image url is known, do not download: {absolute_src}")
+
+
+def download_error_reason(ex: BaseException) -> str:
+    if isinstance(ex, ImageTooLarge):
+        return "too_large"
+    if isinstance(ex, httpx.HTTPStatusError):
+        return f"http_{ex.response.status_code}"
+    return "download_error"
+
+
+def handle_failed_download(absolute_src: str, save_dir: str, entry: dict[str, str] | None, ex: BaseException):
+    """Not modified image is linked from the cache, too small one is remembered as rejected."""
+    metrics = get_metrics(config.METRICS_FLUSH_INTERVAL)
+    if isinstance(ex, NotModified):
+        url_cache.touch(absolute_src)
+        store_cached(absolute_src, save_dir, entry)
+        metrics.inc("images_cached_total")
+    elif isinstance(ex, ImageTooSmall):
+        logger.info(f"Image is not valid. {ex}")
+        url_cache.set(absolute_src, REJECTED)
+        metrics.inc("images_rejected_total", reason="too_small")
+    else:
         logger.error(f"Error downloading: {absolute_src}: {ex}")
+        metrics.inc("images_rejected_total", reason=download_error_reason(ex))
+
+
+def store_download(absolute_src: str, save_dir: str, image_raw_data: bytes, etag: str = "", last_modified: str = ""):
+    """Validates and saves downloaded image, the result is remembered by url cache."""
+    metrics = get_metrics(config.METRICS_FLUSH_INTERVAL)
+    metrics.inc("images_downloaded_total")
+    metrics.inc("images_downloaded_bytes_total", len(image_raw_data))
+    metrics.observe("images_downloaded_bytes", len(image_raw_data), buckets=SIZE_BUCKETS)
+
+    stored = store_image(absolute_src, save_dir, image_raw_data)
+    if stored is not None:
+        status, image_name = stored
+        url_cache.set(
+            absolute_src,
+            status,
+            image_name,
+            etag=etag,
+            last_modified=last_modified,
+            save_dir=save_dir if status == STORED else "",
+        )
+
+
+def download_and_store(images: list[tuple[str, str]]):
+    """
+    Downloads (image url, save dir) concurrently with the pooled async downloader of this process
+    and stores every downloaded image. Urls known by url cache are not downloaded,
+    stale ones are revalidated with ETag/Last-Modified.
+    """
+    metrics = get_metrics(config.METRICS_FLUSH_INTERVAL)
+    try:
+        satisfied = KeywordQuotas(redis_client).satisfied({folder_keyword(save_dir) for _, save_dir in images})
+    except redis.RedisError as ex:
+        logger.error(f"Error while reading keyword quotas: {str(ex)}")
+        satisfied = set()
+    if satisfied:
+        logger.info(f"Keywords {', '.join(sorted(satisfied))} have enough images, their images are skipped")
+        images = [(absolute_src, save_dir) for absolute_src, save_dir in images if folder_keyword(save_dir) not in satisfied]
+
+    to_download: dict[str, list[tuple[str, dict[str, str] | None]]] = {}  # url -> (save dir, entry), downloaded once
+    for (absolute_src, save_dir), entry in zip(images, url_cache.get_many([src for src, _ in images])):
+        if entry is not None and url_cache.is_fresh(entry):
+            store_cached(absolute_src, save_dir, entry)
+            metrics.inc("images_cached_total")
+        else:
+            to_download.setdefault(absolute_src, []).append((save_dir, entry))
+    if not to_download:
+        metrics.flush()
+        return
+
+    downloader = get_downloader(
+        concurrency=config.IMAGE_DOWNLOAD_CONCURRENCY,
+        max_bytes=config.IMAGE_MAX_BYTES,
+        timeout=config.IMAGE_DOWNLOAD_TIMEOUT,
+        min_bytes=config.IMAGE_MIN_BYTES,
+        min_size=config.IMAGE_MIN_SIZE,
+    )
+    urls = list(to_download)
+    results = downloader.fetch_many(urls, [url_cache.validators(to_download[url][0][1]) for url in urls])
+    for absolute_src, result in zip(urls, results):
+        for save_dir, entry in to_download[absolute_src]:
+            if isinstance(result, BaseException):
+                handle_failed_download(absolute_src, save_dir, entry, result)
+            else:
+                store_download(
+                    absolute_src,
+                    save_dir,
+                    result,
+                    etag=getattr(result, "etag", ""),
+                    last_modified=getattr(result, "last_modified", ""),
+                )
+    # one pipeline per batch, counters of an idle worker are not kept in memory
+    metrics.flush()
+
+
+@app.task
+def download_image(absolute_src: str, save_dir: str):
+    download_and_store([(absolute_src, save_dir)])
+
+
+@app.task
+def download_images(images: list[tuple[str, str]]):
+    """
+    Downloads batch of (image url, save dir) sent by crawler.
+    """
+    download_and_store(images)
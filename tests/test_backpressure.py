@@ -0,0 +1,39 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+from backpressure import DownloadBackpressure
+
+
+def test_backpressure_watermarks():
+    """Crawling pauses at the high watermark and resumes only at the low one."""
+    redis_client = fakeredis.FakeRedis()
+    backpressure = DownloadBackpressure(redis_client, "celery", high=3, low=1, check_interval=0)
+
+    redis_client.rpush("celery", "batch", "batch")
+    assert not backpressure.check()
+    redis_client.rpush("celery", "batch")
+    assert backpressure.check()
+    redis_client.lpop("celery")
+    assert backpressure.check()  # 2 batches, still above the low watermark
+    redis_client.lpop("celery")
+    assert not backpressure.check()
+    assert backpressure.depth == 1
+
+
+@pytest.mark.asyncio
+async def test_backpressure_wait():
+    """Waiting ends when the queue drains or crawling is stopped."""
+    redis_client = fakeredis.FakeRedis()
+    redis_client.rpush("celery", *["batch"] * 5)
+    backpressure = DownloadBackpressure(redis_client, "celery", high=5, low=0, check_interval=0.01)
+
+    waiter = asyncio.create_task(backpressure.wait({"running": True}))
+    await asyncio.sleep(0.05)
+    assert not waiter.done()
+    redis_client.delete("celery")
+    await asyncio.wait_for(waiter, timeout=1)
+
+    redis_client.rpush("celery", *["batch"] * 5)
+    await asyncio.wait_for(backpressure.wait({"running": False}), timeout=1)
@@ -20,3 +20,13 @@ def test_config_load():
         assert c.SERVER_PORT == "5000"
         assert c.SAVE_IMAGES_PATH == "test_images"
         assert c.IMAGES_ARCHIVE_NAME == "test_archive"
+
+
+def test_images_batch_size_follows_download_concurrency():
+    """A Celery process downloads one batch at a time, the default batch fills every download slot."""
+    from config import Config
+    with patch.dict(os.environ, {"IMAGE_DOWNLOAD_CONCURRENCY": "300"}):
+        os.environ.pop("IMAGES_BATCH_SIZE", None)
+        assert Config(init_env=False).IMAGES_BATCH_SIZE == 300
+    with patch.dict(os.environ, {"IMAGE_DOWNLOAD_CONCURRENCY": "300", "IMAGES_BATCH_SIZE": "50"}):
+        assert Config(init_env=False).IMAGES_BATCH_SIZE == 50
@@ -0,0 +1,69 @@
+import fakeredis
+from unittest.mock import patch
+
+from crawl_state import CrawlStateStore, make_crawl_id
+from seen_filter import BloomFilter, ExactSeenSet
+
+
+def test_make_crawl_id():
+    assert make_crawl_id({"cat", "dog"}, "photo") == make_crawl_id({"dog", "cat"}, "photo")
+    assert make_crawl_id({"cat"}, "photo") != make_crawl_id({"cat"}, "")
+
+
+def test_crawl_state_store_checkpoint_and_restore():
+    fake_redis = fakeredis.FakeRedis()
+    store = CrawlStateStore(fake_redis, "test", batch_size=2)
+    seen = BloomFilter(capacity=100, error_rate=0.01)
+
+    store.add("http://example.com/a", 5, 1, "cat")
+    assert not store.exists()  # batch is not full yet
+    store.add("http://example.com/b", 3, 2, "dog")
+    assert store.exists()
+    store.remove("http://example.com/a", 1)
+    seen.add("http://example.com/a")
+    seen.add("http://example.com/b")
+    store.checkpoint(seen, visited_count=7)
+
+    restored_store = CrawlStateStore(fake_redis, "test")
+    restored_seen = BloomFilter(capacity=100, error_rate=0.01)
+    assert restored_store.restore(restored_seen) == 7
+    assert "http://example.com/a" in restored_seen
+    assert len(restored_seen) == 2
+    assert list(restored_store.iter_frontier()) == [("http://example.com/b", 3.0, 2)]
+    assert restored_store.url_keywords() == {"http://example.com/b": "dog"}
+
+    restored_store.clear()
+    assert not restored_store.exists()
+    assert restored_store.url_keywords() == {}
+
+
+def test_crawl_state_store_exact_seen_set():
+    fake_redis = fakeredis.FakeRedis()
+    store = CrawlStateStore(fake_redis, "test")
+    seen = ExactSeenSet()
+    seen.add("http://example.com/")
+    store.checkpoint(seen, visited_count=1)
+
+    restored_seen = ExactSeenSet()
+    store.restore(restored_seen)
+    assert "http://example.com/" in restored_seen
+
+
+def test_crawl_state_store_seen_changes():
+    """Checkpoints after the first one write changed bytes of the filter, a crawl with only seen urls is resumed."""
+    fake_redis = fakeredis.FakeRedis()
+    store = CrawlStateStore(fake_redis, "test")
+    seen = BloomFilter(capacity=100_000, error_rate=0.01)
+    seen.add("http://example.com/a")
+    store.checkpoint(seen, visited_count=1)
+    assert store.exists()  # frontier is empty
+
+    seen.add("http://example.com/b")
+    with patch("redis.client.Pipeline.set") as mock_set:
+        store.checkpoint(seen, visited_count=2)
+    mock_set.assert_not_called()  # ~120 KB filter is not written again
+    assert fake_redis.get(store.seen_key) == seen.dump()
+
+    restored_seen = BloomFilter(capacity=100_000, error_rate=0.01)
+    CrawlStateStore(fake_redis, "test").restore(restored_seen)
+    assert "http://example.com/b" in restored_seen
@@ -1,12 +1,17 @@
+import asyncio
+import fakeredis
 import pytest
 from unittest.mock import patch, MagicMock
 from crawler import Crawler
+from scheduler import HostScheduler
+from metrics import HOST_PAGES_KEY, get_metrics
+from quotas import SAVED_KEY
 
 @pytest.mark.asyncio
-@patch("crawler.download_image.delay")
+@patch("crawler.download_images.delay")
 @patch("crawler.httpx.AsyncClient.get")
 async def test_crawler_scrape_images(mock_get, mock_download):
-    """Check that images are scanned and a Celery task is called."""
+    """Check that images are scanned and a Celery task is called with a batch of images."""
     mock_response = MagicMock()
     mock_response.raise_for_status = MagicMock()
 
@@ -23,28 +28,26 @@ async def test_crawler_scrape_images(mock_get, mock_download):
     mock_get.return_value = mock_response
 
     c = Crawler(keywords=["cat", "dog"], text_to_keyword="")
+    c.dispatcher.url_cache.redis = fakeredis.FakeRedis()
     links = await c.scrape_images("http://example.com")
 
     assert len(links) == 2
-    
+
+    mock_download.assert_not_called()  # images are buffered until the batch is flushed
+    c.dispatcher.flush()
     mock_download.assert_called_once()
     call_args, call_kwargs = mock_download.call_args
     
-    assert call_args[0] == "http://example.com/image.jpg"
-    assert "cat" in call_args[1]  
+    (image_src, save_dir), = call_args[0]
+    assert image_src == "http://example.com/image.jpg"
+    assert "cat" in save_dir
 
 
 @pytest.mark.asyncio
 async def test_image_find_keyword():
     """Check keyword detection in image attributes."""
-    from bs4 import BeautifulSoup
-
-    html = """<img src="test.png" alt="Cute Cat" title="Something else" />"""
-    soup = BeautifulSoup(html, "html.parser")
-    img_tag = soup.find("img")
-
     c = Crawler(keywords=["cat", "dog"], text_to_keyword="")
-    found = c.image_find_keyword(img_tag, "test.png")
+    found = c.image_find_keyword("Cute Cat", "Something else", "test.png")
     assert "cat" in found
 
 
@@ -71,3 +74,249 @@ def test_crawler_stop_parsing(mock_celery_purge, mock_process):
 
     instance = mock_process.return_value
     instance.join.assert_called_once()
+
+
+# crawler settings of the tests below, the broker is not running
+CRAWL_ENV = {
+    "CRAWLER_RESPECT_ROBOTS": "false",
+    "CRAWLER_SEEN_FILTER": "exact",
+    "CRAWLER_PERSIST_STATE": "false",
+    "IMAGES_QUEUE_HIGH_WATERMARK": "0",
+}
+
+
+@pytest.fixture
+def crawl_env(monkeypatch):
+    """Sets CRAWL_ENV and extra variables for the whole test, the crawler reads config while crawling."""
+    def set_env(**env):
+        for name, value in {**CRAWL_ENV, **env}.items():
+            monkeypatch.setenv(name, value)
+    return set_env
+
+
+def site_scraper(site: dict, crawled: list, delay: float = 0):
+    """Replaces scrape_images: records crawled page and returns its links from `site`."""
+    async def fake_scrape_images(page_url):
+        crawled.append(page_url)
+        if delay:
+            await asyncio.sleep(delay)
+        return site[page_url]
+    return fake_scrape_images
+
+
+def make_crawler(urls: list[str], scrape_images, keywords=("cat",)) -> Crawler:
+    c = Crawler(list(keywords), "")
+    c.urls = urls
+    c.scrape_images = scrape_images
+    c.quotas.redis = fakeredis.FakeRedis()
+    return c
+
+
+@pytest.mark.asyncio
+@patch("crawler.redis_client")
+async def test_crawler_worker_pool(mock_redis, crawl_env):
+    """Check that workers drain the shared frontier and fetch pages concurrently."""
+    site = {
+        "http://example.com/": {"http://example.com/a": "", "http://example.com/b": ""},
+        "http://example.com/a": {"http://example.com/c": "", "http://example.com/": ""},
+        "http://example.com/b": {"http://example.com/c": ""},
+        "http://example.com/c": {},
+    }
+    in_flight = 0
+    max_in_flight = 0
+    crawled = []
+    scrape = site_scraper(site, crawled, delay=0.01)
+
+    async def fake_scrape_images(page_url):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        links = await scrape(page_url)
+        in_flight -= 1
+        return links
+
+    crawl_env(CRAWLER_WORKERS="4", CRAWLER_CONCURRENCY="4")
+    metrics_redis = fakeredis.FakeRedis()
+    with patch.object(get_metrics(), "redis", metrics_redis):
+        c = make_crawler(["http://example.com/"], fake_scrape_images)
+        await c.start_crawling({"running": True})
+
+    assert sorted(crawled) == sorted(site)
+    assert c.visited_count == len(site)
+    assert max_in_flight == 2  # a and b are crawled at the same time
+    # counters are batched in memory and written when crawling is finished
+    assert int(metrics_redis.get("crawled_links_count")) == len(site)
+    assert metrics_redis.zscore(HOST_PAGES_KEY, "example.com") == len(site)
+
+
+@pytest.mark.asyncio
+@patch("crawler.redis_client")
+async def test_crawler_max_depth(mock_redis, crawl_env):
+    """Links deeper than CRAWLER_MAX_DEPTH are not crawled."""
+    crawled = []
+
+    async def fake_scrape_images(page_url):
+        crawled.append(page_url)
+        depth = int(page_url.rsplit("/", 1)[-1] or 0)
+        return {f"http://example.com/{depth + 1}": "next"}
+
+    crawl_env(CRAWLER_MAX_DEPTH="2")
+    c = make_crawler(["http://example.com/0"], fake_scrape_images)
+    await c.start_crawling({"running": True})
+
+    assert crawled == ["http://example.com/0", "http://example.com/1", "http://example.com/2"]
+
+
+@pytest.mark.asyncio
+@patch("crawler.redis_client")
+async def test_crawler_backpressure_error_keeps_workers(mock_redis, crawl_env):
+    """Failing backpressure check is logged, workers keep crawling."""
+    crawled = []
+    site = {"http://example.com/": {}, "http://example.org/": {}}
+
+    crawl_env(CRAWLER_WORKERS="2", IMAGES_QUEUE_HIGH_WATERMARK="1000")
+    c = make_crawler(list(site), site_scraper(site, crawled))
+    c.backpressure.wait = MagicMock(side_effect=TypeError("broken"))
+    await asyncio.wait_for(c.start_crawling({"running": True}), 10)  # dead workers never drain the frontier
+
+    assert sorted(crawled) == sorted(site)
+    assert c.backpressure.wait.call_count >= 2
+
+
+@pytest.mark.asyncio
+async def test_crawler_enqueue_canonical_urls(crawl_env):
+    """Trivially different urls are queued only once, not http links are skipped."""
+    crawl_env()
+    c = Crawler(["cat"], "")
+    c.frontier = MagicMock()
+    c.frontier.put_nowait.return_value = True
+
+    c.enqueue("http://Example.com/page/?b=2&a=1#top", "", 1)
+    c.enqueue("http://example.com:80/page?a=1&b=2&utm_source=x", "", 1)
+    c.enqueue("mailto:someone@example.com", "", 1)
+
+    c.frontier.put_nowait.assert_called_once()
+    assert c.frontier.put_nowait.call_args[0][0] == "http://example.com/page?a=1&b=2"
+
+
+@pytest.mark.asyncio
+async def test_crawler_resume_from_saved_state(crawl_env):
+    """Stopped crawl is saved to redis and the next crawl continues it without refetching pages."""
+    fake_redis = fakeredis.FakeRedis()
+    site = {
+        "http://example.com/": {"http://example.com/a": "", "http://example.com/b": ""},
+        "http://example.com/a": {"http://example.com/b": "", "http://example.com/c": ""},
+        "http://example.com/b": {},
+        "http://example.com/c": {},
+    }
+    crawled = []
+
+    def make_scrape(shared_data, stop_after):
+        scrape = site_scraper(site, crawled)
+
+        async def fake_scrape_images(page_url):
+            links = await scrape(page_url)
+            if len(crawled) == stop_after:
+                shared_data["running"] = False
+            return links
+        return fake_scrape_images
+
+    crawl_env(
+        CRAWLER_WORKERS="1", CRAWLER_PERSIST_STATE="true", CRAWLER_SEEN_FILTER="bloom", CRAWLER_SEEN_CAPACITY="1000"
+    )
+    with patch("crawler.redis_client", fake_redis):
+        shared_data = {"running": True}
+        c = make_crawler(["http://example.com/"], make_scrape(shared_data, stop_after=2))
+        await c.start_crawling(shared_data)
+        assert c.state_store.exists()
+
+        shared_data = {"running": True}
+        c = make_crawler(["http://example.com/"], make_scrape(shared_data, stop_after=0))
+        await c.start_crawling(shared_data)
+
+    assert sorted(crawled) == sorted(site)  # every page is crawled once
+    assert c.visited_count == len(site)
+    assert not c.state_store.exists()  # finished crawl is removed
+
+
+# every host links to every other one
+HOSTS_SITE = {
+    f"http://host{i}.com/": {f"http://host{j}.com/": "" for j in range(8) if j != i}
+    for i in range(8)
+}
+
+
+@pytest.mark.asyncio
+async def test_crawler_shards(crawl_env):
+    """Two shards crawl a site together, every page is crawled once and both shards finish."""
+    crawled = []
+    crawl_env(CRAWLER_SHARDS="2", CRAWLER_SYNC_INTERVAL="0.05")
+    with patch("crawler.redis_client", fakeredis.FakeRedis()):
+        shards = []
+        for _ in range(2):
+            c = make_crawler(["http://host0.com/"], site_scraper(HOSTS_SITE, crawled, delay=0.01))
+            c.set_shard(c.coordinator.claim_shard())
+            shards.append(c)
+
+        shared_data = {"running": True}
+        await asyncio.wait_for(asyncio.gather(*(c.start_crawling(shared_data) for c in shards)), 10)
+
+    assert sorted(crawled) == sorted(HOSTS_SITE)
+    assert all(c.visited_count > 0 for c in shards)  # both shards got hosts
+
+
+@pytest.mark.asyncio
+async def test_crawler_shard_takes_unclaimed_shard(crawl_env):
+    """A single running shard crawls hosts of the shard without a process, its frontier stays bounded."""
+    crawled = []
+    frontier_sizes = []
+    scrape = site_scraper(HOSTS_SITE, crawled, delay=0.01)
+
+    async def fake_scrape_images(page_url):
+        frontier_sizes.append(c.frontier.qsize())
+        return await scrape(page_url)
+
+    crawl_env(CRAWLER_SHARDS="2", CRAWLER_SHARD_FRONTIER_SIZE="2", CRAWLER_SYNC_INTERVAL="0.05")
+    with patch("crawler.redis_client", fakeredis.FakeRedis()):
+        c = make_crawler(["http://host0.com/"], fake_scrape_images)
+        c.set_shard(c.coordinator.claim_shard())
+        await asyncio.wait_for(c.start_crawling({"running": True}), 10)
+
+    assert sorted(crawled) == sorted(HOSTS_SITE)
+    assert max(frontier_sizes) <= 2
+
+
+@pytest.mark.asyncio
+@patch("crawler.redis_client")
+async def test_crawler_keyword_quotas(mock_redis, crawl_env):
+    """Pages of a keyword which has enough images are not crawled."""
+    site = {
+        "http://cats.com/": {"http://cats.com/a": ""},
+        "http://cats.com/a": {},
+        "http://dogs.com/": {"http://dogs.com/a": ""},
+        "http://dogs.com/a": {},
+    }
+    crawled = []
+
+    crawl_env()
+    with patch.object(get_metrics(), "redis", fakeredis.FakeRedis()):
+        c = make_crawler(["http://cats.com/", "http://dogs.com/"], site_scraper(site, crawled), keywords=("cat", "dog"))
+        c.seed_keywords = {"http://cats.com/": "cat", "http://dogs.com/": "dog"}
+        c.quotas.set_target("cat", 10)
+        c.quotas.redis.hset(SAVED_KEY, "cat", 10)
+        await c.start_crawling({"running": True})
+
+    assert sorted(crawled) == ["http://dogs.com/", "http://dogs.com/a"]
+    assert c.satisfied == {"cat"}
+
+
+@pytest.mark.asyncio
+async def test_crawler_url_keywords_only_for_frontier_urls(crawl_env):
+    """Branch keyword is kept only for urls which got into the frontier."""
+    crawl_env(CRAWLER_MAX_PAGES_PER_HOST="1")
+    c = Crawler(["cat"], "")
+    c.frontier = HostScheduler(per_host_concurrency=1, rate=1, burst=1, max_pages_per_host=1)
+    c.enqueue("http://cats.com/a", "", 1, "cat")
+    c.enqueue("http://cats.com/b", "", 1, "cat")  # over the per-host page cap
+
+    assert c.url_keywords == {"http://cats.com/a": "cat"}
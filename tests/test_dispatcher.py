@@ -0,0 +1,50 @@
+from unittest.mock import MagicMock, patch
+
+from dispatcher import DownloadDispatcher
+
+
+def test_dispatcher_flush_by_size():
+    task = MagicMock()
+    dispatcher = DownloadDispatcher(task, batch_size=2, flush_interval=60)
+
+    dispatcher.add("http://example.com/1.jpg", "images/cat")
+    dispatcher.add("http://example.com/1.jpg", "images/cat")  # the same image is sent once
+    task.delay.assert_not_called()
+
+    dispatcher.add("http://example.com/1.jpg", "images/kitten")  # and once for every keyword
+    task.delay.assert_called_once_with([
+        ("http://example.com/1.jpg", "images/cat"),
+        ("http://example.com/1.jpg", "images/kitten"),
+    ])
+
+
+@patch("dispatcher.time.monotonic")
+def test_dispatcher_flush_by_time(mock_time):
+    mock_time.return_value = 100
+    task = MagicMock()
+    dispatcher = DownloadDispatcher(task, batch_size=100, flush_interval=2)
+    dispatcher.add("http://example.com/1.jpg", "images/cat")
+
+    dispatcher.maybe_flush()
+    task.delay.assert_not_called()
+
+    mock_time.return_value = 102
+    dispatcher.maybe_flush()
+    task.delay.assert_called_once_with([("http://example.com/1.jpg", "images/cat")])
+
+
+def test_dispatcher_skips_known_urls():
+    import fakeredis
+    from url_cache import REJECTED, STORED, ImageUrlCache
+
+    cache = ImageUrlCache(fakeredis.FakeRedis(), ttl=3600, revalidate_after=600)
+    cache.set("http://example.com/logo.png", REJECTED)
+    cache.set("http://example.com/1.jpg", STORED, "abc.jpg", save_dir="images/cat")
+    task = MagicMock()
+    dispatcher = DownloadDispatcher(task, batch_size=100, flush_interval=2, url_cache=cache)
+
+    dispatcher.add("http://example.com/logo.png", "images/cat")
+    dispatcher.add("http://example.com/1.jpg", "images/cat")
+    dispatcher.add("http://example.com/2.jpg", "images/cat")
+    dispatcher.flush()
+    task.delay.assert_called_once_with([("http://example.com/2.jpg", "images/cat")])
@@ -0,0 +1,119 @@
+import fakeredis
+
+from distributed import ShardCoordinator, RedisSharedData, shard_for_host, CRAWL_JOB_KEY
+from url_utils import get_host
+
+
+def test_shard_for_host():
+    assert shard_for_host("example.com", 4) == shard_for_host("example.com", 4)
+    assert {shard_for_host(f"host{i}.com", 4) for i in range(100)} == {0, 1, 2, 3}
+
+
+def foreign_urls(coordinator: ShardCoordinator, count: int) -> list[str]:
+    """Urls of different hosts which belong to other shards."""
+    urls = (f"http://host{i}.com/" for i in range(1000))
+    shard_id = lambda url: shard_for_host(get_host(url), coordinator.shards_count)
+    return [url for url in urls if shard_id(url) != coordinator.shard_id][:count]
+
+
+def test_shard_coordinator_send_and_steal():
+    fake_redis = fakeredis.FakeRedis()
+    first = ShardCoordinator(fake_redis, "test", 0, 2, steal_threshold=1)
+    second = ShardCoordinator(fake_redis, "test", 1, 2, steal_threshold=1)
+    assert first.claim_shard() == 0
+    assert second.claim_shard() == 1
+    assert first.claim_shard() is None
+
+    foreign = foreign_urls(first, 5)
+    first.send(foreign[0], 5, 1)
+    first.send(foreign[0], 7, 1)
+    assert first.sync(local_idle=True) == []  # sent, too few urls to steal
+    assert not first.is_finished()
+    assert second.sync(local_idle=False) == [(foreign[0], 7.0, 1)]
+    assert second.holds(foreign[0])
+
+    for url in foreign[1:5]:
+        first.send(url, 1, 2)
+    first.flush()
+    assert len(first.sync(local_idle=True)) == 2  # idle shard steals a half of second shard inbox
+    assert len(second.sync(local_idle=True)) == 2
+    assert first.sync(local_idle=True) == []
+    assert second.sync(local_idle=True) == []
+    assert first.is_finished()
+    assert second.is_finished()
+
+
+def test_shard_coordinator_drains_unclaimed_shard():
+    """Links to hosts of a shard without a process are crawled by idle shards, then the crawl finishes."""
+    fake_redis = fakeredis.FakeRedis()
+    first = ShardCoordinator(fake_redis, "test", 0, 2)
+    assert first.claim_shard() == 0
+
+    foreign = foreign_urls(first, 10)
+    for url in foreign:
+        first.send(url, 1, 1)
+    assert len(first.sync(local_idle=True, room=4)) == 4  # only what fits in the local frontier
+    assert not first.is_finished()
+    assert len(first.sync(local_idle=False, room=10)) == 0  # busy shard takes only its own urls
+    assert len(first.sync(local_idle=True, room=10)) == 6
+    assert first.sync(local_idle=True) == []
+    assert first.is_finished()
+
+
+def test_shard_coordinator_host_leases():
+    """A host is crawled by one shard, its urls go to the lease holder until the lease is released."""
+    fake_redis = fakeredis.FakeRedis()
+    first = ShardCoordinator(fake_redis, "test", 0, 2)
+    second = ShardCoordinator(fake_redis, "test", 1, 2)
+    first.claim_shard()
+    second.claim_shard()
+
+    url = foreign_urls(first, 1)[0]
+    assert first.take([(url, 1.0, 1)]) == [(url, 1.0, 1)]  # e.g. stolen
+    assert first.holds(url)
+    # the shard of the host by hash forwards urls of the leased host
+    fake_redis.zadd(second.inbox_key(1), {f"1 {url}a": 2})
+    assert second.sync(local_idle=False) == []
+    assert first.sync(local_idle=False) == [(url + "a", 2.0, 1)]
+    # own backlog of a leased host waits in own inbox
+    first.send(url + "b", 1, 1)
+    assert first.sync(local_idle=False) == [(url + "b", 1.0, 1)]
+
+    first.sync(local_idle=False, drained_hosts=[get_host(url)])
+    assert not first.holds(url)
+    assert second.take([(url + "c", 1.0, 1)]) == [(url + "c", 1.0, 1)]
+
+
+def test_shard_coordinator_queues_url_once():
+    """A url taken by one shard is dropped when it is sent again, after its host lease was released too."""
+    fake_redis = fakeredis.FakeRedis()
+    first = ShardCoordinator(fake_redis, "test", 0, 2)
+    second = ShardCoordinator(fake_redis, "test", 1, 2)
+    first.claim_shard()
+
+    url = foreign_urls(first, 1)[0]
+    first.send(url, 1, 1)
+    first.flush()
+    assert first.sync(local_idle=True) == [(url, 1.0, 1)]  # stolen from the unclaimed shard
+    second.claim_shard()
+    first.sync(local_idle=True, drained_hosts=[get_host(url)])
+    first.send(url, 1, 2)
+    assert second.sync(local_idle=False) == []  # the shard of its host got it again
+    assert first.mark_queued([url, url + "a"]) == {url + "a"}
+
+    # restored frontier is queued already, urls forwarded to the lease holder are queued by it
+    second.mark_queued([url + "b", url + "c"])  # queued by second before the crawl was stopped
+    assert first.take([(url + "d", 1.0, 1)]) == [(url + "d", 1.0, 1)]
+    assert second.take([(url + "b", 1.0, 1), (url + "c", 1.0, 1)], check_queued=False) == []
+    assert sorted(first.sync(local_idle=False)) == [(url + "b", 1.0, 1), (url + "c", 1.0, 1)]
+
+    first.reset(resume=False)
+    assert first.mark_queued([url]) == {url}
+
+
+def test_redis_shared_data():
+    fake_redis = fakeredis.FakeRedis()
+    fake_redis.hset(CRAWL_JOB_KEY, "started_at", "1")
+    assert RedisSharedData(fake_redis, b"1")["running"] is True
+    fake_redis.delete(CRAWL_JOB_KEY)
+    assert RedisSharedData(fake_redis, b"1")["running"] is False
@@ -0,0 +1,68 @@
+import asyncio
+import struct
+
+import httpx
+import pytest
+
+from downloader import AsyncImageDownloader, ImageTooLarge, ImageTooSmall
+
+
+def make_downloader(handler, max_bytes=1024):
+    downloader = AsyncImageDownloader(concurrency=10, max_bytes=max_bytes, timeout=5, http2=False)
+
+    async def use_mock_transport():
+        downloader.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    downloader.run(use_mock_transport())
+    return downloader
+
+
+def test_downloader_fetch_many():
+    in_flight = 0
+    max_in_flight = 0
+
+    async def handler(request):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        if request.url.path == "/missing.png":
+            return httpx.Response(404)
+        return httpx.Response(200, content=request.url.path.encode())
+
+    downloader = make_downloader(handler)
+    urls = [f"http://example.com/{i}.png" for i in range(5)] + ["http://example.com/missing.png"]
+    results = downloader.fetch_many(urls)
+
+    assert results[:5] == [f"/{i}.png".encode() for i in range(5)]
+    assert isinstance(results[5], httpx.HTTPStatusError)
+    assert max_in_flight > 1  # images are downloaded concurrently
+
+
+def test_downloader_max_bytes():
+    def handler(request):
+        return httpx.Response(200, content=b"x" * 2048)
+
+    downloader = make_downloader(handler)
+    with pytest.raises(ImageTooLarge):
+        downloader.run(downloader.fetch("http://example.com/big.png"))
+
+
+def test_downloader_stops_on_small_image_header():
+    chunks_sent = 0
+
+    async def stream():
+        nonlocal chunks_sent
+        header = b"GIF89a" + struct.pack("<HH", 16, 16)
+        for chunk in (header, *[b"x" * 1024] * 10):
+            chunks_sent += 1
+            yield chunk
+
+    def handler(request):
+        return httpx.Response(200, content=stream())
+
+    downloader = make_downloader(handler, max_bytes=1024 * 1024)
+    downloader.min_size = 240
+    with pytest.raises(ImageTooSmall):
+        downloader.run(downloader.fetch("http://example.com/icon.gif"))
+    assert chunks_sent == 1  # the rest of the body is not downloaded
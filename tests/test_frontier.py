@@ -0,0 +1,20 @@
+from frontier import LinkScorer, SEED_SCORE
+
+
+def test_link_scorer_keywords():
+    """Links with keywords in anchor text or url are scored higher."""
+    scorer = LinkScorer({"cat", "dog"})
+    assert scorer.score("http://example.com/search?q=cat", "", 0) == SEED_SCORE
+
+    keyword_link = scorer.score("http://example.com/cats/cat-photos", "Cute dog", 1)
+    plain_link = scorer.score("http://example.com/login", "Sign in", 1)
+    assert keyword_link > plain_link
+
+
+def test_link_scorer_depth_and_host_yield():
+    scorer = LinkScorer({"cat"})
+    assert scorer.score("http://example.com/a", "", 1) > scorer.score("http://example.com/a", "", 3)
+
+    scorer.record_page("http://images.com/1", 10)
+    scorer.record_page("http://example.com/1", 0)
+    assert scorer.score("http://images.com/2", "", 2) > scorer.score("http://example.com/2", "", 2)
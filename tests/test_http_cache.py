@@ -0,0 +1,77 @@
+import os
+
+import httpx
+import pytest
+
+from http_cache import CachingTransport, PageCache, CachedResponse, freshness_lifetime
+
+
+def make_client(tmp_path, handler, max_size=1024 * 1024):
+    cache = PageCache(str(tmp_path / "pages"), max_size)
+    return httpx.AsyncClient(transport=CachingTransport(cache, httpx.MockTransport(handler))), cache
+
+
+def test_freshness_lifetime():
+    assert freshness_lifetime(httpx.Headers({"Cache-Control": "public, max-age=60"})) == 60
+    assert freshness_lifetime(httpx.Headers({"Cache-Control": "no-cache, max-age=60"})) == 0
+    assert freshness_lifetime(httpx.Headers({
+        "Date": "Wed, 21 Oct 2015 07:28:00 GMT", "Expires": "Wed, 21 Oct 2015 08:28:00 GMT"
+    })) == 3600
+    assert freshness_lifetime(httpx.Headers()) == 0
+
+
+@pytest.mark.asyncio
+async def test_fresh_response_from_cache(tmp_path):
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, headers={"Cache-Control": "max-age=60"}, text="<html>page</html>")
+
+    client, _ = make_client(tmp_path, handler)
+    first = await client.get("http://example.com/page")
+    second = await client.get("http://example.com/page")
+
+    assert first.text == second.text == "<html>page</html>"
+    assert len(requests) == 1
+
+
+@pytest.mark.asyncio
+async def test_stale_response_revalidated(tmp_path):
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304, headers={"ETag": '"v1"'})
+        return httpx.Response(200, headers={"ETag": '"v1"'}, text="<html>page</html>")
+
+    client, _ = make_client(tmp_path, handler)
+    await client.get("http://example.com/page")
+    response = await client.get("http://example.com/page")
+
+    assert response.status_code == 200
+    assert response.text == "<html>page</html>"
+    assert requests[1].headers["If-None-Match"] == '"v1"'
+
+
+@pytest.mark.asyncio
+async def test_no_store_is_not_cached(tmp_path):
+    def handler(request):
+        return httpx.Response(200, headers={"Cache-Control": "no-store", "ETag": '"v1"'}, text="secret")
+
+    client, cache = make_client(tmp_path, handler)
+    await client.get("http://example.com/page")
+    assert cache.load("http://example.com/page") is None
+
+
+def test_page_cache_lru_eviction(tmp_path):
+    cache = PageCache(str(tmp_path), max_size=3000)
+    for i in range(5):
+        body = os.urandom(1000)  # random data is not compressed
+        cache.store(f"http://example.com/{i}", CachedResponse(200, [("ETag", f'"{i}"')], body, 0))
+        os.utime(cache._file(f"http://example.com/{i}"), (i, i))
+
+    assert cache.size <= 3000
+    assert cache.load("http://example.com/0") is None  # least recently used
+    assert cache.load("http://example.com/4").body
@@ -0,0 +1,54 @@
+import io
+
+import fakeredis
+from PIL import Image, ImageDraw
+
+from image_hash import PerceptualHashIndex, dhash, hamming_distance
+
+
+def make_image(size=(400, 300), shapes=((50, 50, 200, 200),), fmt="JPEG", quality=90):
+    img = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(img)
+    for x0, y0, x1, y1 in shapes:
+        draw.ellipse((x0, y0, x1, y1), fill="red")
+    data = io.BytesIO()
+    img.save(data, fmt, quality=quality)
+    return data.getvalue()
+
+
+def test_dhash_resized_and_recompressed():
+    original = dhash(make_image())
+    # the same picture twice smaller and with low quality
+    copy = dhash(make_image(size=(200, 150), shapes=((25, 25, 100, 100),), quality=30))
+    other = dhash(make_image(shapes=((250, 100, 390, 290),), fmt="PNG"))
+
+    assert hamming_distance(original, copy) <= 6
+    assert hamming_distance(original, other) > 6
+
+
+def test_dhash_not_decodable():
+    assert dhash(b'<svg width="320" height="320"></svg>') is None
+
+
+def test_perceptual_hash_index():
+    index = PerceptualHashIndex(fakeredis.FakeRedis(), max_distance=3)
+    value = 0x0123456789ABCDEF
+    assert index.find(value) is None
+
+    index.add(value)
+    assert index.find(value) == value
+    assert index.find(value ^ 0b1011) == value  # 3 bits differ
+    assert index.find(value ^ 0b1111) is None  # 4 bits differ
+    assert index.find(value ^ (1 << 63 | 1 << 40 | 1)) == value  # bits of different bands
+
+
+def test_perceptual_hash_index_find_or_add():
+    index = PerceptualHashIndex(fakeredis.FakeRedis(), max_distance=3)
+    value = 0x0123456789ABCDEF
+    assert index.find_or_add(value, "a.jpg") is None
+    assert index.find_or_add(value ^ 0b11, "b.jpg") == (value, "a.jpg")
+    assert index.find(value ^ 0b11) == value  # near duplicate is not added
+
+    index.remove(value)
+    assert index.find(value) is None
+    assert index.find_or_add(value ^ 0b11, "b.jpg") is None
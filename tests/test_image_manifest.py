@@ -0,0 +1,19 @@
+import fakeredis
+
+from image_manifest import ImageManifest
+
+
+def test_image_manifest():
+    manifest = ImageManifest(fakeredis.FakeRedis(), "images")
+    manifest.add("images/cat", "a.jpg", saved_at=10)
+    manifest.add("images/cat", "a.jpg", saved_at=50)  # saved time is not changed
+    manifest.add("images/dog", "b.jpg", saved_at=20)
+    manifest.add("images/cat", "c.jpg", saved_at=30)
+
+    assert manifest.folders() == ["cat", "dog"]
+    assert manifest.list_images(until=100) == [("cat/a.jpg", 10), ("dog/b.jpg", 20), ("cat/c.jpg", 30)]
+    assert manifest.list_images(["cat"], since=10, until=100) == [("cat/c.jpg", 30)]
+    assert manifest.list_images(until=25) == [("cat/a.jpg", 10), ("dog/b.jpg", 20)]
+
+    manifest.remove(["cat/a.jpg"])
+    assert manifest.list_images(["cat"], until=100) == [("cat/c.jpg", 30)]
@@ -0,0 +1,63 @@
+import asyncio
+from unittest.mock import patch
+
+import fakeredis
+import pytest
+
+from downloader import DownloadedImage, ImageTooSmall
+from image_pipeline import LocalImagePipeline
+from url_cache import ImageUrlCache
+
+
+@pytest.mark.asyncio
+@patch("image_pipeline.handle_failed_download")
+@patch("image_pipeline.store_download")
+async def test_local_pipeline_backpressure(mock_store_download, mock_handle_failed):
+    """Full queue makes the crawler wait, queued images are downloaded and stored when pipeline closes."""
+    cache = ImageUrlCache(fakeredis.FakeRedis(), ttl=3600, revalidate_after=600)
+    pipeline = LocalImagePipeline(cache, workers=1, queue_size=1, store_processes=0)
+    release = asyncio.Event()
+
+    async def fake_fetch(absolute_src, headers):
+        await release.wait()
+        if absolute_src.endswith("icon.png"):
+            raise ImageTooSmall("16x16")
+        image = DownloadedImage(b"image")
+        image.etag = '"1"'
+        return image
+
+    with patch.object(pipeline, "fetch", fake_fetch):
+        await pipeline.start()
+        await pipeline.put("http://example.com/1.jpg", "images/cat")
+        await asyncio.sleep(0.01)  # taken by the worker
+        await pipeline.put("http://example.com/icon.png", "images/cat")
+        await pipeline.put("http://example.com/icon.png", "images/cat")  # already queued
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(pipeline.put("http://example.com/3.jpg", "images/dog"), timeout=0.05)
+
+        release.set()
+        await pipeline.close()
+
+    mock_store_download.assert_called_once_with("http://example.com/1.jpg", "images/cat", b"image", '"1"', "")
+    assert mock_handle_failed.call_count == 1
+    assert mock_handle_failed.call_args.args[0] == "http://example.com/icon.png"
+
+
+@pytest.mark.asyncio
+@patch("image_pipeline.store_download")
+async def test_local_pipeline_same_url_for_keywords(mock_store_download):
+    """An image url queued for one keyword is queued for another keyword too."""
+    cache = ImageUrlCache(fakeredis.FakeRedis(), ttl=3600, revalidate_after=600)
+    pipeline = LocalImagePipeline(cache, workers=1, queue_size=10, store_processes=0)
+
+    async def fake_fetch(absolute_src, headers):
+        return DownloadedImage(b"image")
+
+    with patch.object(pipeline, "fetch", fake_fetch):
+        await pipeline.start()
+        await pipeline.put("http://example.com/1.jpg", "images/cat")
+        await pipeline.put("http://example.com/1.jpg", "images/cat")  # already queued
+        await pipeline.put("http://example.com/1.jpg", "images/kitten")
+        await pipeline.close()
+
+    assert [call.args[1] for call in mock_store_download.call_args_list] == ["images/cat", "images/kitten"]
@@ -0,0 +1,59 @@
+import struct
+
+from image_probe import probe_image_format, probe_image_size
+
+
+def test_probe_png():
+    data = b"\x89PNG\r\n\x1a\n" + b"\x00\x00\x00\rIHDR" + struct.pack(">II", 640, 480) + b"\x08\x02"
+    assert probe_image_size(data) == (640, 480)
+
+
+def test_probe_gif():
+    assert probe_image_size(b"GIF89a" + struct.pack("<HH", 16, 32)) == (16, 32)
+
+
+def test_probe_jpeg():
+    app0 = b"\xff\xe0" + struct.pack(">H", 16) + b"JFIF\x00" + b"\x00" * 9
+    sof = b"\xff\xc0" + struct.pack(">HBHH", 17, 8, 300, 400) + b"\x03"
+    data = b"\xff\xd8" + app0 + sof
+    assert probe_image_size(data) == (400, 300)
+    assert probe_image_size(data[:10]) is None  # more bytes are needed
+
+
+def test_probe_webp():
+    vp8x = b"RIFF\x00\x00\x00\x00WEBPVP8X" + b"\x00" * 8 + (1023).to_bytes(3, "little") + (767).to_bytes(3, "little")
+    assert probe_image_size(vp8x) == (1024, 768)
+
+
+def test_probe_avif():
+    ftyp = struct.pack(">I", 20) + b"ftypavif" + b"\x00" * 8
+    ispe = struct.pack(">I", 20) + b"ispe" + b"\x00" * 4 + struct.pack(">II", 1920, 1080)
+    assert probe_image_size(ftyp + b"meta" + ispe) == (1920, 1080)
+    assert probe_image_format(ftyp) == "avif"
+
+
+def test_probe_image_format():
+    assert probe_image_format(b"\xff\xd8\xff\xe0") == "jpg"
+    assert probe_image_format(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == "webp"
+    assert probe_image_format(b"%PDF-1.4") is None
+
+
+def test_probe_svg():
+    assert probe_image_size(b'<?xml version="1.0"?><svg width="100px" height="50">') == (100, 50)
+    assert probe_image_size(b'<svg viewBox="0 0 800 600" width="100%">') == (800, 600)
+
+
+def test_probe_svg_root():
+    """Only documents with svg root are SVG images, HTML pages with inline SVG are not."""
+    svg = (
+        b'\xef\xbb\xbf<?xml version="1.0" encoding="UTF-8"?>\n<!-- icon -->\n'
+        b'<!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 1.1//EN" "http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">\n'
+        b'<svg xmlns="http://www.w3.org/2000/svg" width="64" height="64"></svg>'
+    )
+    assert probe_image_format(svg) == "svg"
+    assert probe_image_format(b"<!DOCTYPE html><html><body><svg width='64' height='64'></svg></body></html>") is None
+    assert probe_image_format(b"<html><!-- <svg> --></html>") is None
+
+
+def test_probe_unknown():
+    assert probe_image_size(b"not an image") is None
@@ -0,0 +1,28 @@
+from keyword_matcher import KeywordMatcher
+
+
+def test_keyword_matcher_fields_rank():
+    matcher = KeywordMatcher(["cat", "dog", "bird"])
+    assert matcher.match("Cute Cat", "a dog", "bird_photo") == ["cat", "dog", "bird"]
+    assert matcher.match("", "dog and cat", "cat-1") == ["cat", "dog"]
+    assert matcher.match("concatenate", "hotdogs", "") == []
+
+
+def test_keyword_matcher_plurals_and_multi_words():
+    matcher = KeywordMatcher(["puppy", "red car"])
+    assert matcher.match("Two puppies", "", "") == ["puppy"]
+    assert matcher.match("", "", "red_cars_2024") == ["red car"]
+    # words of keyword are not joined across fields
+    assert matcher.match("red", "car", "") == []
+
+    assert KeywordMatcher(["cat"], plurals=False).match("cats", "", "") == []
+
+
+def test_keyword_matcher_stemming():
+    matcher = KeywordMatcher(["running"], stemming=True)
+    assert matcher.match("runner", "", "") == ["running"]
+    assert KeywordMatcher(["running"]).match("runner", "", "") == []
+
+
+def test_keyword_matcher_no_keywords():
+    assert KeywordMatcher([]).match("cat", "", "") == []
@@ -0,0 +1,86 @@
+import fakeredis
+
+from metrics import HOST_PAGES_KEY, Metrics, read_summary, render_prometheus, series
+
+
+def test_series():
+    assert series("pages_total", {}) == "pages_total"
+    assert series("errors_total", {"reason": 'say "hi"', "host": "a.com"}) == (
+        'errors_total{host="a.com",reason="say \\"hi\\""}'
+    )
+
+
+def test_metrics_batched_until_flush():
+    redis_client = fakeredis.FakeRedis()
+    metrics = Metrics(redis_client, flush_interval=3600)
+    metrics.inc("crawler_pages_total")
+    metrics.inc("crawler_pages_total", 2)
+    metrics.inc_key("crawled_links_count")
+    assert redis_client.hgetall("metrics:counters") == {}
+
+    metrics.flush()
+    assert float(redis_client.hget("metrics:counters", "crawler_pages_total")) == 3
+    assert int(redis_client.get("crawled_links_count")) == 1
+
+    # another process adds to the same counters
+    other = Metrics(redis_client, flush_interval=0)
+    other.inc("crawler_pages_total")
+    assert float(redis_client.hget("metrics:counters", "crawler_pages_total")) == 4
+
+
+def test_render_prometheus():
+    redis_client = fakeredis.FakeRedis()
+    metrics = Metrics(redis_client, flush_interval=3600)
+    metrics.inc("crawler_fetch_errors_total", reason="http_404")
+    metrics.set("crawler_queue_depth", 12, shard=0)
+    metrics.observe("crawler_fetch_seconds", 0.2, buckets=(0.1, 0.5))
+    metrics.observe("crawler_fetch_seconds", 0.7, buckets=(0.1, 0.5))
+    metrics.flush()
+
+    lines = render_prometheus(redis_client).splitlines()
+    assert "# TYPE crawler_fetch_errors_total counter" in lines
+    assert 'crawler_fetch_errors_total{reason="http_404"} 1' in lines
+    assert 'crawler_queue_depth{shard="0"} 12' in lines
+
+    start = lines.index("# TYPE crawler_fetch_seconds histogram")
+    assert lines[start + 1:start + 5] == [
+        'crawler_fetch_seconds_bucket{le="0.1"} 0',
+        'crawler_fetch_seconds_bucket{le="0.5"} 1',
+        'crawler_fetch_seconds_bucket{le="+Inf"} 2',
+        "crawler_fetch_seconds_count 2",
+    ]
+    assert lines[start + 5].startswith("crawler_fetch_seconds_sum 0.8")
+
+
+def test_read_summary():
+    redis_client = fakeredis.FakeRedis()
+    metrics = Metrics(redis_client, flush_interval=3600)
+    for host, pages in (("a.com", 3), ("b.com", 1)):
+        metrics.inc("crawler_pages_total", pages)
+        metrics.inc_ranked(HOST_PAGES_KEY, host, pages)
+    metrics.inc("images_rejected_total", reason="too_small")
+    metrics.set("crawler_pages_per_second", 1.5, shard=0)
+    metrics.set("crawler_pages_per_second", 2, shard=1)
+    metrics.observe("crawler_fetch_seconds", 0.1)
+    metrics.observe("crawler_fetch_seconds", 0.3)
+    metrics.flush()
+    redis_client.set("saved_images_count", 7)
+
+    summary = read_summary(redis_client, top_hosts=1)
+    assert summary["pages"] == 4
+    assert summary["pages_per_second"] == 3.5
+    assert abs(summary["fetch_avg_seconds"] - 0.2) < 1e-9
+    assert summary["images_rejected"] == {"too_small": 1}
+    assert summary["images_saved"] == 7
+    assert summary["top_hosts"] == [("a.com", 3)]
+    assert "host_pages" not in render_prometheus(redis_client)
+
+
+def test_ranked_keeps_top_members(monkeypatch):
+    monkeypatch.setattr("metrics.RANKED_LIMIT", 2)
+    redis_client = fakeredis.FakeRedis()
+    metrics = Metrics(redis_client, flush_interval=3600)
+    for host, pages in (("a.com", 3), ("b.com", 1), ("c.com", 2)):
+        metrics.inc_ranked(HOST_PAGES_KEY, host, pages)
+    metrics.flush()
+    assert redis_client.zrevrange(HOST_PAGES_KEY, 0, -1) == [b"a.com", b"c.com"]
@@ -0,0 +1,94 @@
+import pytest
+
+from parsing import largest_srcset_candidate, parse_page
+
+HTML = """
+<html>
+  <body>
+    <img src="/a.jpg" alt="Cute &amp; cat" title="Cat">
+    <img alt="no src">
+    <img src="b.png"/>
+    <a href="page2.html">Link <b>one</b></a>
+    <a name="anchor">no href</a>
+    <a href="page3.html">
+      Link two
+    </a>
+  </body>
+</html>
+"""
+
+
+@pytest.mark.parametrize("backend", ["tokenizer", "html.parser"])
+def test_parse_page(backend):
+    images, links = parse_page(HTML, backend)
+    assert images == [("/a.jpg", "Cute & cat", "Cat"), ("b.png", "", "")]
+    assert links == [("page2.html", "Link one"), ("page3.html", "Link two")]
+
+
+def test_parse_page_unknown_backend():
+    with pytest.raises(ValueError):
+        parse_page(HTML, "unknown")
+
+
+RICH_HTML = """
+<html><head>
+  <meta property="og:image" content="https://site.com/og.jpg">
+  <meta property="og:image:alt" content="Og cat">
+  <meta property="og:title" content="Cats">
+  <style>.hero { background-image: url('/hero.jpg'); }</style>
+</head><body>
+  <img src="small.jpg" srcset="medium.jpg 480w, https://cdn.com/w_800,h_600/large.jpg 800w" alt="Set">
+  <img src="data:image/gif;base64,R0lGOD" data-src="/lazy.jpg" alt="Lazy">
+  <picture>
+    <source srcset="pic.webp 1x, pic@2x.webp 2x" type="image/webp">
+    <img src="pic.jpg" alt="Pic" title="Picture">
+  </picture>
+  <div style="background: #fff url(&quot;/bg.png&quot;) no-repeat" aria-label="Background"></div>
+</body></html>
+"""
+
+
+@pytest.mark.parametrize("backend", ["tokenizer", "html.parser"])
+def test_parse_page_generic_images(backend):
+    images, _ = parse_page(RICH_HTML, backend)
+    assert images == [
+        ("/hero.jpg", "", ""),
+        ("https://cdn.com/w_800,h_600/large.jpg", "Set", ""),
+        ("/lazy.jpg", "Lazy", ""),
+        ("pic@2x.webp", "Pic", "Picture"),
+        ("pic.jpg", "Pic", "Picture"),
+        ("/bg.png", "Background", ""),
+        ("https://site.com/og.jpg", "Og cat", "Cats"),
+    ]
+
+
+def test_largest_srcset_candidate():
+    assert largest_srcset_candidate("a.jpg, b.jpg 2x, c.jpg 1.5x") == "b.jpg"
+    assert largest_srcset_candidate("a.jpg 100w,b.jpg 300w , c.jpg 200w") == "b.jpg"
+    assert largest_srcset_candidate("data:image/png;base64,xx 2x, a.jpg") == "a.jpg"
+    assert largest_srcset_candidate("") is None
+
+
+def test_parse_google_images_results():
+    html = (
+        '<img src="https://encrypted-tbn0.gstatic.com/images?q=tbn:1" alt="">'
+        '<script>AF_initDataCallback({data:[["https://encrypted-tbn0.gstatic.com/images?q\\u003dtbn:1",140,180],'
+        '["https://site.com/cat.jpg?w\\u003d1",1080,1920],["https://site.com/cat.jpg?w\\u003d1",1080,1920]]});</script>'
+    )
+    images, _ = parse_page(html, page_url="https://www.google.com/search?q=cute+cat&tbm=isch")
+    assert images == [
+        ("https://site.com/cat.jpg?w=1", "cute cat", ""),
+        ("https://encrypted-tbn0.gstatic.com/images?q=tbn:1", "", ""),
+    ]
+    # the same page of other site is parsed only by the generic parser
+    images, _ = parse_page(html, page_url="https://site.com/search?q=cute+cat&tbm=isch")
+    assert len(images) == 1
+
+
+def test_parse_bing_images_results():
+    html = (
+        '<a class="iusc" m="{&quot;murl&quot;:&quot;https://site.com/dog.png&quot;,'
+        '&quot;t&quot;:&quot;Good dog&quot;}" href="/images/search?view=detail"></a>'
+    )
+    images, _ = parse_page(html, page_url="https://www.bing.com/images/search?q=dog")
+    assert images == [("https://site.com/dog.png", "dog", "Good dog")]
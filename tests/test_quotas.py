@@ -0,0 +1,29 @@
+import fakeredis
+
+from quotas import KeywordQuotas, folder_keyword
+
+
+def test_keyword_quotas():
+    quotas = KeywordQuotas(fakeredis.FakeRedis())
+    quotas.set_target("cat", 2)
+
+    assert quotas.reserve("cat")
+    assert quotas.reserve("dog")  # no target, only counted
+    assert quotas.satisfied(["cat", "dog"]) == set()
+    assert quotas.reserve("cat")
+    assert not quotas.reserve("cat")  # target reached, nothing counted
+    assert quotas.progress() == {"cat": (2, 2), "dog": (1, None)}
+    assert quotas.satisfied(["cat", "dog"]) == {"cat"}
+
+    quotas.release("cat")
+    assert quotas.satisfied(["cat"]) == set()
+
+    quotas.set_target("cat", 5)  # counted from zero again
+    assert quotas.progress()["cat"] == (0, 5)
+    quotas.set_target("dog", 0)
+    assert "dog" not in quotas.progress()
+
+
+def test_folder_keyword():
+    assert folder_keyword("images/black cat") == "black cat"
+    assert folder_keyword("images/cat/") == "cat"
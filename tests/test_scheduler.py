@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from scheduler import TokenBucket, HostScheduler, RobotsCache
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=2, capacity=2)
+    now = bucket.updated_at
+    assert bucket.consume(now) is True
+    assert bucket.consume(now) is True
+    assert bucket.consume(now) is False
+    assert bucket.delay(now) == pytest.approx(0.5)
+    assert bucket.consume(now + 0.5) is True
+
+
+@pytest.mark.asyncio
+async def test_host_scheduler_per_host_concurrency():
+    """A busy host must not block urls of other hosts."""
+    scheduler = HostScheduler(per_host_concurrency=1, rate=100, burst=100)
+    scheduler.put_nowait("http://slow.com/1")
+    scheduler.put_nowait("http://slow.com/2")
+    scheduler.put_nowait("http://fast.com/1")
+
+    first, _ = await scheduler.get()
+    second, _ = await scheduler.get()
+    assert {first, second} == {"http://slow.com/1", "http://fast.com/1"}
+
+    waiting = asyncio.create_task(scheduler.get())
+    await asyncio.sleep(0.01)
+    assert not waiting.done()  # slow.com already has a request in flight
+
+    scheduler.task_done("http://slow.com/1")
+    assert await asyncio.wait_for(waiting, 1) == ("http://slow.com/2", 0)
+
+    scheduler.task_done("http://fast.com/1")
+    scheduler.task_done("http://slow.com/2")
+    await asyncio.wait_for(scheduler.join(), 1)
+
+
+@pytest.mark.asyncio
+async def test_host_scheduler_crawl_delay():
+    scheduler = HostScheduler(per_host_concurrency=10, rate=100, burst=100)
+    scheduler.set_crawl_delay("example.com", 0.05)
+    scheduler.put_nowait("http://example.com/1")
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    await scheduler.get()
+    assert loop.time() - started >= 0.04
+
+
+@pytest.mark.asyncio
+async def test_robots_cache():
+    response = MagicMock(status_code=200, text="User-agent: *\nDisallow: /private\nCrawl-delay: 3")
+    client = MagicMock()
+    client.get = AsyncMock(return_value=response)
+
+    robots = RobotsCache(client, "test-agent", ttl=60)
+    assert await robots.allowed("http://example.com/page") == (True, 3)
+    assert await robots.allowed("http://example.com/private/1") == (False, 3)
+    client.get.assert_called_once()  # robots.txt is cached per host
+
+
+@pytest.mark.asyncio
+async def test_host_scheduler_priority():
+    """The highest priority url is returned first, hosts over page limit are skipped."""
+    scheduler = HostScheduler(per_host_concurrency=10, rate=100, burst=100, max_pages_per_host=2)
+    assert scheduler.put_nowait("http://a.com/low", priority=1, depth=2)
+    assert scheduler.put_nowait("http://a.com/high", priority=5, depth=1)
+    assert not scheduler.put_nowait("http://a.com/over-limit", priority=10, depth=1)
+    assert scheduler.put_nowait("http://b.com/best", priority=7, depth=3)
+
+    assert await scheduler.get() == ("http://b.com/best", 3)
+    assert await scheduler.get() == ("http://a.com/high", 1)
+    assert await scheduler.get() == ("http://a.com/low", 2)
+
+
+@pytest.mark.asyncio
+async def test_host_scheduler_evicts_idle_hosts():
+    """States of drained hosts are kept for max_idle_hosts hosts only, busy hosts are never evicted."""
+    scheduler = HostScheduler(per_host_concurrency=1, rate=100, burst=100, max_pages_per_host=1, max_idle_hosts=2)
+    scheduler.put_nowait("http://busy.com/1")
+    busy, _ = await scheduler.get()
+    for i in range(5):
+        scheduler.put_nowait(f"http://host{i}.com/")
+        url, _ = await scheduler.get()
+        scheduler.task_done(url)
+        assert not scheduler.put_nowait(f"http://host{i}.com/2")  # page count is kept while the host is idle
+
+    assert set(scheduler.hosts) == {"busy.com", "host3.com", "host4.com"}
+    assert scheduler.put_nowait("http://host0.com/2")  # evicted, counted from zero
+    scheduler.task_done(busy)
+    assert "busy.com" in scheduler.hosts
@@ -0,0 +1,45 @@
+import pytest
+
+from seen_filter import BloomFilter, ExactSeenSet, make_seen_filter
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(capacity=10_000, error_rate=0.01)
+    urls = [f"http://example.com/page/{i}" for i in range(10_000)]
+    for url in urls:
+        bloom.add(url)
+
+    assert all(url in bloom for url in urls)
+    assert bloom.add(urls[0]) is False
+
+    false_positives = sum(f"http://other.com/{i}" in bloom for i in range(10_000))
+    assert false_positives < 300  # ~1% expected
+    assert len(bloom.bits) < 10_000 * 2  # less than 2 bytes per url
+
+
+def test_bloom_filter_dump_changes():
+    """Only bytes changed since the last dump are returned, too many changes mean the whole dump."""
+    bloom = BloomFilter(capacity=10_000, error_rate=0.01)
+    saved = bytearray(bloom.dump())
+    bloom.add("http://example.com/")
+    changes = bloom.dump_changes()
+    assert 0 < sum(len(data) for _, data in changes) < 100
+    for offset, data in changes:
+        saved[offset:offset + len(data)] = data
+    assert saved == bloom.bits
+    assert bloom.dump_changes() == []
+
+    for i in range(5_000):
+        bloom.add(f"http://example.com/page/{i}")
+    assert bloom.dump_changes() is None
+
+
+def test_make_seen_filter():
+    seen = make_seen_filter("exact", 0, 0)
+    assert isinstance(seen, ExactSeenSet)
+    assert seen.add("a") is True
+    assert seen.add("a") is False
+    assert len(seen) == 1
+
+    with pytest.raises(ValueError):
+        make_seen_filter("unknown", 10, 0.1)
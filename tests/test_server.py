@@ -1,8 +1,15 @@
+import io
 import os
+import zipfile
 import pytest
 import shutil
+from unittest.mock import patch
 
-from server import app, PARSED_IMAGES_DIR, ARCHIVE_PATH
+import fakeredis
+
+import server
+from metrics import get_metrics
+from server import app, PARSED_IMAGES_DIR, parse_range
 from flask.testing import FlaskClient
 
 @pytest.fixture
@@ -10,6 +17,24 @@ def client():
     with app.test_client() as client:
         yield client
 
+
+@pytest.fixture(autouse=True)
+def lock_path(tmp_path, monkeypatch):
+    monkeypatch.setenv("SERVER_LOCK_PATH", str(tmp_path / "export.lock"))
+
+
+@pytest.fixture(autouse=True)
+def fake_manifest():
+    with patch.object(server.manifest, "redis", fakeredis.FakeRedis()):
+        yield server.manifest
+
+
+@pytest.fixture(autouse=True)
+def fake_metrics():
+    metrics = get_metrics()
+    with patch.object(metrics, "redis", fakeredis.FakeRedis()), patch.object(server, "redis_client", metrics.redis):
+        yield metrics
+
 def test_images_archive_no_dir(client: FlaskClient):
     """If the images directory does not exist or is empty, return 404."""
     if os.path.exists(PARSED_IMAGES_DIR):
@@ -30,8 +55,134 @@ def test_images_archive_with_files(client: FlaskClient):
     assert response.status_code == 200
     # And that it is most likely a ZIP file
     assert response.headers["Content-Type"] == "application/zip"
+    assert int(response.headers["Content-Length"]) == len(response.data)
+    assert zipfile.ZipFile(io.BytesIO(response.data)).read("test.jpg") == b"\x00\x00\x00\x00"
 
-    # Check that the archive is deleted from the project
+    # Check that the images are deleted when the archive was sent
     assert not os.path.exists(PARSED_IMAGES_DIR)
-    if os.path.exists(ARCHIVE_PATH):
-        os.remove(ARCHIVE_PATH)
+
+
+def test_images_archive_range(client: FlaskClient):
+    """Archive can be downloaded in parts, parts are the same bytes as the whole archive."""
+    os.makedirs(os.path.join(PARSED_IMAGES_DIR, "cat"), exist_ok=True)
+    try:
+        for i in range(3):
+            with open(os.path.join(PARSED_IMAGES_DIR, "cat", f"{i}.jpg"), "wb") as f:
+                f.write(os.urandom(1000))
+
+        whole = client.get("/get_images_archive", headers={"Range": "bytes=0-"})
+        assert whole.status_code == 200  # without If-Range the archive may have changed since the first part
+        etag = whole.headers["ETag"]
+        size = len(whole.data)
+        first = client.get("/get_images_archive", headers={"Range": "bytes=0-1499", "If-Range": etag})
+        rest = client.get("/get_images_archive", headers={"Range": "bytes=1500-", "If-Range": etag})
+        assert first.status_code == rest.status_code == 206
+        assert int(first.headers["Content-Range"].split("/")[1]) == size
+        assert len(first.data) + len(rest.data) == size
+        assert first.data + rest.data == whole.data
+
+        changed = client.get("/get_images_archive", headers={"Range": "bytes=1500-", "If-Range": '"old"'})
+        assert changed.status_code == 200 and changed.data == whole.data
+
+        archive = zipfile.ZipFile(io.BytesIO(first.data + rest.data))
+        assert archive.testzip() is None
+        assert sorted(archive.namelist()) == ["cat/0.jpg", "cat/1.jpg", "cat/2.jpg"]
+        assert os.path.exists(PARSED_IMAGES_DIR)  # parts don't remove images
+    finally:
+        shutil.rmtree(PARSED_IMAGES_DIR)
+
+
+def test_images_archive_export_delta(client: FlaskClient, fake_manifest):
+    """Images are selected by keyword and since cursor, only exported images are removed."""
+    images = {"cat/1.jpg": 100, "cat/2.jpg": 200, "dog/3.jpg": 150}
+    try:
+        for image, saved_at in images.items():
+            path = os.path.join(PARSED_IMAGES_DIR, image)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(image.encode())
+            folder, image_name = image.split("/")
+            fake_manifest.add(os.path.join(PARSED_IMAGES_DIR, folder), image_name, saved_at)
+
+        response = client.get("/get_images_archive?keyword=cat&since=100&until=1000")
+        assert response.status_code == 200
+        assert zipfile.ZipFile(io.BytesIO(response.data)).namelist() == ["cat/2.jpg"]
+        assert response.headers["X-Export-Cursor"] == "1000.0"
+        response.close()  # server closes response when it is sent, it releases export lock
+        assert not os.path.exists(os.path.join(PARSED_IMAGES_DIR, "cat", "2.jpg"))
+        assert os.path.exists(os.path.join(PARSED_IMAGES_DIR, "cat", "1.jpg"))
+
+        response = client.get("/get_images_archive?since=100&remove=0")
+        assert zipfile.ZipFile(io.BytesIO(response.data)).namelist() == ["dog/3.jpg"]
+        response.close()
+        assert os.path.exists(os.path.join(PARSED_IMAGES_DIR, "dog", "3.jpg"))
+
+        response = client.get("/get_images_archive?keyword=cat&since=1000")
+        assert response.status_code == 404
+    finally:
+        shutil.rmtree(PARSED_IMAGES_DIR)
+
+
+def test_images_archive_removes_unlinked_blobs(client: FlaskClient, tmp_path, monkeypatch):
+    """Blobs of archived images are removed when nothing links them, other blobs are not looked at."""
+    monkeypatch.setenv("IMAGES_BLOBS_PATH", str(tmp_path / "blobs"))
+    blobs = {}
+    for image_name in ("ab1.jpg", "cd2.jpg", "ef3.jpg"):
+        blobs[image_name] = tmp_path / "blobs" / image_name[:2] / image_name
+        blobs[image_name].parent.mkdir(parents=True)
+        blobs[image_name].write_bytes(image_name.encode())
+    try:
+        for image in ("cat/ab1.jpg", "cat/cd2.jpg", "dog/cd2.jpg"):
+            path = os.path.join(PARSED_IMAGES_DIR, image)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.link(blobs[os.path.basename(image)], path)
+
+        with patch.object(server.manifest, "list_images", return_value=[("cat/ab1.jpg", 1), ("cat/cd2.jpg", 1)]):
+            response = client.get("/get_images_archive?keyword=cat")
+            assert zipfile.ZipFile(io.BytesIO(response.data)).namelist() == ["cat/ab1.jpg", "cat/cd2.jpg"]
+            response.close()
+
+        assert not blobs["ab1.jpg"].exists()
+        assert blobs["cd2.jpg"].exists()  # dog folder still has it
+        assert blobs["ef3.jpg"].exists()  # not linked, but not archived either
+    finally:
+        shutil.rmtree(PARSED_IMAGES_DIR)
+
+
+def test_parse_range():
+    assert parse_range("bytes=0-99", 1000) == (0, 99)
+    assert parse_range("bytes=900-", 1000) == (900, 999)
+    assert parse_range("bytes=-100", 1000) == (900, 999)
+    assert parse_range("bytes=0-10,20-30", 1000) is None  # several ranges are not supported
+    assert parse_range(None, 1000) is None
+
+
+def test_images_archive_lock(client: FlaskClient):
+    """Images are not removed while another archive is streamed."""
+    os.makedirs(PARSED_IMAGES_DIR, exist_ok=True)
+    try:
+        with open(os.path.join(PARSED_IMAGES_DIR, "test.jpg"), "wb") as f:
+            f.write(b"\x00" * 10)
+
+        download = client.get("/get_images_archive?remove=0", buffered=False)
+        assert download.status_code == 200
+        assert client.get("/get_images_archive").status_code == 409  # can't remove images
+        assert client.get("/get_images_archive?remove=0").status_code == 200  # downloads run together
+
+        download.close()
+        assert client.get("/get_images_archive").status_code == 200
+    finally:
+        shutil.rmtree(PARSED_IMAGES_DIR, ignore_errors=True)
+
+
+def test_metrics_endpoint(client: FlaskClient):
+    """Archive requests are counted and the metrics are served in Prometheus text format."""
+    if os.path.exists(PARSED_IMAGES_DIR):
+        shutil.rmtree(PARSED_IMAGES_DIR)
+    client.get("/get_images_archive")
+    get_metrics().flush()
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("text/plain")
+    assert 'archive_requests_total{status="404"} 1' in response.get_data(as_text=True).splitlines()
@@ -1,7 +1,12 @@
 import os
 import pytest
 from unittest.mock import patch, MagicMock
-from tasks import download_image, has_ext, is_image_valid
+import fakeredis
+
+from tasks import download_image, download_images, has_ext, is_image_valid
+from downloader import NotModified
+from url_cache import ImageUrlCache
+from metrics import get_metrics
 
 @pytest.fixture
 def fake_response():
@@ -11,8 +16,9 @@ def fake_response():
     mock_resp.raise_for_status = MagicMock()
     return mock_resp
 
+@patch("tasks.KeywordQuotas")
 @patch("tasks.redis_client")
-def test_download_image(mock_redis):
+def test_download_image(mock_redis, mock_quotas):
     mock_redis.sismember.return_value = False  # Simulate that the hash does not exist
 
     save_dir = "test_dir"
@@ -20,9 +26,10 @@ def test_download_image(mock_redis):
         os.mkdir(save_dir)
 
     try:
-        download_image("https://http.cat/images/102.jpg", save_dir)
+        with patch.object(get_metrics(), "redis", fakeredis.FakeRedis()) as metrics_redis:
+            download_image("https://http.cat/images/102.jpg", save_dir)
         mock_redis.sadd.assert_called_once()
-        mock_redis.incr.assert_called_once_with("saved_images_count")
+        assert int(metrics_redis.get("saved_images_count")) == 1
     finally:
         # Remove the created directory
         if os.path.exists(save_dir):
@@ -48,3 +55,201 @@ def test_is_image_valid_large(mock_size):
 def test_is_image_valid_small(mock_size):
     """Check that a 100x100 image is not valid (too small)."""
     assert is_image_valid("some_path.png") is False
+
+
+def test_is_image_valid_truncated():
+    """Truncated image is rejected even though its header is valid."""
+    import io
+    from PIL import Image
+    image = io.BytesIO()
+    Image.effect_noise((400, 300), 50).convert("RGB").save(image, "JPEG")
+    assert is_image_valid("image.jpg", image.getvalue())
+    assert not is_image_valid("image.jpg", image.getvalue()[:len(image.getvalue()) // 2])
+
+
+@patch("tasks.url_cache", ImageUrlCache(fakeredis.FakeRedis(), ttl=3600, revalidate_after=600))
+@patch("tasks.store_image")
+@patch("tasks.get_downloader")
+def test_download_images_batch(mock_get_downloader, mock_store_image):
+    """All images of a batch are downloaded together (a url once for all its keywords), failed downloads are skipped."""
+    mock_get_downloader.return_value.fetch_many.return_value = [b"image", ValueError("404")]
+    mock_store_image.return_value = ("stored", "abc.jpg")
+    images = [
+        ("http://example.com/1.jpg", "images/cat"),
+        ("http://example.com/2.jpg", "images/dog"),
+        ("http://example.com/1.jpg", "images/kitten"),
+    ]
+    download_images(images)
+
+    mock_get_downloader.return_value.fetch_many.assert_called_once_with(
+        ["http://example.com/1.jpg", "http://example.com/2.jpg"], [None, None]
+    )
+    assert mock_store_image.call_args_list == [
+        (("http://example.com/1.jpg", "images/cat", b"image"),),
+        (("http://example.com/1.jpg", "images/kitten", b"image"),),
+    ]
+
+
+@patch("tasks.store_cached")
+@patch("tasks.get_downloader")
+def test_download_images_url_cache(mock_get_downloader, mock_store_cached):
+    """Known url is not downloaded again, stale one is revalidated with its ETag."""
+    cache = ImageUrlCache(fakeredis.FakeRedis(), ttl=3600, revalidate_after=600)
+    cache.set("http://example.com/1.jpg", "stored", "abc.jpg", etag='"v1"')
+    cache.set("http://example.com/2.jpg", "stored", "def.jpg", etag='"v2"')
+    cache.redis.hset(cache.key("http://example.com/2.jpg"), "checked_at", 0)  # stale
+    mock_get_downloader.return_value.fetch_many.return_value = [NotModified()]
+
+    with patch("tasks.url_cache", cache):
+        download_images([("http://example.com/1.jpg", "images/cat"), ("http://example.com/2.jpg", "images/cat")])
+
+    mock_get_downloader.return_value.fetch_many.assert_called_once_with(
+        ["http://example.com/2.jpg"], [{"If-None-Match": '"v2"'}]
+    )
+    assert mock_store_cached.call_count == 2
+    assert cache.is_fresh(cache.get_many(["http://example.com/2.jpg"])[0])
+
+
+def test_get_image_data_size_svg():
+    """SVG size is read from its attributes, it is not rendered."""
+    from tasks import get_image_data_size
+    assert get_image_data_size(b'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 512 256">') == (512, 256)
+    assert get_image_data_size(b"not an image") == (0, 0)
+
+
+@patch("tasks.KeywordQuotas")
+@patch("tasks.redis_client")
+def test_store_image_writes_original_bytes(mock_redis, mock_quotas, tmp_path, monkeypatch):
+    """Valid image is written byte for byte, small one is not written at all."""
+    from tasks import store_image
+    monkeypatch.setenv("IMAGES_BLOBS_PATH", str(tmp_path / "blobs"))
+    mock_redis.sadd.return_value = 1
+    large = b'<svg width="320" height="320"></svg>'
+    small = b'<svg width="16" height="16"></svg>'
+
+    with patch.object(get_metrics(), "redis", fakeredis.FakeRedis()) as metrics_redis:
+        store_image("http://example.com/large.svg", str(tmp_path / "cat"), large)
+        store_image("http://example.com/small.svg", str(tmp_path / "cat"), small)
+        get_metrics().flush()
+
+    saved = list((tmp_path / "cat").iterdir())
+    assert len(saved) == 1
+    assert saved[0].read_bytes() == large
+    mock_redis.sadd.assert_called_once()  # invalid image is not added to hashes
+    assert int(metrics_redis.get("saved_images_count")) == 1
+
+
+def test_store_image_content_addressed(tmp_path, monkeypatch):
+    """The same image is written once, another keyword folder gets a link to it."""
+    import fakeredis
+    from tasks import store_image
+    monkeypatch.setenv("IMAGES_BLOBS_PATH", str(tmp_path / "blobs"))
+    image = b'<svg width="320" height="320"></svg>'
+
+    with patch("tasks.redis_client", fakeredis.FakeRedis()), \
+            patch.object(get_metrics(), "redis", fakeredis.FakeRedis()) as metrics_redis:
+        store_image("http://example.com/a.svg", str(tmp_path / "cat"), image)
+        store_image("http://cdn.example.com/b.svg?x=1", str(tmp_path / "cat"), image)
+        store_image("http://example.com/a.svg", str(tmp_path / "kitten"), image)
+        get_metrics().flush()
+        assert int(metrics_redis.get("saved_images_count")) == 1
+
+    cat_files = list((tmp_path / "cat").iterdir())
+    kitten_files = list((tmp_path / "kitten").iterdir())
+    assert len(cat_files) == 1 and len(kitten_files) == 1
+    assert cat_files[0].name == kitten_files[0].name  # named by hash
+    assert os.path.samefile(cat_files[0], kitten_files[0])
+
+
+def test_store_image_near_duplicate_does_not_reserve_quota(tmp_path, monkeypatch):
+    """A near duplicate is rejected before a quota slot is reserved, so the target is never reached by it."""
+    from tasks import store_image
+    from tests.test_image_hash import make_image
+    monkeypatch.setenv("IMAGES_BLOBS_PATH", str(tmp_path / "blobs"))
+
+    with patch("tasks.redis_client", fakeredis.FakeRedis()), patch("tasks.reserve_quota", return_value=True) as mock_reserve:
+        store_image("http://example.com/a.jpg", str(tmp_path / "cat"), make_image(size=(800, 600), shapes=((100, 100, 400, 400),)))
+        store_image("http://example.com/b.jpg", str(tmp_path / "cat"), make_image(quality=40))
+
+    mock_reserve.assert_called_once()
+
+
+def test_store_image_format_from_bytes(tmp_path, monkeypatch):
+    """Image url without extension is saved with the extension of its format, not images are rejected."""
+    import io
+    from PIL import Image
+    from tasks import store_image
+    monkeypatch.setenv("IMAGES_BLOBS_PATH", str(tmp_path / "blobs"))
+    webp = io.BytesIO()
+    Image.new("RGB", (400, 300), "red").save(webp, "WEBP")
+
+    with patch("tasks.redis_client", fakeredis.FakeRedis()):
+        store_image("https://cdn.example.com/images/123?w=800", str(tmp_path / "cat"), webp.getvalue())
+        assert store_image("https://example.com/cat.jpg", str(tmp_path / "cat"), b"%PDF-1.4 " * 100) == ("rejected", "")
+
+    assert [path.suffix for path in (tmp_path / "cat").iterdir()] == [".webp"]
+
+
+def test_store_image_near_duplicate_linked_for_another_keyword(tmp_path, monkeypatch):
+    """A resized copy found for another keyword is linked to the saved image, not rejected."""
+    from tasks import store_image
+    from tests.test_image_hash import make_image
+    monkeypatch.setenv("IMAGES_BLOBS_PATH", str(tmp_path / "blobs"))
+
+    with patch("tasks.redis_client", fakeredis.FakeRedis()):
+        saved = store_image("http://example.com/a.jpg", str(tmp_path / "cat"), make_image(size=(800, 600), shapes=((100, 100, 400, 400),)))
+        copy = make_image(quality=40)
+        assert store_image("http://example.com/small.jpg", str(tmp_path / "kitten"), copy) == saved
+
+    cat_file, = (tmp_path / "cat").iterdir()
+    kitten_file, = (tmp_path / "kitten").iterdir()
+    assert os.path.samefile(cat_file, kitten_file)
+
+
+def test_store_image_already_in_folder_releases_quota(tmp_path, monkeypatch):
+    """A new blob which the folder already has (e.g. image hashes were cleared) does not use a quota slot."""
+    from tasks import store_image
+    from quotas import SAVED_KEY
+    monkeypatch.setenv("IMAGES_BLOBS_PATH", str(tmp_path / "blobs"))
+    image = b'<svg width="320" height="320"></svg>'
+    fake_redis = fakeredis.FakeRedis()
+
+    with patch("tasks.redis_client", fake_redis), \
+            patch.object(get_metrics(), "redis", fakeredis.FakeRedis()) as metrics_redis:
+        get_metrics().flush()  # counts buffered by other tests
+        metrics_redis.delete("saved_images_count")
+        store_image("http://example.com/a.svg", str(tmp_path / "cat"), image)
+        fake_redis.delete("image_hashes")
+        assert store_image("http://example.com/a.svg", str(tmp_path / "cat"), image)[0] == "stored"
+        get_metrics().flush()
+        assert int(metrics_redis.get("saved_images_count")) == 1
+
+    assert int(fake_redis.hget(SAVED_KEY, "cat")) == 1
+
+
+def test_store_image_waits_for_blob_of_another_worker(tmp_path, monkeypatch):
+    """A worker which lost the hash race links the blob when the winner has written it, else nothing is cached."""
+    import hashlib
+    import threading
+    from tasks import store_image, blob_path, make_image_name, write_blob
+    monkeypatch.setenv("IMAGES_BLOBS_PATH", str(tmp_path / "blobs"))
+    image = b'<svg width="320" height="320"></svg>'
+    image_hash = hashlib.md5(image).hexdigest()
+    path = blob_path(make_image_name("http://example.com/a.svg", image_hash, "svg"))
+    fake_redis = fakeredis.FakeRedis()
+    fake_redis.sadd("image_hashes", image_hash)  # another worker is writing the blob
+
+    with patch("tasks.redis_client", fake_redis):
+        writer = threading.Timer(0.2, write_blob, (path, image))
+        writer.start()
+        assert store_image("http://example.com/a.svg", str(tmp_path / "cat"), image)[0] == "stored"
+        writer.join()
+        assert os.path.samefile(path, tmp_path / "cat" / os.path.basename(path))
+
+        os.remove(path)
+        with patch("tasks.BLOB_WAIT_TIMEOUT", 0.1):
+            assert store_image("http://example.com/a.svg", str(tmp_path / "dog"), image) == ("rejected", "")  # exported
+            failed = threading.Timer(0.02, fake_redis.srem, ("image_hashes", image_hash))  # the writer failed
+            failed.start()
+            assert store_image("http://example.com/a.svg", str(tmp_path / "dog"), image) is None
+            failed.join()
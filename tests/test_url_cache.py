@@ -0,0 +1,20 @@
+import fakeredis
+
+from url_cache import REJECTED, STORED, ImageUrlCache
+
+
+def test_image_url_cache():
+    cache = ImageUrlCache(fakeredis.FakeRedis(), ttl=3600, revalidate_after=600)
+    assert cache.get_many(["http://example.com/a.jpg"]) == [None]
+
+    cache.set("http://example.com/a.jpg?utm_source=x", STORED, "abc.jpg", etag='"1"', save_dir="images/cat")
+    cache.set("http://example.com/icon.png", REJECTED)
+    entry, icon = cache.get_many(["http://example.com/a.jpg", "http://example.com/icon.png"])
+
+    assert entry["name"] == "abc.jpg"  # the same canonical url
+    assert cache.is_fresh(entry)
+    assert cache.validators(entry) == {"If-None-Match": '"1"'}
+    assert cache.is_done(entry, "images/cat")
+    assert not cache.is_done(entry, "images/kitten")
+    assert cache.is_done(icon, "images/kitten")
+    assert 0 < cache.redis.ttl(cache.key("http://example.com/a.jpg")) <= 3600
@@ -0,0 +1,14 @@
+from url_utils import canonicalize_url, get_host
+
+
+def test_canonicalize_url():
+    assert canonicalize_url("HTTP://Example.COM") == "http://example.com/"
+    assert canonicalize_url("https://example.com:443/a/b/#part") == "https://example.com/a/b"
+    assert canonicalize_url("http://example.com:8080/a") == "http://example.com:8080/a"
+    assert canonicalize_url("http://example.com/?z=1&a=2&utm_medium=mail&fbclid=1") == "http://example.com/?a=2&z=1"
+    assert canonicalize_url("javascript:void(0)") is None
+    assert canonicalize_url("mailto:someone@example.com") is None
+
+
+def test_get_host():
+    assert get_host("https://Images.Example.com/a.png") == "images.example.com"
@@ -0,0 +1,105 @@
+import time
+import hashlib
+import logging
+
+import redis
+
+from url_utils import canonicalize_url
+
+logger = logging.getLogger(__name__)
+
+STORED = "stored"  # image is saved, entry keeps its blob name
+REJECTED = "rejected"  # invalid, too small or duplicate image which is not saved
+
+
+class ImageUrlCache:
+    """
+    Remembers what was downloaded from an image url (canonical url -> status, blob name,
+    ETag/Last-Modified and keyword folders it is linked to), so a url found again on other
+    pages costs one Redis lookup instead of a download. Entries expire after `ttl` seconds,
+    after `revalidate_after` seconds the image is requested again with validators.
+    """
+
+    def __init__(self, redis_client: redis.Redis, ttl: int, revalidate_after: int):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.revalidate_after = revalidate_after
+
+    @staticmethod
+    def key(url: str) -> str:
+        canonical_url = canonicalize_url(url) or url
+        return "image_url:" + hashlib.sha1(canonical_url.encode()).hexdigest()
+
+    def get_many(self, urls: list[str]) -> list[dict[str, str] | None]:
+        """Returns entry for every url, None if url is unknown (or Redis is not available)."""
+        pipe = self.redis.pipeline(transaction=False)
+        for url in urls:
+            pipe.hgetall(self.key(url))
+        try:
+            entries = pipe.execute()
+        except redis.RedisError as ex:
+            logger.error(f"Error while reading image url cache: {str(ex)}")
+            return [None] * len(urls)
+        return [
+            {field.decode(): value.decode() for field, value in entry.items()} or None
+            for entry in entries
+        ]
+
+    def is_fresh(self, entry: dict[str, str]) -> bool:
+        return time.time() - float(entry.get("checked_at", 0)) < self.revalidate_after
+
+    @staticmethod
+    def is_done(entry: dict[str, str] | None, save_dir: str) -> bool:
+        """Nothing to download for save_dir: image was rejected or is already in this folder."""
+        if entry is None:
+            return False
+        return entry.get("status") == REJECTED or f"dir:{save_dir}" in entry
+
+    @staticmethod
+    def validators(entry: dict[str, str] | None) -> dict[str, str] | None:
+        """Headers of conditional request for a stale entry, None if it can't be revalidated."""
+        if entry is None:
+            return None
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers or None
+
+    def set(
+        self,
+        url: str,
+        status: str,
+        image_name: str = "",
+        etag: str = "",
+        last_modified: str = "",
+        save_dir: str = "",
+    ):
+        mapping = {
+            "status": status,
+            "name": image_name,
+            "etag": etag,
+            "last_modified": last_modified,
+            "checked_at": time.time(),
+        }
+        if save_dir:
+            mapping[f"dir:{save_dir}"] = 1
+        self._write(url, mapping)
+
+    def touch(self, url: str):
+        """Image was not modified, entry is fresh again."""
+        self._write(url, {"checked_at": time.time()})
+
+    def add_dir(self, url: str, save_dir: str):
+        self._write(url, {f"dir:{save_dir}": 1})
+
+    def _write(self, url: str, mapping: dict):
+        key = self.key(url)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hset(key, mapping=mapping)
+        pipe.expire(key, self.ttl)
+        try:
+            pipe.execute()
+        except redis.RedisError as ex:
+            logger.error(f"Error while saving image url cache: {str(ex)}")
@@ -0,0 +1,216 @@
+import os
+import time
+import struct
+import hashlib
+import zlib
+from collections import OrderedDict
+from collections.abc import Iterator
+
+CHUNK_SIZE = 1024 * 1024
+ZIP64_LIMIT = 0xFFFFFFFF
+VERSION = 45  # 4.5: zip64
+MADE_BY = (3 << 8) | VERSION  # unix, file mode in external attributes
+FLAGS = 0x08 | 0x800  # crc and sizes in data descriptor, utf-8 names
+
+# crc32 of files, so a resumed download doesn't read files before the range twice
+_crc_cache: OrderedDict[tuple[str, int, float], int] = OrderedDict()
+CRC_CACHE_SIZE = 100_000
+
+
+class ZipEntry:
+    def __init__(self, path: str, arcname: str, size: int, mtime: float):
+        self.path = path
+        self.arcname = arcname
+        self.name = arcname.encode()
+        self.size = size
+        self.mtime = mtime
+        self.zip64 = size >= ZIP64_LIMIT
+        self.offset = 0  # of local header in archive
+
+    @property
+    def header_size(self) -> int:
+        return 30 + len(self.name) + (20 if self.zip64 else 0)
+
+    @property
+    def descriptor_size(self) -> int:
+        return 24 if self.zip64 else 16
+
+
+def _dos_time(mtime: float) -> tuple[int, int]:
+    t = time.localtime(max(mtime, 315532800))  # zip dates start in 1980
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+def file_crc32(entry: ZipEntry) -> int:
+    key = (entry.path, entry.size, entry.mtime)
+    if key in _crc_cache:
+        _crc_cache.move_to_end(key)
+        return _crc_cache[key]
+    crc = 0
+    with open(entry.path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            crc = zlib.crc32(chunk, crc)
+    _remember_crc(entry, crc)
+    return crc
+
+
+def _remember_crc(entry: ZipEntry, crc: int):
+    _crc_cache[(entry.path, entry.size, entry.mtime)] = crc
+    if len(_crc_cache) > CRC_CACHE_SIZE:
+        _crc_cache.popitem(last=False)
+
+
+class ZipStream:
+    """
+    Zip archive of files generated on the fly, without temporary file.
+    Files are stored without compression (images are already compressed),
+    so the archive size and the offset of every byte are known before reading
+    any file: the archive can be sent with Content-Length and from any offset (HTTP Range).
+    CRC of a file goes to the data descriptor after its data, zip64 records are used for big archives.
+    """
+
+    def __init__(self, files: list[tuple[str, str]]):
+        """files: (path, name in archive), missing files are skipped."""
+        self.entries: list[ZipEntry] = []
+        for path, arcname in files:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            self.entries.append(ZipEntry(path, arcname, stat.st_size, stat.st_mtime))
+
+        offset = 0
+        for entry in self.entries:
+            entry.offset = offset
+            offset += entry.header_size + entry.size + entry.descriptor_size
+        self.cd_offset = offset
+        self.cd_size = sum(self._central_header_size(entry) for entry in self.entries)
+        self.zip64 = (
+            len(self.entries) >= 0xFFFF or self.cd_offset >= ZIP64_LIMIT or self.cd_size >= ZIP64_LIMIT
+        )
+        self.size = self.cd_offset + self.cd_size + (56 + 20 if self.zip64 else 0) + 22
+
+    @classmethod
+    def from_dir(cls, root: str) -> "ZipStream":
+        files = []
+        for dir_path, dir_names, file_names in os.walk(root):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                path = os.path.join(dir_path, file_name)
+                files.append((path, os.path.relpath(path, root).replace(os.sep, "/")))
+        return cls(files)
+
+    @property
+    def etag(self) -> str:
+        """The same files give the same archive, a download is resumed only if ETag didn't change."""
+        digest = hashlib.sha1()
+        for entry in self.entries:
+            digest.update(f"{entry.arcname}|{entry.size}|{entry.mtime}\n".encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def _central_extra(entry: ZipEntry) -> bytes:
+        fields = b""
+        if entry.zip64:
+            fields += struct.pack("<QQ", entry.size, entry.size)
+        if entry.offset >= ZIP64_LIMIT:
+            fields += struct.pack("<Q", entry.offset)
+        return struct.pack("<HH", 0x0001, len(fields)) + fields if fields else b""
+
+    def _central_header_size(self, entry: ZipEntry) -> int:
+        return 46 + len(entry.name) + len(self._central_extra(entry))
+
+    @staticmethod
+    def _local_header(entry: ZipEntry) -> bytes:
+        dos_time, dos_date = _dos_time(entry.mtime)
+        size = ZIP64_LIMIT if entry.zip64 else entry.size
+        extra = struct.pack("<HHQQ", 0x0001, 16, entry.size, entry.size) if entry.zip64 else b""
+        return struct.pack(
+            "<IHHHHHIIIHH", 0x04034B50, VERSION, FLAGS, 0, dos_time, dos_date,
+            0, size, size, len(entry.name), len(extra),
+        ) + entry.name + extra
+
+    @staticmethod
+    def _descriptor(entry: ZipEntry, crc: int) -> bytes:
+        if entry.zip64:
+            return struct.pack("<IIQQ", 0x08074B50, crc, entry.size, entry.size)
+        return struct.pack("<IIII", 0x08074B50, crc, entry.size, entry.size)
+
+    def _central_header(self, entry: ZipEntry, crc: int) -> bytes:
+        dos_time, dos_date = _dos_time(entry.mtime)
+        extra = self._central_extra(entry)
+        size = ZIP64_LIMIT if entry.zip64 else entry.size
+        offset = min(entry.offset, ZIP64_LIMIT)
+        return struct.pack(
+            "<IHHHHHHIIIHHHHHII", 0x02014B50, MADE_BY, VERSION, FLAGS, 0, dos_time, dos_date,
+            crc, size, size, len(entry.name), len(extra), 0, 0, 0, 0o100644 << 16, offset,
+        ) + entry.name + extra
+
+    def _end_records(self) -> bytes:
+        count = len(self.entries)
+        records = b""
+        if self.zip64:
+            zip64_end_offset = self.cd_offset + self.cd_size
+            records += struct.pack(
+                "<IQHHIIQQQQ", 0x06064B50, 44, VERSION, VERSION, 0, 0, count, count, self.cd_size, self.cd_offset
+            )
+            records += struct.pack("<IIQI", 0x07064B50, 0, zip64_end_offset, 1)
+        records += struct.pack(
+            "<IHHHHIIH", 0x06054B50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+            min(self.cd_size, ZIP64_LIMIT), min(self.cd_offset, ZIP64_LIMIT), 0,
+        )
+        return records
+
+    def _file_data(self, entry: ZipEntry, start: int, crcs: dict[str, int]) -> Iterator[bytes]:
+        """File data from `start`, CRC is calculated on the way if the whole file is read."""
+        crc = 0
+        remaining = entry.size - start
+        with open(entry.path, "rb") as f:
+            f.seek(start)
+            while remaining > 0 and (chunk := f.read(min(CHUNK_SIZE, remaining))):
+                remaining -= len(chunk)
+                if start == 0:
+                    crc = zlib.crc32(chunk, crc)
+                yield chunk
+        if remaining > 0:
+            raise OSError(f"File changed while archiving: {entry.path}")
+        if start == 0:
+            crcs[entry.arcname] = crc
+            _remember_crc(entry, crc)
+
+    def _segments(self, crcs: dict[str, int]) -> Iterator[tuple[int, object]]:
+        """(size, bytes or callable(start) -> chunks) of the archive in order."""
+        def crc(entry: ZipEntry) -> int:
+            return crcs[entry.arcname] if entry.arcname in crcs else file_crc32(entry)
+
+        for entry in self.entries:
+            yield entry.header_size, self._local_header(entry)
+            yield entry.size, lambda start, entry=entry: self._file_data(entry, start, crcs)
+            yield entry.descriptor_size, lambda start, entry=entry: [self._descriptor(entry, crc(entry))[start:]]
+        for entry in self.entries:
+            yield self._central_header_size(entry), lambda start, entry=entry: [
+                self._central_header(entry, crc(entry))[start:]
+            ]
+        yield self.size - self.cd_offset - self.cd_size, lambda start: [self._end_records()[start:]]
+
+    def iter_bytes(self, start: int = 0, end: int | None = None) -> Iterator[bytes]:
+        """Archive bytes from start to end (inclusive), as in HTTP Range."""
+        end = self.size - 1 if end is None else min(end, self.size - 1)
+        remaining = end - start + 1
+        crcs: dict[str, int] = {}
+        position = 0
+        for size, data in self._segments(crcs):
+            if remaining <= 0:
+                break
+            if position + size <= start:
+                position += size
+                continue
+            offset = max(start - position, 0)
+            chunks = [data[offset:]] if isinstance(data, bytes) else data(offset)
+            for chunk in chunks:
+                chunk = chunk[:remaining]
+                remaining -= len(chunk)
+                yield chunk
+                if remaining <= 0:
+                    break
+            position += size